@@ -1,21 +1,26 @@
 import json
 import os
 import re
+import subprocess
 from typing import List, Dict, Tuple
-import requests
 import time
 from dotenv import load_dotenv
+from commit_store import get_commit_store
+from token_pool import get_token_pool
+from git_mirror import ensure_mirror
+from git_groundtruth import compute_ground_truth_for_issues
+from journal import IssueJournal
 
 load_dotenv()
 
-GITHUB_TOKEN = os.getenv("MY_GITHUB_TOKEN")
-
 HEADERS = {
-    "Authorization": f"Bearer {GITHUB_TOKEN}",
     "Accept": "application/vnd.github+json"
 }
 
-folder = "thunderbird"  # 示例仓库
+folder = os.getenv("VFLOC_REPO", "thunderbird")  # 示例仓库，pipeline.py运行时通过环境变量传入
+
+# ground truth计算方式：'local_git' 使用本地bare镜像（git diff-tree），'rest' 逐个commit请求GitHub API
+GROUNDTRUTH_BACKEND = 'local_git'
 
 folder_to_name = {
     'All-Hands-AI': 'All-Hands-AI',
@@ -95,7 +100,7 @@ def make_api_request_with_retry(url: str, max_retries: int = 3):
     for attempt in range(max_retries):
         try:
             print(f"尝试第 {attempt + 1} 次请求: {url}")
-            response = requests.get(url, headers=HEADERS, timeout=30)
+            response = get_token_pool().get(url, headers=HEADERS, timeout=30)
             return response
 
         except Exception as e:
@@ -111,87 +116,57 @@ def make_api_request_with_retry(url: str, max_retries: int = 3):
     return None
 
 
+# commit对象缓存，与generate_operation_folders.py共用，同一SHA只请求一次API
+COMMIT_STORE = get_commit_store()
+
+
 def get_commit_files(owner: str, repo: str, commit_hash: str) -> Dict[str, List[str]]:
-    """获取指定commit修改的文件列表，按状态分类"""
+    """获取指定commit修改的文件列表，按状态分类；请求失败时结果中 failed 为True"""
     empty_result = {'modified': [], 'added': [], 'removed': [], 'added_paths': []}
 
-    try:
-        api_url = f"https://api.github.com/repos/{owner}/{repo}/commits/{commit_hash}"
-        print(f"正在获取commit {commit_hash[:7]} 的文件信息...")
-
-        response = make_api_request_with_retry(api_url)
-        if response is None:
-            print(f"错误: 无法获取commit {commit_hash[:7]} 的信息，所有重试都失败")
-            return empty_result
-
-        if response.status_code == 200:
-            commit_data = response.json()
-            result = {
-                'modified': [],
-                'added': [],
-                'removed': [],
-                'added_paths': []
-            }
-
-            if 'files' in commit_data:
-                for file_info in commit_data['files']:
-                    filename = file_info['filename']
-                    status = file_info['status']
-
-                    # 只处理有效的源代码文件
-                    if not is_valid_file(filename):
-                        continue
-
-                    if status == 'modified':
-                        result['modified'].append(filename)
-                    elif status == 'added':
-                        result['added'].append(filename)
-                        # 提取新增文件的路径（目录部分）
-                        file_path = os.path.dirname(filename)
-                        if file_path and file_path not in result['added_paths']:
-                            result['added_paths'].append(file_path)
-                    elif status == 'removed':
-                        result['removed'].append(filename)
-
-                return result
-            else:
-                print(f"警告: commit {commit_hash[:7]} 没有文件变更信息")
-                return empty_result
+    commit_data = COMMIT_STORE.get(owner, repo, commit_hash, make_api_request_with_retry)
+    if commit_data is None:
+        return dict(empty_result, failed=True)
 
-        else:
-            print(f"错误: 获取commit {commit_hash[:7]} 失败，HTTP状态码: {response.status_code}")
-            return empty_result
-
-    except Exception as e:
-        print(f"错误: 获取commit {commit_hash[:7]} 文件列表时发生未知错误: {type(e).__name__}: {e}")
+    if not commit_data['files']:
+        print(f"警告: commit {commit_hash[:7]} 没有文件变更信息")
         return empty_result
 
+    result = {
+        'modified': [],
+        'added': [],
+        'removed': [],
+        'added_paths': []
+    }
 
-def get_commit_time(commit_hash: str, owner: str, repo: str) -> int:
-    """获取commit的时间戳"""
-    try:
-        api_url = f"https://api.github.com/repos/{owner}/{repo}/commits/{commit_hash}"
+    for file_info in commit_data['files']:
+        filename = file_info['filename']
+        status = file_info['status']
 
-        response = make_api_request_with_retry(api_url)
-        if response is None:
-            print(f"错误: 无法获取commit {commit_hash[:7]} 的时间，所有重试都失败")
-            return 0
+        # 只处理有效的源代码文件
+        if not is_valid_file(filename):
+            continue
 
-        if response.status_code == 200:
-            commit_data = response.json()
+        if status == 'modified':
+            result['modified'].append(filename)
+        elif status == 'added':
+            result['added'].append(filename)
+            # 提取新增文件的路径（目录部分）
+            file_path = os.path.dirname(filename)
+            if file_path and file_path not in result['added_paths']:
+                result['added_paths'].append(file_path)
+        elif status == 'removed':
+            result['removed'].append(filename)
 
-            if 'commit' in commit_data and 'author' in commit_data['commit'] and 'date' in commit_data['commit']['author']:
-                commit_time = commit_data['commit']['author']['date']
-                from datetime import datetime
-                dt = datetime.fromisoformat(commit_time.replace('Z', '+00:00'))
-                timestamp = int(dt.timestamp())
-                return timestamp
+    return result
 
-        return 0
 
-    except Exception as e:
-        print(f"错误: 获取commit时间时发生未知错误 (commit: {commit_hash[:7]}): {type(e).__name__}: {e}")
+def get_commit_time(commit_hash: str, owner: str, repo: str) -> int:
+    """获取commit的时间戳"""
+    commit_data = COMMIT_STORE.get(owner, repo, commit_hash, make_api_request_with_retry)
+    if commit_data is None:
         return 0
+    return commit_data['author_date']
 
 
 def process_and_update_json(input_file_path: str, output_file_path: str):
@@ -203,10 +178,34 @@ def process_and_update_json(input_file_path: str, output_file_path: str):
 
     print(f"开始处理 {len(issues_data)} 个issues...")
 
-    updated_issues = []
+    # 每处理完一个issue就写入日志，中断后重新运行会跳过已处理的issue
+    journal = IssueJournal(output_file_path)
+    issue_keys = [issue.get('number', idx) for idx, issue in enumerate(issues_data)]
+    pending_issues = [issue for key, issue in zip(issue_keys, issues_data) if not journal.done(key, issue)]
+
+    # 本地镜像后端：按仓库分组，一次性计算所有未处理issue的ground truth；
+    # 镜像无法clone或fetch的仓库、有commit无法从镜像获取的issue改用REST API计算
+    local_results = {}
+    if GROUNDTRUTH_BACKEND == 'local_git':
+        issues_by_repo = {}
+        for issue in pending_issues:
+            owner, repo, _ = extract_repo_info(issue['html_url'])
+            if owner and repo:
+                issues_by_repo.setdefault((owner, repo), []).append(issue)
+        for (owner, repo), repo_issues in issues_by_repo.items():
+            try:
+                mirror = ensure_mirror(owner, repo, update=True)
+            except subprocess.CalledProcessError as e:
+                print(f"无法准备 {owner}/{repo} 的镜像，改用REST API计算: {(e.stderr or str(e)).strip()}")
+                continue
+            for number, result in compute_ground_truth_for_issues(mirror, repo_issues, is_valid_file).items():
+                local_results[(owner, repo, number)] = result
 
     for idx, issue in enumerate(issues_data, 1):
         print(f"处理第 {idx} 个issue: {issue['title']} (ID: {issue.get('number', 'N/A')})")
+        if journal.done(issue_keys[idx - 1], issue):
+            print("已在日志中，跳过")
+            continue
 
 
         updated_issue = issue.copy()
@@ -216,42 +215,49 @@ def process_and_update_json(input_file_path: str, output_file_path: str):
         owner, repo, issue_number = extract_repo_info(issue['html_url'])
         if not owner or not repo:
             print(f"无法解析仓库信息: {issue['html_url']}")
-            updated_issues.append(updated_issue)
+            journal.append(issue_keys[idx - 1], issue, updated_issue)
             continue
 
         # 计算modified_files和add_paths
         commits = issue.get('commits', [])
+        fetch_failed = False
         if commits:
             print(f"处理 {len(commits)} 个commits...")
 
-            all_modified_files = set()
-            all_added_paths = set()
-            added_files_tracker = set()
-
-            # 按时间顺序处理commits
-            sorted_commits = sorted(commits, key=lambda c: get_commit_time(c, owner, repo))
-
-            for commit in sorted_commits:
-                commit_files = get_commit_files(owner, repo, commit)
-
-                # 处理新增文件
-                for added_file in commit_files['added']:
-                    added_files_tracker.add(added_file)
-                    file_path = os.path.dirname(added_file)
-                    if file_path:
-                        all_added_paths.add(file_path)
-
-                # 处理修改的文件 - 但排除之前新增过的文件
-                for modified_file in commit_files['modified']:
-                    if modified_file not in added_files_tracker:
-                        all_modified_files.add(modified_file)
-
-                # 处理删除的文件 - 但排除之前新增过的文件
-                for removed_file in commit_files['removed']:
-                    if removed_file not in added_files_tracker:
-                        all_modified_files.add(removed_file)
-
-                time.sleep(0.5)  # 避免API请求过快
+            local_result = local_results.get((owner, repo, str(issue.get('number'))))
+            if local_result is not None and local_result[2]:
+                print(f"镜像中无法获取 {len(local_result[2])} 个commit，改用REST API计算")
+                local_result = None
+            if local_result is not None:
+                all_modified_files, all_added_paths, _ = local_result
+            else:
+                all_modified_files = set()
+                all_added_paths = set()
+                added_files_tracker = set()
+
+                # 按时间顺序处理commits
+                sorted_commits = sorted(commits, key=lambda c: get_commit_time(c, owner, repo))
+
+                for commit in sorted_commits:
+                    commit_files = get_commit_files(owner, repo, commit)
+                    fetch_failed = fetch_failed or commit_files.get('failed', False)
+
+                    # 处理新增文件
+                    for added_file in commit_files['added']:
+                        added_files_tracker.add(added_file)
+                        file_path = os.path.dirname(added_file)
+                        if file_path:
+                            all_added_paths.add(file_path)
+
+                    # 处理修改的文件 - 但排除之前新增过的文件
+                    for modified_file in commit_files['modified']:
+                        if modified_file not in added_files_tracker:
+                            all_modified_files.add(modified_file)
+
+                    # 处理删除的文件 - 但排除之前新增过的文件
+                    for removed_file in commit_files['removed']:
+                        if removed_file not in added_files_tracker:
+                            all_modified_files.add(removed_file)
 
             # 添加到issue数据中
             updated_issue['modified_files'] = sorted(list(all_modified_files))
@@ -263,12 +269,13 @@ def process_and_update_json(input_file_path: str, output_file_path: str):
             updated_issue['modified_files'] = []
             updated_issue['added_paths'] = []
 
-        updated_issues.append(updated_issue)
+        # 有commit请求失败时结果不完整，续跑时重新处理
+        journal.append(issue_keys[idx - 1], issue, updated_issue, complete=not fetch_failed)
         print("-" * 50)
 
-    # 保存更新后的数据
-    with open(output_file_path, 'w', encoding='utf-8') as f:
-        json.dump(updated_issues, f, indent=2, ensure_ascii=False)
+    # 由日志按输入顺序生成更新后的数据
+    journal.close()
+    updated_issues = journal.compact(issue_keys)
 
     print(f"处理完成！更新后的数据已保存到: {output_file_path}")
 
@@ -286,8 +293,10 @@ def process_and_update_json(input_file_path: str, output_file_path: str):
 
 def main():
     # 配置路径
-    input_file_path = f"../issue_results/{folder}/{folder_to_name[folder]}_issues_with_code_checked_again.json"
-    output_file_path = f"../issue_results/{folder}/{folder_to_name[folder]}_issues_with_code_updated.json"
+    input_file_path = os.getenv("VFLOC_INPUT",
+                                f"../issue_results/{folder}/{folder_to_name[folder]}_issues_with_code_checked_again.json")
+    output_file_path = os.getenv("VFLOC_OUTPUT",
+                                 f"../issue_results/{folder}/{folder_to_name[folder]}_issues_with_code_updated.json")
 
     if not os.path.exists(input_file_path):
         print(f"错误: 输入文件不存在 {input_file_path}")
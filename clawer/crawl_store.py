@@ -0,0 +1,135 @@
+"""
+爬取结果的SQLite存储
+
+issue.py 以前每100个issue就把整个Excel工作簿重写一遍，并额外写一个 *_stats_progress_{n}.json，
+检查点的开销随爬取规模线性增长。这里改为每个issue到达时按id upsert一行，
+统计数据只保留一行并原地更新，增量同步水位线和断点进度也存放在同一个数据库中。
+评论扫描得到的每条评论的图片数也保存在这里，按issue汇总后与issue列表关联。
+Excel只在爬取结束时按需导出一次。
+"""
+import json
+import os
+import sqlite3
+from typing import Dict, List, Optional
+
+from openpyxl import Workbook
+from openpyxl.utils.exceptions import IllegalCharacterError
+from log_config import logger
+
+# Excel导出时的列顺序
+ISSUE_COLUMNS = [
+    'id', 'number', 'html_url', 'type', 'labels', 'created_date', 'updated_date', 'resolved_date', 'title', 'body',
+    'state', 'comments', 'state_reason', 'repository_url', 'labels_url', 'comments_url', 'events_url',
+    'user_login', 'user_url', 'assignees', 'milestone_title', 'milestone_description', 'pull_request_url',
+    'body_image_count', 'comment_image_count', 'total_image_count'
+]
+
+
+class CrawlStore:
+    """单个仓库的爬取结果存储"""
+
+    def __init__(self, repo_name: str, db_path: Optional[str] = None):
+        if db_path is None:
+            db_path = f'../issue_results/{repo_name.replace("/", "_")}_crawl.sqlite3'
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self.repo_name = repo_name
+        self.db_path = db_path
+        self._conn = sqlite3.connect(db_path)
+        # WAL模式下每个issue提交一次的成本很低
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS issues (
+                id INTEGER PRIMARY KEY,
+                number INTEGER NOT NULL,
+                updated_date TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS stats (
+                repo_name TEXT PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS comment_images (
+                comment_id INTEGER PRIMARY KEY,
+                issue_number INTEGER NOT NULL,
+                image_count INTEGER NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def upsert_issue(self, issue_data: Dict):
+        """按issue id插入或替换一行"""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO issues (id, number, updated_date, data) VALUES (?, ?, ?, ?)",
+            (issue_data['id'], issue_data['number'], issue_data.get('updated_date'),
+             json.dumps(issue_data, ensure_ascii=False))
+        )
+        self._conn.commit()
+
+    def delete_issue(self, issue_id: int):
+        """删除一个issue（例如重新爬取后不再满足筛选条件）"""
+        self._conn.execute("DELETE FROM issues WHERE id = ?", (issue_id,))
+        self._conn.commit()
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM issues").fetchone()[0]
+
+    def all_issues(self) -> List[Dict]:
+        """按issue编号从大到小返回所有issue"""
+        rows = self._conn.execute("SELECT data FROM issues ORDER BY number DESC").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def save_stats(self, stats: Dict):
+        """保存统计数据（单行原地更新）"""
+        stats_copy = dict(stats)
+        stats_copy['all_labels'] = dict(stats_copy['all_labels'])
+        self._conn.execute("INSERT OR REPLACE INTO stats VALUES (?, ?)",
+                           (self.repo_name, json.dumps(stats_copy, ensure_ascii=False)))
+        self._conn.commit()
+
+    def upsert_comment_images(self, rows: List[tuple]):
+        """批量写入评论的图片数，rows为 (comment_id, issue_number, image_count)"""
+        self._conn.executemany("INSERT OR REPLACE INTO comment_images VALUES (?, ?, ?)", rows)
+        self._conn.commit()
+
+    def comment_image_counts(self) -> Dict[int, int]:
+        """按issue编号汇总评论中的图片数"""
+        rows = self._conn.execute(
+            "SELECT issue_number, SUM(image_count) FROM comment_images GROUP BY issue_number"
+        ).fetchall()
+        return {number: count for number, count in rows}
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, None if value is None else str(value)))
+        self._conn.commit()
+
+    def export_excel(self, excel_path: str) -> int:
+        """把所有issue导出到Excel，含非法字符的行跳过，返回写入的行数"""
+        wb = Workbook()
+        ws = wb.active
+        ws.append(ISSUE_COLUMNS)
+        row_num = 2
+        for issue_data in self.all_issues():
+            try:
+                for col_num, column in enumerate(ISSUE_COLUMNS, start=1):
+                    ws.cell(row=row_num, column=col_num, value=issue_data.get(column))
+            except IllegalCharacterError:
+                # 写了一半的行会被下一行覆盖
+                logger.warning(f"导出issue #{issue_data['number']} 时遇到非法字符，已跳过。")
+                continue
+            row_num += 1
+        if row_num <= ws.max_row:
+            ws.delete_rows(row_num, ws.max_row - row_num + 1)
+        wb.save(excel_path)
+        return row_num - 2
+
+    def close(self):
+        self._conn.close()
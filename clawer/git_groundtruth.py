@@ -0,0 +1,79 @@
+"""
+基于本地bare镜像计算ground truth（modified_files / added_paths）
+
+与 add_groundtruth.py 中基于REST API的实现结果一致：按作者时间顺序回放每个commit的
+added / modified / removed 变更，重命名的文件忽略，之前新增过的文件不计入modified。
+区别在于文件变更来自 `git diff-tree`，不会像REST接口那样截断过长的文件列表，也不消耗API额度。
+"""
+import os
+from typing import Callable, Dict, List, Tuple
+
+from git_mirror import diff_commits, ensure_commits, get_commit_info
+
+# git diff-tree 的状态字母与 REST API status 的对应关系
+GIT_STATUS_TO_REST = {
+    'A': 'added',
+    'M': 'modified',
+    'D': 'removed',
+    'R': 'renamed',
+    'C': 'copied',
+    'T': 'changed'
+}
+
+
+def _replay_commits(commits: List[str], info: Dict, changes: Dict,
+                    is_valid_file: Callable[[str], bool]) -> Tuple[List[str], List[str]]:
+    """按作者时间顺序回放commit的文件变更"""
+    all_modified_files = set()
+    all_added_paths = set()
+    added_files_tracker = set()
+
+    # 按时间顺序处理commits（sorted是稳定排序，时间相同时保持原顺序）
+    for commit in sorted(commits, key=lambda c: info[c][0]):
+        for status, filename, _ in changes.get(commit, []):
+            if not is_valid_file(filename):
+                continue
+            rest_status = GIT_STATUS_TO_REST.get(status)
+
+            if rest_status == 'added':
+                added_files_tracker.add(filename)
+                file_path = os.path.dirname(filename)
+                if file_path:
+                    all_added_paths.add(file_path)
+            elif rest_status in ('modified', 'removed'):
+                # 排除之前新增过的文件
+                if filename not in added_files_tracker:
+                    all_modified_files.add(filename)
+            # 忽略 'renamed' 等其他状态的文件
+
+    return sorted(all_modified_files), sorted(all_added_paths)
+
+
+def compute_ground_truth_for_issues(mirror: str, issues: List[Dict],
+                                    is_valid_file: Callable[[str], bool]
+                                    ) -> Dict[str, Tuple[List[str], List[str], List[str]]]:
+    """
+    一次性计算同一仓库中多个issue的ground truth，所有commit共用一次git log和一次diff-tree调用。
+    is_valid_file: 过滤有效源代码文件的函数（与REST实现使用同一个）
+    返回 {issue_number: (modified_files, added_paths, missing_commits)}，modified_files和added_paths均已排序；
+    missing_commits为镜像中无法获取、没有参与回放的commit，不为空时结果不完整，由调用方决定如何处理。
+    """
+    all_commits = list(dict.fromkeys(c for issue in issues for c in issue.get('commits', [])))
+    missing = set(ensure_commits(mirror, all_commits))
+    available = [c for c in all_commits if c not in missing]
+    info = get_commit_info(mirror, available)
+    changes = diff_commits(mirror, {c: info[c][1] for c in available})
+
+    results = {}
+    for issue in issues:
+        commits = [c for c in issue.get('commits', []) if c in info]
+        missing_commits = [c for c in issue.get('commits', []) if c not in info]
+        modified_files, added_paths = _replay_commits(commits, info, changes, is_valid_file)
+        results[str(issue.get('number'))] = (modified_files, added_paths, missing_commits)
+    return results
+
+
+def compute_ground_truth(mirror: str, commits: List[str],
+                         is_valid_file: Callable[[str], bool]) -> Tuple[List[str], List[str], List[str]]:
+    """计算一组commit的ground truth，返回 (modified_files, added_paths, missing_commits)"""
+    return compute_ground_truth_for_issues(mirror, [{'number': 0, 'commits': commits}], is_valid_file)['0']
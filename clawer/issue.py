@@ -1,14 +1,14 @@
 import os
 import time
 import json
-import pandas as pd
-import re
 from collections import defaultdict
-from dotenv import load_dotenv
+from datetime import datetime
 from github import Github, Auth, GithubException, RateLimitExceededException
-from openpyxl import Workbook
-from openpyxl.utils.exceptions import IllegalCharacterError
 from log_config import logger
+from crawl_store import CrawlStore
+from image_scanner import count_images
+from issue_predicate import COMPLETED_WITH_IMAGES
+from token_pool import get_token_pool
 
 
 # 设置基本的日志输出
@@ -23,70 +23,108 @@ class SimpleLogger:
         print(f"[ERROR] {msg}")
 
 
-def write_row_to_excel(_ws, _row_data, _row_num):
-    """
-    将一行数据写入Excel工作表中的指定行号，如果遇到非法字符错误则跳过该行。
-    """
-    try:
-        for col_num, value in enumerate(_row_data, start=1):
-            _ws.cell(row=_row_num, column=col_num, value=value)
-    except IllegalCharacterError:
-        logger.warning(f"在写入第 {_row_num} 行时遇到非法字符，已跳过。")
-        return False
-    return True
-
-
-def save_progress(repo_name, last_issue_number):
-    """保存处理进度到文件"""
-    progress_file = f'../issue_results/{repo_name.replace("/", "_")}_progress.json'
-    with open(progress_file, 'w') as f:
-        json.dump({"last_issue_number": last_issue_number}, f)
-
-
-def load_progress(repo_name):
-    """加载保存的进度"""
-    progress_file = f'../issue_results/{repo_name.replace("/", "_")}_progress.json'
-    if os.path.exists(progress_file):
-        with open(progress_file, 'r') as f:
-            data = json.load(f)
-            return data.get("last_issue_number", 0)
-    return 0
+def compute_stats(issues_data):
+    """根据完整的issue列表重新计算统计数据（增量同步后使用）"""
+    stats = {
+        'total_issues': 0,
+        'total_prs': 0,
+        'pr_with_images': 0,
+        'pr_with_images_b': 0,
+        'all_labels': defaultdict(int),
+        'issues_with_images': 0,
+        'issues_with_images_b': 0,
+        'total_images': 0,
+        'total_images_b': 0
+    }
+    for issue_data in issues_data:
+        is_pr = issue_data['type'] == 'pull_request'
+        stats['total_issues'] += 1
+        if is_pr:
+            stats['total_prs'] += 1
+        labels = issue_data['labels'] if isinstance(issue_data['labels'], str) else ''
+        for label in filter(None, labels.split(',')):
+            stats['all_labels'][label] += 1
+        total_images_in_issue = int(issue_data['total_image_count'])
+        if int(issue_data['body_image_count']) > 0:
+            stats['issues_with_images_b'] += 1
+            stats['total_images_b'] += total_images_in_issue
+            if is_pr:
+                stats['pr_with_images_b'] += 1
+        if total_images_in_issue > 0:
+            stats['issues_with_images'] += 1
+            stats['total_images'] += total_images_in_issue
+            if is_pr:
+                stats['pr_with_images'] += 1
+    return stats
 
 
-def analyze_images_in_content(content):
+def sweep_comment_images(repo, store):
     """
-    分析内容中的图片链接
+    通过仓库级评论列表 /issues/comments?since= 一次性统计所有评论中的图片数（每页100条），
+    替代逐个issue调用 get_comments()。按updated升序遍历并定期推进水位线，中断后从水位线继续。
+    返回 {issue_number: comment_image_count}
     """
-    if not content:
-        return {'markdown_images': [], 'html_images': []}
-
-    # 匹配markdown图片语法: ![alt](url)
-    image_pattern = r'!\[([^\]]*)\]\(([^)]+)\)'
-    images = re.findall(image_pattern, content)
-
-    # 匹配HTML img标签
-    html_img_pattern = r'<img[^>]*src="([^"]*)"[^>]*>'
-    html_images = re.findall(html_img_pattern, content)
-
-
-    return {
-        'markdown_images': images,  # [(alt_text, url), ...]
-        'html_images': html_images,  # [url, ...]
-    }
-
-
-def get_issue_to_excel_with_analysis(repo_name):
+    watermark = store.get_meta('comments_updated_at')
+    query = {'sort': 'updated', 'direction': 'asc'}
+    if watermark:
+        query['since'] = datetime.fromisoformat(watermark)
+        logger.info(f"扫描 {watermark} 之后更新的评论...")
+    else:
+        logger.info("扫描仓库的全部评论...")
+
+    rows = []
+    swept = 0
+    max_updated_at = None
+    for comment in repo.get_issues_comments(**query):
+        image_count = count_images(comment.body)
+        issue_number = int(comment.issue_url.rstrip('/').rsplit('/', 1)[-1])
+        rows.append((comment.id, issue_number, image_count))
+        swept += 1
+        max_updated_at = comment.updated_at
+        if len(rows) >= 100:
+            store.upsert_comment_images(rows)
+            store.set_meta('comments_updated_at', max_updated_at.isoformat())
+            rows = []
+    if rows:
+        store.upsert_comment_images(rows)
+    if max_updated_at is not None:
+        store.set_meta('comments_updated_at', max_updated_at.isoformat())
+
+    logger.info(f"评论扫描完成，本次扫描 {swept} 条评论")
+    return store.comment_image_counts()
+
+
+def get_issue_to_excel_with_analysis(repo_name, incremental=False, export_excel=True, comment_sweep=None,
+                                     predicate=None, excel_path=None):
     """
-    使用issue_2的逻辑爬取issues到Excel，并同时进行图片和标签分析
+    使用issue_2的逻辑爬取issues，并同时进行图片和标签分析。
+    每个issue到达时即upsert进SQLite（CrawlStore），中断后重新运行会从断点继续；
+    incremental为True且存在水位线时，只请求水位线之后更新过的issues。
+    export_excel为True时在结束后一次性导出Excel。
+    comment_sweep为True时先扫描仓库全部评论再按issue编号关联；
+    只爬取少量issue（如按标签筛选后很少）时可设为False，逐个issue获取评论。
+    predicate为下游筛选条件（IssuePredicate），爬取时按字段成本依次判断，
+    无法通过的issue不保存，也不再获取评论；此时comment_sweep默认为False，只为通过的issue获取评论。
+    excel_path默认为 ../issue_results/{owner}_{repo}_issues_with_analysis.xlsx。
+    token从令牌池中选取，某个token额度耗尽时换用其他token从断点继续，所有token都耗尽时才等待。
     """
-    load_dotenv()
-    my_github_token = os.getenv("MY_GITHUB_TOKEN")
-    if not my_github_token:
-        raise ValueError("You need to set a GITHUB_TOKEN in your .env file!")
-
-    auth = Auth.Token(my_github_token)
-    g = Github(auth=auth)
-
+    if comment_sweep is None:
+        comment_sweep = predicate is None
+    pool = get_token_pool()
+
+    while True:
+        token = pool.acquire('core')
+        try:
+            return _crawl_issues(Github(auth=Auth.Token(token), per_page=100), repo_name, incremental,
+                                 export_excel, comment_sweep, predicate, excel_path)
+        except RateLimitExceededException as e:
+            reset = (e.headers or {}).get('x-ratelimit-reset')
+            pool.mark_exhausted(token, 'core', int(reset) if reset else time.time() + 60)
+            logger.warning(f"token ...{token[-4:]} 的速率限制已达到，换用其他token从断点继续。")
+
+
+def _crawl_issues(g, repo_name, incremental, export_excel, comment_sweep, predicate, excel_path):
+    """用给定的Github客户端执行一次爬取，速率限制异常交给调用方切换token"""
     try:
         repo = g.get_repo(repo_name)
         logger.info(f"开始爬取仓库: {repo_name}")
@@ -95,13 +133,32 @@ def get_issue_to_excel_with_analysis(repo_name):
         logger.error(f"无法访问仓库 {repo_name}: {e}")
         return None, None
 
-    # 加载保存的进度
-    last_issue_number = load_progress(repo_name)
-    logger.info(f"从进度 {last_issue_number} 开始处理。")
-
-    issues_data = []
-
-    # 统计数据
+    store = CrawlStore(repo_name)
+
+    # 增量模式：从水位线开始只获取更新过的issues
+    watermark = store.get_meta('updated_at') if incremental else None
+    issue_query = {'state': "all", 'labels': ["Type: Feature request"]}
+    if predicate is not None and predicate.api_state() and not watermark:
+        # 把state条件下推到列表接口；增量同步时不下推，之后被重新打开的issue也要取回，
+        # 在客户端判断不满足条件后从数据库中删除
+        issue_query['state'] = predicate.api_state()
+        logger.info(f"筛选条件: {predicate}，列表接口只请求 state={issue_query['state']} 的issues")
+    if watermark:
+        issue_query.update(since=datetime.fromisoformat(watermark), sort='updated', direction='asc')
+        logger.info(f"增量同步: 获取 {watermark} 之后更新的issues。")
+        last_issue_number = 0
+    else:
+        # 加载保存的进度
+        last_issue_number = int(store.get_meta('last_issue_number') or 0)
+        logger.info(f"从进度 {last_issue_number} 开始处理，数据库中已有 {store.count()} 个issues。")
+    max_updated_at = datetime.fromisoformat(watermark) if watermark else None
+    # 从头开始的完整爬取完成后才能记录水位线。换token或重新运行时从断点继续（last_issue_number不为0），
+    # 所以在开始时把标记写入数据库，续爬时仍能知道这是一次完整爬取
+    if not watermark and last_issue_number == 0:
+        store.set_meta('full_crawl', 1)
+    crawl_started_fresh = not watermark and store.get_meta('full_crawl') == '1'
+
+    # 统计数据（本次运行），最终统计在结束时根据数据库中的全部issue重新计算
     stats = {
         'total_issues': 0,
         'total_prs': 0,
@@ -114,36 +171,25 @@ def get_issue_to_excel_with_analysis(repo_name):
         'total_images_b': 0
     }
 
-
-    # 创建一个新的工作簿和工作表
-    wb = Workbook()
-    ws = wb.active
-
     # 创建issue_results目录
     if not os.path.exists('../issue_results'):
         os.makedirs('../issue_results')
 
-    # 设置工作表的表头（添加图片相关字段）
-    ws.append([
-        'id', 'number', 'html_url', 'type', 'labels', 'created_date', 'updated_date', 'resolved_date', 'title', 'body',
-        'state', 'comments', 'state_reason', 'repository_url', 'labels_url', 'comments_url', 'events_url',
-        'user_login', 'user_url', 'assignees', 'milestone_title', 'milestone_description', 'pull_request_url',
-        'body_image_count', 'comment_image_count', 'total_image_count'
-    ])
-
-    # 保存工作表
-    start_time = time.time()
-    start_time_str = time.strftime("%Y-%m-%d_%H-%M-%S")
     repo_name_temp = repo_name.replace('/', '_')
-    excel_path = f'../issue_results/{repo_name_temp}_issues_with_analysis_{start_time_str}.xlsx'
-    wb.save(excel_path)
-
-    row_num = len(ws['A']) + 1
+    if excel_path is None:
+        excel_path = f'../issue_results/{repo_name_temp}_issues_with_analysis.xlsx'
+    processed_count = 0
+    last_done_number = 0
+    predicate_stats = {'predicate_rejected': 0, 'api_calls_saved': 0}
 
     try:
-        for issue in repo.get_issues(state="all", labels=["Type: Feature request"]):
+        comment_image_counts = sweep_comment_images(repo, store) if comment_sweep else None
+
+        for issue in repo.get_issues(**issue_query):
             if last_issue_number and issue.number >= last_issue_number:
                 continue  # 跳过已处理的 issues
+            if max_updated_at is None or issue.updated_at > max_updated_at:
+                max_updated_at = issue.updated_at
 
             labels = [label.name for label in issue.labels]
             assignees = [assignee.login for assignee in issue.assignees]
@@ -154,6 +200,27 @@ def get_issue_to_excel_with_analysis(repo_name):
             # 判断是issue还是PR
             is_pr = issue.pull_request is not None
 
+            # 分析正文中的图片
+            body_image_count = count_images(issue.body)
+
+            # 先用列表接口自带的字段和正文图片数判断筛选条件，无法通过的issue不再做后续工作
+            if predicate is not None:
+                known_fields = {
+                    'state': issue.state,
+                    'state_reason': issue.state_reason,
+                    'type': 'pull_request' if is_pr else 'issue',
+                    'labels': ','.join(labels),
+                    'comments': issue.comments,
+                    'body_image_count': body_image_count
+                }
+                if not predicate.evaluate(known_fields, max_cost=1):
+                    predicate_stats['predicate_rejected'] += 1
+                    if comment_image_counts is None:
+                        # 逐个获取评论时，每个issue至少一次请求，每100条评论一页
+                        predicate_stats['api_calls_saved'] += max(1, -(-issue.comments // 100))
+                    store.delete_issue(issue.id)  # 之前保存过但现在不满足条件的issue
+                    continue
+
             stats['total_issues'] += 1
 
             if is_pr:
@@ -164,26 +231,31 @@ def get_issue_to_excel_with_analysis(repo_name):
             for label in labels:
                 stats['all_labels'][label] += 1
 
-            # 分析正文中的图片
-            body_images = analyze_images_in_content(issue.body or "")
-            body_image_count = (len(body_images['markdown_images']) +
-                                len(body_images['html_images']))
-
             # 分析评论中的图片（简化版，只统计数量）
-            comment_image_count = 0
-            try:
-                for comment in issue.get_comments():
-                    comment_images = analyze_images_in_content(comment.body or "")
-                    comment_image_count += (len(comment_images['markdown_images']) +
-                                            len(comment_images['html_images']))
-            except RateLimitExceededException:
-                # 如果在获取评论时遇到速率限制，跳过这个issue的评论分析
-                logger.warning(f"  获取issue #{issue.number}的评论时遇到速率限制，跳过评论分析")
-            except Exception as e:
-                logger.warning(f"  获取issue #{issue.number}评论失败 - {e}")
+            if comment_image_counts is not None:
+                comment_image_count = comment_image_counts.get(issue.number, 0)
+            else:
+                comment_image_count = 0
+                try:
+                    for comment in issue.get_comments():
+                        comment_image_count += count_images(comment.body)
+                except RateLimitExceededException:
+                    raise  # 交给外层等待速率限制重置后重试，不再丢弃这个issue的评论数
+                except Exception as e:
+                    logger.warning(f"  获取issue #{issue.number}评论失败 - {e}")
 
             total_images_in_issue = body_image_count + comment_image_count
 
+            if predicate is not None and not predicate.evaluate({
+                'state': issue.state, 'state_reason': issue.state_reason,
+                'type': 'pull_request' if is_pr else 'issue', 'labels': ','.join(labels),
+                'comments': issue.comments, 'body_image_count': body_image_count,
+                'comment_image_count': comment_image_count, 'total_image_count': total_images_in_issue
+            }):
+                predicate_stats['predicate_rejected'] += 1
+                store.delete_issue(issue.id)
+                continue
+
             if body_image_count > 0:
                 stats['issues_with_images_b'] += 1
                 stats['total_images_b'] += total_images_in_issue
@@ -227,34 +299,40 @@ def get_issue_to_excel_with_analysis(repo_name):
                 'comment_image_count': comment_image_count,
                 'total_image_count': total_images_in_issue
             }
-            issues_data.append(issue_data)
+            store.upsert_issue(issue_data)
+            processed_count += 1
+            last_done_number = issue.number
 
             logger.info(f'当前已获取 issue #{issue.number} (images: {total_images_in_issue})')
 
-            if len(issues_data) % 100 == 0:  # 减少批量大小，更频繁保存
-                issues_df = pd.DataFrame(issues_data)
-                for _, row in issues_df.iterrows():
-                    if write_row_to_excel(ws, row, row_num):
-                        row_num += 1
-
-                wb.save(excel_path)
-                logger.info(f'已将 {row_num - 2} 个issues保存到了Excel')
-                save_progress(repo_name, issue.number)  # 保存当前最小编号进度
-
-                # 保存中间统计结果
-                save_intermediate_stats(repo_name, stats, len(issues_data))
-                issues_data = []
-
-        # 保存剩余数据
-        if issues_data:
-            issues_df = pd.DataFrame(issues_data)
-            for _, row in issues_df.iterrows():
-                if write_row_to_excel(ws, row, row_num):
-                    row_num += 1
-
-        wb.save(excel_path)
-        save_progress(repo_name, 0)  # 清空进度，表示完成
-        logger.info(f'导出成功，共有 {row_num - 2} 个issues')
+            if processed_count % 100 == 0:
+                if not watermark:
+                    store.set_meta('last_issue_number', issue.number)  # 保存当前最小编号进度
+                store.save_stats(stats)
+                logger.info(f'本次已处理 {processed_count} 个issues，数据库中共有 {store.count()} 个issues')
+
+        store.set_meta('last_issue_number', 0)  # 清空进度，表示完成
+        if (watermark or crawl_started_fresh) and max_updated_at is not None:
+            # 只有完整爬取或增量同步成功后，水位线才可靠；续爬时之前处理的issue不在max_updated_at中，
+            # 水位线只会偏早（下次多获取一些issue），不会漏掉更新
+            store.set_meta('updated_at', max_updated_at.isoformat())
+        store.set_meta('full_crawl', 0)
+
+        # 根据数据库中的全部issue计算最终统计
+        all_issues = store.all_issues()
+        stats = compute_stats(all_issues)
+        if predicate is not None:
+            stats.update(predicate_stats)
+            logger.info(f"筛选条件跳过了 {predicate_stats['predicate_rejected']} 个issues，"
+                        f"节省了约 {predicate_stats['api_calls_saved']} 次API请求")
+        store.save_stats(stats)
+        logger.info(f'爬取完成，本次处理 {processed_count} 个issues，共有 {len(all_issues)} 个issues')
+
+        if export_excel:
+            exported = store.export_excel(excel_path)
+            logger.info(f'已将 {exported} 个issues导出到Excel: {excel_path}')
+        else:
+            excel_path = store.db_path
 
         # 保存最终统计结果
         save_final_stats(repo_name, stats)
@@ -262,31 +340,17 @@ def get_issue_to_excel_with_analysis(repo_name):
         return excel_path, stats
 
     except RateLimitExceededException:
-        reset_time = g.get_rate_limit().core.reset.timestamp()
-        sleep_time = reset_time - time.time() + 1
-        logger.warning(f"速率限制已达到，暂停 {sleep_time} 秒。")
-        time.sleep(sleep_time)
-        return get_issue_to_excel_with_analysis(repo_name)  # 在同一运行中重试
+        if not watermark and last_done_number:
+            store.set_meta('last_issue_number', last_done_number)  # 换token后从这里继续
+        store.save_stats(stats)
+        raise
 
     except GithubException as e:
         logger.error(f"获取仓库 {repo_name} 的数据时出错: {e}")
-        # 保存当前进度和数据
-        if issues_data:
-            save_intermediate_stats(repo_name, stats, len(issues_data))
-        return excel_path if 'excel_path' in locals() else None, stats
-
-
-def save_intermediate_stats(repo_name, stats, processed_count):
-    """保存中间统计结果"""
-    repo_name_clean = repo_name.replace('/', '_')
-    stats_file = f'../issue_results/{repo_name_clean}_stats_progress_{processed_count}.json'
-
-    # 转换defaultdict为普通dict以便JSON序列化
-    stats_copy = dict(stats)
-    stats_copy['all_labels'] = dict(stats_copy['all_labels'])
-
-    with open(stats_file, 'w', encoding='utf-8') as f:
-        json.dump(stats_copy, f, ensure_ascii=False, indent=2)
+        # 已获取的issues都在数据库中，重新运行会从断点继续
+        store.save_stats(stats)
+        logger.info(f"已获取的数据保存在 {store.db_path}，重新运行即可继续。")
+        return None, stats
 
 
 def save_final_stats(repo_name, stats):
@@ -333,13 +397,19 @@ def print_statistics(stats):
 
 
 if __name__ == "__main__":
-    repo_name = "AntennaPod1/AntennaPod1"
+    # pipeline.py运行时通过环境变量传入GitHub仓库全名和Excel输出路径
+    repo_name = os.getenv("VFLOC_GITHUB_REPO", "AntennaPod1/AntennaPod1")
 
     print(f"开始使用issue_2逻辑爬取和分析仓库: {repo_name}")
     print("程序会自动处理速率限制并从上次中断的地方继续执行。")
     print("这可能需要一些时间，请耐心等待...")
 
-    excel_path, stats = get_issue_to_excel_with_analysis(repo_name)
+    # 爬取时直接应用filter阶段的筛选条件（已完成且包含图片），VFLOC_CRAWL_PREDICATE=0 时爬取全部issues
+    predicate = COMPLETED_WITH_IMAGES if os.getenv("VFLOC_CRAWL_PREDICATE", "1") != "0" else None
+
+    # 已有同步状态时只获取上次之后更新过的issues，否则全量爬取
+    excel_path, stats = get_issue_to_excel_with_analysis(repo_name, incremental=True, predicate=predicate,
+                                                         excel_path=os.getenv("VFLOC_OUTPUT"))
 
     if stats and excel_path:
         print(f"\n爬取完成！Excel文件已保存到: {excel_path}")
@@ -0,0 +1,180 @@
+"""
+commit对象的持久化存储（SQLite + 进程内缓存）
+
+add_groundtruth.py 和 generate_operation_folders.py 都需要同一个commit的时间、父commit和文件变更列表，
+以前每个字段都要单独请求一次 GET /repos/{owner}/{repo}/commits/{sha}。
+这里把解析后的commit对象持久化下来，同一个SHA在所有运行中只请求一次API。
+数据库在第一次查询时才创建，只导入模块（或其他脚本导入 generate_operation_folders.py）不会产生文件。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from http_cassette import CASSETTE_MODE
+
+# 默认数据库位置：与各脚本使用的 ../issue_results 目录一致
+DEFAULT_DB_PATH = os.getenv(
+    "COMMIT_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'issue_results', 'cache', 'commit_store.sqlite3')
+)
+
+
+def _parse_timestamp(date_str: Optional[str]) -> int:
+    """把GitHub返回的ISO时间转换为时间戳，解析失败返回0"""
+    if not date_str:
+        return 0
+    try:
+        return int(datetime.fromisoformat(date_str.replace('Z', '+00:00')).timestamp())
+    except ValueError:
+        return 0
+
+
+def parse_commit_payload(commit_data: dict) -> dict:
+    """从REST commit响应中提取需要缓存的字段"""
+    commit_info = commit_data.get('commit', {})
+    return {
+        'sha': commit_data.get('sha'),
+        'author_date': _parse_timestamp(commit_info.get('author', {}).get('date')),
+        'committer_date': _parse_timestamp(commit_info.get('committer', {}).get('date')),
+        'parents': [parent['sha'] for parent in commit_data.get('parents', [])],
+        'files': [
+            {
+                'filename': file_info.get('filename'),
+                'status': file_info.get('status'),
+                'previous_filename': file_info.get('previous_filename')
+            }
+            for file_info in commit_data.get('files', [])
+        ]
+    }
+
+
+class CommitStore:
+    """
+    按 (owner, repo, sha) 缓存解析后的commit对象。
+    查询顺序：进程内字典 -> SQLite -> GitHub API（成功后写回前两层）。
+    """
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, min_interval: float = 0.5):
+        self.db_path = db_path
+        self.min_interval = min_interval  # 两次真实API请求之间的最小间隔（秒），回放磁带时不等待
+        self.api_calls = 0
+        self._memo: Dict[tuple, dict] = {}
+        self._lock = threading.Lock()
+        self._last_fetch = 0.0
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        """第一次使用时打开数据库"""
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS commits (
+                    owner TEXT NOT NULL,
+                    repo TEXT NOT NULL,
+                    sha TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (owner, repo, sha)
+                )
+            """)
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def _key(owner: str, repo: str, sha: str) -> tuple:
+        return owner.lower(), repo.lower(), sha
+
+    def _load(self, key: tuple) -> Optional[dict]:
+        row = self._db().execute(
+            "SELECT payload FROM commits WHERE owner = ? AND repo = ? AND sha = ?", key
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _save(self, key: tuple, commit: dict):
+        payload = json.dumps(commit, ensure_ascii=False)
+        conn = self._db()
+        conn.execute("INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?)", key + (payload,))
+        # 短SHA请求时同时以完整SHA保存，方便其他脚本命中
+        if commit.get('sha') and commit['sha'] != key[2]:
+            conn.execute("INSERT OR REPLACE INTO commits VALUES (?, ?, ?, ?)", key[:2] + (commit['sha'], payload))
+        conn.commit()
+
+    def _fetch(self, owner: str, repo: str, sha: str, fetch: Callable) -> Optional[dict]:
+        """通过传入的请求函数获取commit，文件列表超过一页时继续翻页"""
+        wait_time = self.min_interval - (time.time() - self._last_fetch)
+        if wait_time > 0 and CASSETTE_MODE != 'replay':
+            time.sleep(wait_time)
+
+        url = f"https://api.github.com/repos/{owner}/{repo}/commits/{sha}"
+        response = fetch(url)
+        self._last_fetch = time.time()
+        self.api_calls += 1
+        if response is None:
+            print(f"错误: 无法获取commit {sha[:7]} 的信息，所有重试都失败")
+            return None
+        if response.status_code != 200:
+            if response.status_code == 404:
+                print(f"错误: commit {sha[:7]} 不存在或仓库 {owner}/{repo} 不可访问")
+            elif response.status_code == 403:
+                print(f"错误: GitHub API访问被限制，可能是token问题或请求过于频繁 (commit: {sha[:7]})")
+            elif response.status_code == 422:
+                print(f"错误: commit hash {sha[:7]} 格式无效")
+            else:
+                print(f"错误: 获取commit {sha[:7]} 失败，HTTP状态码: {response.status_code}")
+            return None
+
+        try:
+            commit_data = response.json()
+            # 单页最多300个文件，按Link头继续获取剩余文件
+            next_url = response.links.get('next', {}).get('url')
+            while next_url:
+                page = fetch(next_url)
+                self.api_calls += 1
+                if page is None or page.status_code != 200:
+                    print(f"警告: commit {sha[:7]} 的文件列表翻页失败，结果可能不完整")
+                    break
+                commit_data.setdefault('files', []).extend(page.json().get('files', []))
+                next_url = page.links.get('next', {}).get('url')
+        except (json.JSONDecodeError, ValueError) as e:
+            print(f"错误: 解码GitHub API响应JSON失败 (commit: {sha[:7]}): {e}")
+            return None
+
+        return parse_commit_payload(commit_data)
+
+    def get(self, owner: str, repo: str, sha: str, fetch: Callable) -> Optional[dict]:
+        """
+        获取commit对象，返回包含 sha/author_date/committer_date/parents/files 的字典，失败返回None。
+        fetch: 接收URL并返回 requests.Response（或None）的函数，由调用方提供鉴权和重试。
+        """
+        key = self._key(owner, repo, sha)
+        with self._lock:
+            if key in self._memo:
+                return self._memo[key]
+            commit = self._load(key)
+            if commit is None:
+                commit = self._fetch(owner, repo, sha, fetch)
+                if commit is None:
+                    return None  # 失败结果不缓存，下次运行重新请求
+                self._save(key, commit)
+            self._memo[key] = commit
+            return commit
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_default_store: Optional[CommitStore] = None
+
+
+def get_commit_store() -> CommitStore:
+    """返回进程内共享的默认CommitStore"""
+    global _default_store
+    if _default_store is None:
+        _default_store = CommitStore()
+    return _default_store
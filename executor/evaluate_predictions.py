@@ -0,0 +1,394 @@
+"""
+文件定位结果评测
+
+generate_operation_folders.py 为每个issue生成 {repo}_{issue}/ground_truth.json（modified_files、added_paths），
+prompt.txt 要求模型返回同样结构的JSON。本脚本读取模型的预测结果，与ground truth比较：
+
+    预测目录布局: {predictions_root}/{run}/{repo}_{issue}.json
+    文件内容:     {"modified_files": [...], "added_paths": [...]}，
+                  或 {"response": "<模型回复原文>"}（从回复中提取JSON，可带```json代码块和思考过程）
+
+所有路径先转换为整数id，所有run、所有issue的预测拼接成一维数组后用NumPy一次计算：
+- modified_files：precision / recall / F1 / 完全匹配 / Hit@k（前k个预测中至少命中一个）
+- added_paths：同上，另外计算目录前缀得分：预测目录是真实目录的上级或下级目录时，
+  按 较浅目录的层数 / 较深目录的层数 计部分得分（如预测 a/b，真实为 a/b/c，得 2/3）
+
+预测和真实都为空时各项指标记为1；只有一方为空时记为0；真实为空时Hit@k不参与平均。
+预测文件缺失或无法解析的issue各项指标都记为0（真实为空时也是如此）。
+结果按issue、仓库、整体三个层次写入CSV。
+
+用法：
+    python evaluate_predictions.py                       # 评测 ../predictions 下的所有run
+    python evaluate_predictions.py --runs gpt-4o --repos florisboard uno
+"""
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+OPERATION_ROOT = os.getenv("VFLOC_OPERATION_ROOT", "../operation")
+PREDICTIONS_ROOT = os.getenv("VFLOC_PREDICTIONS_ROOT", "../predictions")
+
+FIELDS = ('modified_files', 'added_paths')
+DEFAULT_K = (1, 3, 5, 10)
+
+_FENCE_PATTERN = re.compile(r"```(?:json)?\s*(.*?)```", re.S)
+
+
+# --- 读取预测和ground truth ---
+def normalize_path(path) -> str:
+    """统一路径写法：反斜杠转为/，去掉首尾的引号、./ 和 /"""
+    if not isinstance(path, str):
+        return ''
+    path = path.strip().strip('`"\'').replace('\\', '/')
+    while path.startswith('./'):
+        path = path[2:]
+    return path.strip('/')
+
+
+def normalize_paths(paths) -> List[str]:
+    """规范化并去重（保持预测顺序，顺序用于Hit@k）"""
+    if not isinstance(paths, list):
+        return []
+    return list(dict.fromkeys(p for p in map(normalize_path, paths) if p))
+
+
+def _is_prediction(obj) -> bool:
+    return isinstance(obj, dict) and any(field in obj for field in FIELDS)
+
+
+def extract_prediction(text: str) -> Optional[Dict]:
+    """从模型回复中提取包含modified_files/added_paths的JSON对象，找不到返回None"""
+    for candidate in [text] + _FENCE_PATTERN.findall(text):
+        try:
+            obj = json.loads(candidate)
+        except ValueError:
+            continue
+        if _is_prediction(obj):
+            return obj
+    # 回复中夹杂说明文字时，从每个 { 处尝试解析，取最后一个符合要求的对象（思考过程之后的最终答案）
+    decoder = json.JSONDecoder()
+    found = None
+    for match in re.finditer(r'\{', text):
+        try:
+            obj, _ = decoder.raw_decode(text, match.start())
+        except ValueError:
+            continue
+        if _is_prediction(obj):
+            found = obj
+    return found
+
+
+def load_prediction(path: str) -> Optional[Dict]:
+    """读取一个预测文件，返回 {'modified_files': [...], 'added_paths': [...]}，无法解析返回None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            text = f.read()
+    except OSError:
+        return None
+    try:
+        obj = json.loads(text)
+    except ValueError:
+        obj = extract_prediction(text)
+    if isinstance(obj, dict) and not _is_prediction(obj) and isinstance(obj.get('response'), str):
+        obj = extract_prediction(obj['response'])
+    if not _is_prediction(obj):
+        return None
+    return {field: normalize_paths(obj.get(field)) for field in FIELDS}
+
+
+def load_ground_truth(operation_root: str, folders: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Dict]]:
+    """读取 {operation_root}/{folder}/{repo}_{issue}/ground_truth.json，返回 {folder: {issue_key: ground_truth}}"""
+    if folders is None:
+        folders = sorted(d for d in os.listdir(operation_root) if os.path.isdir(os.path.join(operation_root, d)))
+    ground_truth = {}
+    for folder in folders:
+        folder_dir = os.path.join(operation_root, folder)
+        if not os.path.isdir(folder_dir):
+            print(f"警告: operation目录不存在 {folder_dir}")
+            continue
+        issues = {}
+        for issue_key in sorted(os.listdir(folder_dir)):
+            path = os.path.join(folder_dir, issue_key, 'ground_truth.json')
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            issues[issue_key] = {field: normalize_paths(data.get(field, [])) for field in FIELDS}
+        ground_truth[folder] = issues
+    return ground_truth
+
+
+def load_run(run_dir: str, issue_keys: List[str]) -> List[Optional[Dict]]:
+    """按issue_keys的顺序读取一个run的所有预测，缺失或无法解析的为None"""
+    return [load_prediction(os.path.join(run_dir, f"{key}.json")) for key in issue_keys]
+
+
+# --- 路径编号 ---
+class PathInterner:
+    """把路径字符串映射为连续的整数id，并记录每个目录的层数和所有上级目录"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.paths: List[str] = []
+
+    def intern(self, path: str) -> int:
+        path_id = self.ids.get(path)
+        if path_id is None:
+            path_id = self.ids[path] = len(self.paths)
+            self.paths.append(path)
+        return path_id
+
+    def ancestor_table(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        返回 (depth, ptr, ancestors)：depth[i] 为路径i的层数；ancestors[ptr[i]:ptr[i+1]] 为路径i的
+        所有上级目录及其自身的id（CSR格式）。上级目录会被加入编号表，因此要在所有路径编号之后调用。
+        """
+        ancestor_lists = []
+        for path in list(self.paths):
+            parts = path.split('/')
+            ancestor_lists.append([self.intern('/'.join(parts[:n])) for n in range(1, len(parts) + 1)])
+        # 新加入的上级目录本身也需要一行（不会再产生新的路径）
+        for path in self.paths[len(ancestor_lists):]:
+            parts = path.split('/')
+            ancestor_lists.append([self.ids['/'.join(parts[:n])] for n in range(1, len(parts) + 1)])
+        depth = np.array([len(a) for a in ancestor_lists], dtype=np.int64)
+        ptr = np.zeros(len(ancestor_lists) + 1, dtype=np.int64)
+        np.cumsum(depth, out=ptr[1:])
+        ancestors = np.fromiter((a for lst in ancestor_lists for a in lst), dtype=np.int64, count=int(ptr[-1]))
+        return depth, ptr, ancestors
+
+
+class FlatSets:
+    """所有查询（run × issue）的路径列表拼接成的一维数组：第i个元素属于查询query[i]，在列表中排第rank[i]"""
+
+    def __init__(self):
+        self._query: List[int] = []
+        self._ids: List[int] = []
+        self._rank: List[int] = []
+
+    def add(self, query: int, path_ids: List[int]):
+        self._query.extend([query] * len(path_ids))
+        self._ids.extend(path_ids)
+        self._rank.extend(range(len(path_ids)))
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return (np.asarray(self._query, dtype=np.int64), np.asarray(self._ids, dtype=np.int64),
+                np.asarray(self._rank, dtype=np.int64))
+
+
+# --- 向量化计算 ---
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    return np.divide(numerator, denominator, out=np.zeros(len(numerator)), where=denominator > 0)
+
+
+def _f1(precision: np.ndarray, recall: np.ndarray) -> np.ndarray:
+    return _ratio(2 * precision * recall, precision + recall)
+
+
+def _expand(ids: np.ndarray, ptr: np.ndarray, ancestors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """展开每个元素的所有上级目录，返回 (元素下标, 上级目录id)"""
+    lengths = ptr[ids + 1] - ptr[ids]
+    owner = np.repeat(np.arange(len(ids)), lengths)
+    offsets = np.arange(int(lengths.sum())) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return owner, ancestors[np.repeat(ptr[ids], lengths) + offsets]
+
+
+def score_sets(pred: Tuple[np.ndarray, ...], gold: Tuple[np.ndarray, ...], n_queries: int, n_ids: int,
+               ks: Iterable[int] = DEFAULT_K, parsed: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    按完全相同的路径计算每个查询的precision、recall、F1、完全匹配和Hit@k。
+    parsed为每个查询的预测是否存在且解析成功，预测与真实都为空时只有解析成功的查询得1分，其余得0分。
+    """
+    pred_query, pred_ids, pred_rank = pred
+    gold_query, gold_ids, _ = gold
+    hit = np.isin(pred_query * n_ids + pred_ids, gold_query * n_ids + gold_ids)
+
+    n_pred = np.bincount(pred_query, minlength=n_queries)
+    n_gold = np.bincount(gold_query, minlength=n_queries)
+    tp = np.bincount(pred_query, weights=hit, minlength=n_queries)
+    both_empty = (n_pred == 0) & (n_gold == 0)
+    if parsed is not None:
+        both_empty &= parsed
+
+    precision = _ratio(tp, n_pred)
+    recall = _ratio(tp, n_gold)
+    precision[both_empty] = 1.0
+    recall[both_empty] = 1.0
+    scores = {
+        'precision': precision,
+        'recall': recall,
+        'f1': _f1(precision, recall),
+        'exact': ((tp == n_pred) & (tp == n_gold) & (parsed if parsed is not None else True)).astype(float),
+        'n_pred': n_pred.astype(float),
+        'n_gold': n_gold.astype(float)
+    }
+    for k in ks:
+        hit_at_k = (np.bincount(pred_query[hit & (pred_rank < k)], minlength=n_queries) > 0).astype(float)
+        hit_at_k[n_gold == 0] = np.nan
+        scores[f'hit@{k}'] = hit_at_k
+    return scores
+
+
+def score_prefix(pred: Tuple[np.ndarray, ...], gold: Tuple[np.ndarray, ...], n_queries: int, n_ids: int,
+                 depth: np.ndarray, ptr: np.ndarray, ancestors: np.ndarray,
+                 parsed: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+    """
+    目录前缀得分：预测目录d与真实目录g相同得1分，互为上下级时得 min(层数)/max(层数)。
+    每个预测目录取与所有真实目录的最高得分计precision，每个真实目录取最高得分计recall。
+    parsed的含义与score_sets相同。
+    """
+    pred_query, pred_ids, _ = pred
+    gold_query, gold_ids, _ = gold
+    pred_keys = pred_query * n_ids + pred_ids
+    gold_keys = gold_query * n_ids + gold_ids
+    pred_order = np.argsort(pred_keys)
+    gold_order = np.argsort(gold_keys)
+
+    def lookup(keys, sorted_order, all_keys):
+        """在all_keys中查找keys，返回 (是否找到, 元素下标)"""
+        sorted_keys = all_keys[sorted_order]
+        pos = np.clip(np.searchsorted(sorted_keys, keys), 0, max(len(sorted_keys) - 1, 0))
+        found = sorted_keys[pos] == keys if len(sorted_keys) else np.zeros(len(keys), dtype=bool)
+        return found, sorted_order[pos] if len(sorted_keys) else pos
+
+    # 真实目录是预测目录自身或其上级
+    owner, anc = _expand(pred_ids, ptr, ancestors)
+    found, gold_index = lookup(pred_query[owner] * n_ids + anc, gold_order, gold_keys)
+    pairs_pred = [owner[found]]
+    pairs_gold = [gold_index[found]]
+    pairs_credit = [depth[anc[found]] / depth[pred_ids[owner[found]]]]
+    # 预测目录是真实目录的上级
+    owner, anc = _expand(gold_ids, ptr, ancestors)
+    found, pred_index = lookup(gold_query[owner] * n_ids + anc, pred_order, pred_keys)
+    pairs_pred.append(pred_index[found])
+    pairs_gold.append(owner[found])
+    pairs_credit.append(depth[anc[found]] / depth[gold_ids[owner[found]]])
+
+    pairs_pred = np.concatenate(pairs_pred)
+    pairs_gold = np.concatenate(pairs_gold)
+    pairs_credit = np.concatenate(pairs_credit)
+    pred_credit = np.zeros(len(pred_ids))
+    gold_credit = np.zeros(len(gold_ids))
+    np.maximum.at(pred_credit, pairs_pred, pairs_credit)
+    np.maximum.at(gold_credit, pairs_gold, pairs_credit)
+
+    n_pred = np.bincount(pred_query, minlength=n_queries)
+    n_gold = np.bincount(gold_query, minlength=n_queries)
+    both_empty = (n_pred == 0) & (n_gold == 0)
+    if parsed is not None:
+        both_empty &= parsed
+    precision = _ratio(np.bincount(pred_query, weights=pred_credit, minlength=n_queries), n_pred)
+    recall = _ratio(np.bincount(gold_query, weights=gold_credit, minlength=n_queries), n_gold)
+    precision[both_empty] = 1.0
+    recall[both_empty] = 1.0
+    return {'prefix_precision': precision, 'prefix_recall': recall, 'prefix_f1': _f1(precision, recall)}
+
+
+# --- 主流程 ---
+def list_runs(predictions_root: str) -> List[str]:
+    """predictions_root下的每个子目录是一个run（以_开头的目录除外，如评测结果目录）"""
+    if not os.path.isdir(predictions_root):
+        return []
+    return sorted(d for d in os.listdir(predictions_root)
+                  if os.path.isdir(os.path.join(predictions_root, d)) and not d.startswith('_'))
+
+
+def evaluate(operation_root: str = OPERATION_ROOT, predictions_root: str = PREDICTIONS_ROOT,
+             runs: Optional[List[str]] = None, folders: Optional[List[str]] = None,
+             ks: Iterable[int] = DEFAULT_K, jobs: Optional[int] = None) -> pd.DataFrame:
+    """评测所有run的预测，返回每个 (run, issue) 一行的DataFrame"""
+    ks = tuple(ks)
+    ground_truth = load_ground_truth(operation_root, folders)
+    issue_index = [(folder, key) for folder, issues in ground_truth.items() for key in issues]
+    issue_keys = [key for _, key in issue_index]
+    runs = runs or list_runs(predictions_root)
+    if not issue_index or not runs:
+        print("没有找到需要评测的ground truth或预测结果")
+        return pd.DataFrame()
+    print(f"评测 {len(runs)} 个run × {len(issue_index)} 个issue...")
+
+    # 读取和解析JSON是主要耗时，按run并行
+    run_dirs = [os.path.join(predictions_root, run) for run in runs]
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        predictions = list(pool.map(load_run, run_dirs, [issue_keys] * len(runs)))
+
+    interner = PathInterner()
+    flat = {(side, field): FlatSets() for side in ('pred', 'gold') for field in FIELDS}
+    parsed = np.zeros(len(runs) * len(issue_index), dtype=bool)
+    for r, run_predictions in enumerate(predictions):
+        for i, (folder, key) in enumerate(issue_index):
+            query = r * len(issue_index) + i
+            prediction = run_predictions[i]
+            parsed[query] = prediction is not None
+            for field in FIELDS:
+                flat['gold', field].add(query, [interner.intern(p) for p in ground_truth[folder][key][field]])
+                if prediction is not None:
+                    flat['pred', field].add(query, [interner.intern(p) for p in prediction[field]])
+
+    depth, ptr, ancestors = interner.ancestor_table()
+    n_ids = len(interner.paths)
+    n_queries = len(parsed)
+    columns = {
+        'run': np.repeat(runs, len(issue_index)),
+        'repo': np.tile([folder for folder, _ in issue_index], len(runs)),
+        'issue': np.tile(issue_keys, len(runs)),
+        'parsed': parsed.astype(float)
+    }
+    for field, prefix in (('modified_files', 'file'), ('added_paths', 'dir')):
+        pred = flat['pred', field].arrays()
+        gold = flat['gold', field].arrays()
+        scores = score_sets(pred, gold, n_queries, n_ids, ks, parsed)
+        if field == 'added_paths':
+            scores.update(score_prefix(pred, gold, n_queries, n_ids, depth, ptr, ancestors, parsed))
+        for name, values in scores.items():
+            columns[f'{prefix}_{name}'] = values
+    return pd.DataFrame(columns)
+
+
+def summarize(per_issue: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """按仓库和整体对每个issue的指标求平均（Hit@k忽略真实为空的issue），返回 (per_repo, overall)"""
+    metrics = [c for c in per_issue.columns if c not in ('run', 'repo', 'issue')]
+    per_repo = per_issue.groupby(['run', 'repo'])[metrics].mean()
+    per_repo.insert(0, 'issues', per_issue.groupby(['run', 'repo']).size())
+    overall = per_issue.groupby('run')[metrics].mean()
+    overall.insert(0, 'issues', per_issue.groupby('run').size())
+    return per_repo.reset_index(), overall.reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="评测文件定位预测结果")
+    parser.add_argument('--operation', default=OPERATION_ROOT, help="operation目录（包含ground_truth.json）")
+    parser.add_argument('--predictions', default=PREDICTIONS_ROOT, help="预测结果目录，每个子目录是一个run")
+    parser.add_argument('--runs', nargs='+', default=None, help="只评测这些run，默认全部")
+    parser.add_argument('--repos', nargs='+', default=None, help="只评测这些仓库（operation下的目录名），默认全部")
+    parser.add_argument('--k', nargs='+', type=int, default=list(DEFAULT_K), help="Hit@k的k值")
+    parser.add_argument('--output', default=None, help="评测结果目录，默认为 {predictions}/_scores")
+    parser.add_argument('--jobs', '-j', type=int, default=None, help="读取预测的并行进程数")
+    args = parser.parse_args()
+
+    per_issue = evaluate(args.operation, args.predictions, args.runs, args.repos, args.k, args.jobs)
+    if per_issue.empty:
+        return
+    per_repo, overall = summarize(per_issue)
+
+    output_dir = args.output or os.path.join(args.predictions, '_scores')
+    os.makedirs(output_dir, exist_ok=True)
+    per_issue.to_csv(os.path.join(output_dir, 'per_issue.csv'), index=False)
+    per_repo.to_csv(os.path.join(output_dir, 'per_repo.csv'), index=False)
+    overall.to_csv(os.path.join(output_dir, 'overall.csv'), index=False)
+
+    shown = ['run', 'issues', 'parsed', 'file_precision', 'file_recall', 'file_f1', 'file_exact', 'file_hit@1',
+             'dir_f1', 'dir_prefix_f1']
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.precision', 3):
+        print(overall[[c for c in shown if c in overall.columns]].to_string(index=False))
+    print(f"\n评测结果已保存到 {output_dir}（per_issue.csv、per_repo.csv、overall.csv）")
+
+
+if __name__ == "__main__":
+    main()
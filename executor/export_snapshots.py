@@ -0,0 +1,204 @@
+"""
+导出operation文件夹对应的源代码快照（按git blob SHA去重）
+
+operation文件夹中只有 git_commands.sh 指向一个检出，发布自包含的benchmark时如果为每个issue复制整个仓库，
+同一仓库几十个issue的快照大部分文件完全相同。这里把每个issue的 base_commit 中
+folder_to_extension_list 后缀的文件写入共享的内容寻址存储：
+
+    {snapshot_root}/blobs/ab/abcdef...    文件内容，以git blob SHA命名，相同内容只写一次
+    {issue_dir}/snapshot_manifest.json    {"repository", "base_commit", "tree", "files": {路径: blob SHA}}
+
+文件列表和内容通过 git_batch.py 中常驻的cat-file进程从镜像读取，不需要检出工作树。
+已存在的blob直接跳过，同一仓库的快照共享大部分文件时磁盘占用接近一份快照。
+blob文件是只读的（0444）。restore_snapshot 按manifest还原出一个目录，默认复制文件
+（文件系统支持时使用reflink，写时复制，不占用额外空间），还原出的文件可以随意修改；
+--link 改为硬链接到blob，速度最快，但还原出的文件与所有快照共用同一个blob，只能读不能改。
+
+默认存储位置为 ../snapshots，可用环境变量 VFLOC_SNAPSHOT_ROOT 修改。
+
+用法：
+    python export_snapshots.py                             # 导出 ../operation/{folder}
+    python export_snapshots.py ../operation/uno --remote "file:///tmp/remotes/{owner}/{repo}.git"
+    python export_snapshots.py --restore ../operation/uno/uno_123 /tmp/uno_123
+    python export_snapshots.py --restore ../operation/uno/uno_123 /tmp/uno_123 --link   # 只读的硬链接
+"""
+import argparse
+import fcntl
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from generate_operation_folders import folder_to_extension_list
+from git_batch import POOL_SIZE, get_pool
+from git_mirror import MIRROR_ROOT, ensure_mirror
+from materialize_checkouts import load_targets, resolve_base
+
+folder = os.getenv("VFLOC_REPO", "florisboard")  # 示例仓库，直接运行本脚本时处理该仓库
+
+SNAPSHOT_ROOT = os.getenv("VFLOC_SNAPSHOT_ROOT", "../snapshots")
+MANIFEST_FILENAME = 'snapshot_manifest.json'
+_SYMLINK_MODE = '120000'
+_FICLONE = 0x40049409  # Linux的reflink ioctl（btrfs、XFS等支持）
+
+
+class BlobStore:
+    """以git blob SHA命名的文件目录"""
+
+    def __init__(self, root: str = SNAPSHOT_ROOT):
+        self.root = root
+        self.blob_root = os.path.join(root, 'blobs')
+        self.tmp_root = os.path.join(root, 'tmp')
+        os.makedirs(self.blob_root, exist_ok=True)
+        os.makedirs(self.tmp_root, exist_ok=True)
+
+    def blob_path(self, sha: str) -> str:
+        return os.path.join(self.blob_root, sha[:2], sha)
+
+    def has(self, sha: str) -> bool:
+        return os.path.exists(self.blob_path(sha))
+
+    def put(self, sha: str, data: bytes) -> bool:
+        """写入blob，已存在时返回False；先写临时文件再rename，并发写入同一blob也不会得到不完整的文件"""
+        path = self.blob_path(sha)
+        if os.path.exists(path):
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=self.tmp_root, delete=False) as f:
+            f.write(data)
+        os.chmod(f.name, 0o444)  # blob被多个快照共用，只读，避免通过硬链接被原地修改
+        os.replace(f.name, path)
+        return True
+
+
+def export_snapshot(mirror: str, base: str, extensions, store: BlobStore) -> Dict:
+    """把base中指定后缀的文件写入存储，返回manifest和统计信息"""
+    pool = get_pool(mirror)
+    commit = pool.commit(base)
+    if commit is None:
+        raise KeyError(f"{mirror} 中找不到commit {base}")
+
+    files = {}
+    stats = {'files': 0, 'new_blobs': 0, 'bytes': 0, 'new_bytes': 0}
+    for path, entry in pool.walk(commit.tree):
+        if entry.mode == _SYMLINK_MODE or os.path.splitext(path)[1].lower() not in extensions:
+            continue
+        files[path] = entry.sha
+        stats['files'] += 1
+        if store.has(entry.sha):
+            stats['bytes'] += os.path.getsize(store.blob_path(entry.sha))
+            continue
+        data = pool.blob(entry.sha)
+        stats['bytes'] += len(data)
+        if store.put(entry.sha, data):
+            stats['new_blobs'] += 1
+            stats['new_bytes'] += len(data)
+    manifest = {'base_commit': commit.sha, 'tree': commit.tree, 'files': files}
+    return {'manifest': manifest, 'stats': stats}
+
+
+def export_operation_dir(operation_dir: str, snapshot_root: str = SNAPSHOT_ROOT, remote: Optional[str] = None,
+                         mirror_root: str = MIRROR_ROOT, folder_name: Optional[str] = None,
+                         jobs: int = POOL_SIZE) -> Dict[str, int]:
+    """
+    导出operation目录下每个issue的快照，manifest写入各issue文件夹，返回统计信息。
+    folder_name决定文件后缀（folder_to_extension_list的键），默认为operation目录名。
+    """
+    folder_name = folder_name or os.path.basename(os.path.normpath(operation_dir))
+    extensions = {ext.lower() for ext in folder_to_extension_list[folder_name]}
+    store = BlobStore(snapshot_root)
+    targets = load_targets(operation_dir)
+    mirrors = {}
+    for target in targets:
+        key = (target['owner'], target['repo'])
+        if key not in mirrors:
+            url = remote.format(owner=key[0], repo=key[1]) if remote else None
+            mirrors[key] = ensure_mirror(key[0], key[1], url=url, mirror_root=mirror_root)
+        target['mirror'] = mirrors[key]
+
+    def export_one(target: Dict) -> Optional[Dict]:
+        base = resolve_base(target['mirror'], target)
+        try:
+            result = export_snapshot(target['mirror'], base, extensions, store)
+        except KeyError as e:
+            print(f"无法导出 {os.path.basename(target['issue_dir'])}: {e.args[0]}")
+            return None
+        manifest = dict({'repository': f"{target['owner']}/{target['repo']}"}, **result['manifest'])
+        with open(os.path.join(target['issue_dir'], MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        return result['stats']
+
+    totals = {'snapshots': 0, 'failed': 0, 'files': 0, 'new_blobs': 0, 'bytes': 0, 'new_bytes': 0}
+    # 同一仓库共用一个cat-file进程池，线程数与池大小一致
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for stats in executor.map(export_one, targets):
+            if stats is None:
+                totals['failed'] += 1
+                continue
+            totals['snapshots'] += 1
+            for name, value in stats.items():
+                totals[name] += value
+
+    print(f"导出 {totals['snapshots']} 个快照（失败 {totals['failed']} 个），共 {totals['files']} 个文件 "
+          f"{totals['bytes'] / 1e6:.1f}MB，新写入 {totals['new_blobs']} 个blob {totals['new_bytes'] / 1e6:.1f}MB")
+    return totals
+
+
+def copy_blob(src: str, dst: str):
+    """复制blob，文件系统支持时使用reflink，否则普通复制；复制出的文件可写"""
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def restore_snapshot(issue_dir: str, dest: str, snapshot_root: str = SNAPSHOT_ROOT, link: bool = False) -> int:
+    """
+    按issue文件夹中的manifest在dest还原快照，返回文件数。
+    默认复制（或reflink）blob；link=True时硬链接到只读的blob（不支持硬链接时复制），还原出的文件不能修改。
+    """
+    with open(os.path.join(issue_dir, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    store = BlobStore(snapshot_root)
+    for path, sha in manifest['files'].items():
+        target = os.path.join(dest, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.lexists(target):
+            os.remove(target)
+        if link:
+            try:
+                os.link(store.blob_path(sha), target)
+                continue
+            except OSError:
+                pass
+        copy_blob(store.blob_path(sha), target)
+    return len(manifest['files'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出operation文件夹对应的源代码快照（按blob去重）")
+    parser.add_argument('operation_dir', nargs='?', default=f"../operation/{folder}")
+    parser.add_argument('--snapshot-root', default=SNAPSHOT_ROOT)
+    parser.add_argument('--mirror-root', default=MIRROR_ROOT)
+    parser.add_argument('--remote', default=None, help="clone镜像的地址模板，如 file:///path/{owner}/{repo}.git")
+    parser.add_argument('--folder', default=None, help="folder_to_extension_list中的仓库名，默认为operation目录名")
+    parser.add_argument('--jobs', '-j', type=int, default=POOL_SIZE)
+    parser.add_argument('--restore', nargs=2, metavar=('ISSUE_DIR', 'DEST'), help="按manifest还原一个快照")
+    parser.add_argument('--link', action='store_true', help="还原时硬链接到blob而不是复制（还原出的文件只读）")
+    args = parser.parse_args()
+
+    if args.restore:
+        count = restore_snapshot(args.restore[0], args.restore[1], args.snapshot_root, args.link)
+        print(f"已还原 {count} 个文件到 {args.restore[1]}")
+        return
+    export_operation_dir(args.operation_dir, args.snapshot_root, args.remote, args.mirror_root, args.folder,
+                         args.jobs)
+
+
+if __name__ == "__main__":
+    main()
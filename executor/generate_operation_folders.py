@@ -3,24 +3,28 @@ import os
 import re
 import requests
 import subprocess
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import time
 from dotenv import load_dotenv
-import ssl
 from urllib3.exceptions import SSLError
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+from commit_store import get_commit_store
+from git_mirror import MIRROR_ROOT, ensure_commits, ensure_mirror, resolve_pr_commits
+from token_pool import get_token_pool
+from image_scanner import replace_images
+from image_downloader import make_job, download_images
+from normalize_images import normalize_operation_dir
 
 load_dotenv()
 
-GITHUB_TOKEN = os.getenv("MY_GITHUB_TOKEN")  # 可放入 .env 文件或直接设置环境变量
-
+# token由令牌池从 MY_GITHUB_TOKENS / MY_GITHUB_TOKEN 读取，可放入 .env 文件或直接设置环境变量
 HEADERS = {
-    "Authorization": f"Bearer {GITHUB_TOKEN}",
     "Accept": "application/vnd.github+json"
 }
 
-folder = "florisboard"  # 示例仓库
+folder = os.getenv("VFLOC_REPO", "florisboard")  # 示例仓库，pipeline.py运行时通过环境变量传入
+
+# 下载图片后按 normalize_images.py 中的设置缩小、重新压缩图片（动图拼成网格图）
+NORMALIZE_IMAGES = True
 
 folder_to_name = {
     'All-Hands-AI': 'All-Hands-AI',
@@ -89,31 +93,12 @@ folder_to_extension_list = {
 
 
 # 配置重试策略
-def create_session_with_retries():
-    """创建带有重试机制的requests session"""
-    session = requests.Session()
-
-    # 配置重试策略
-    retry_strategy = Retry(
-        total=5,  # 总重试次数
-        backoff_factor=2,  # 退避因子
-        status_forcelist=[429, 500, 502, 503, 504],  # 需要重试的HTTP状态码
-        allowed_methods=["HEAD", "GET", "OPTIONS"]  # 允许重试的HTTP方法
-    )
-
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-
-    return session
-
-
 def make_api_request_with_retry(url: str, max_retries: int = 3) -> Optional[requests.Response]:
     """使用重试机制发送API请求，专门处理SSL错误"""
     for attempt in range(max_retries):
         try:
             print(f"尝试第 {attempt + 1} 次请求: {url}")
-            response = SESSION.get(url, headers=HEADERS, timeout=30)
+            response = get_token_pool().get(url, headers=HEADERS, timeout=30)
             return response
 
         except requests.exceptions.SSLError as e:
@@ -160,14 +145,14 @@ def make_api_request_with_retry(url: str, max_retries: int = 3) -> Optional[requ
 
     return None
 
-# 创建全局session
-SESSION = create_session_with_retries()
+# commit对象缓存，与add_groundtruth.py共用，同一SHA只请求一次API（请求间隔由CommitStore控制）
+COMMIT_STORE = get_commit_store()
 
 
-def is_valid_file(filepath: str) -> bool:
-    """判断文件是否为有效的源代码文件（排除测试文件）"""
+def is_valid_file(filepath: str, folder_name: Optional[str] = None) -> bool:
+    """判断文件是否为有效的源代码文件（排除测试文件），folder_name默认为当前处理的仓库"""
     _, ext = os.path.splitext(filepath)
-    if ext.lower() not in folder_to_extension_list[folder]:
+    if ext.lower() not in folder_to_extension_list[folder_name or folder]:
         return False
 
     path_parts = filepath.replace('\\', '/').split('/')
@@ -205,379 +190,113 @@ def extract_repo_info(html_url: str) -> tuple:
     return None, None, None
 
 def extract_images_from_body(body: str) -> tuple:
-    """从body中提取图片URL并替换为标签"""
-    # HTML img标签格式
-    img_pattern = r'<img[^>]*src="([^"]*)"[^>]*>'
-    html_images = re.findall(img_pattern, body)
-
-    # Markdown图片格式 ![alt text](url)
-    markdown_img_pattern = r'!\[([^\]]*)\]\(([^)]+)\)'
-    markdown_images = re.findall(markdown_img_pattern, body)
-
-    # 合并所有图片URL
-    all_images = html_images + [img[1] for img in markdown_images]
-
-    processed_body = body
-
-    # 替换HTML格式图片为标签
-    for i, img_url in enumerate(html_images, 1):
-        img_tag = f'<img[^>]*src="{re.escape(img_url)}"[^>]*>'
-        processed_body = re.sub(img_tag, f'[IMAGE_{i}]', processed_body)
-
-    # 替换Markdown格式图片为标签
-    start_index = len(html_images) + 1
-    for i, (alt_text, img_url) in enumerate(markdown_images, start_index):
-        # 转义特殊字符用于正则表达式
-        escaped_alt = re.escape(alt_text)
-        escaped_url = re.escape(img_url)
-        markdown_pattern = f'!\[{escaped_alt}\]\({escaped_url}\)'
-        processed_body = re.sub(markdown_pattern, f'[IMAGE_{i}]', processed_body)
-
-    return processed_body, all_images
-
-def get_image_extension_from_content(content: bytes) -> str:
-    """从图片内容的文件头检测图片格式"""
-    if content.startswith(b'\xff\xd8\xff'):
-        return '.jpg'
-    elif content.startswith(b'\x89PNG\r\n\x1a\n'):
-        return '.png'
-    elif content.startswith(b'GIF87a') or content.startswith(b'GIF89a'):
-        return '.gif'
-    elif content.startswith(b'RIFF') and b'WEBP' in content[:20]:
-        return '.webp'
-    elif content.startswith(b'BM'):
-        return '.bmp'
-    else:
-        return '.jpg'  # 默认使用jpg
-
-def get_image_extension_from_url_and_response(url: str, response: requests.Response) -> str:
-    """从URL和HTTP响应中推断图片扩展名"""
-    # 首先尝试从URL中提取扩展名（排除查询参数和token）
-    from urllib.parse import urlparse, parse_qs
-    parsed_url = urlparse(url)
-    path = parsed_url.path
-
-    # 检查路径是否有明确的图片扩展名
-    common_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp']
-    for ext in common_extensions:
-        if path.lower().endswith(ext):
-            return ext
-
-    # 如果URL没有扩展名，尝试从Content-Type获取
-    content_type = response.headers.get('content-type', '').lower()
-    if 'jpeg' in content_type or 'jpg' in content_type:
-        return '.jpg'
-    elif 'png' in content_type:
-        return '.png'
-    elif 'gif' in content_type:
-        return '.gif'
-    elif 'webp' in content_type:
-        return '.webp'
-    elif 'bmp' in content_type:
-        return '.bmp'
-
-    # 最后尝试从内容检测
-    return get_image_extension_from_content(response.content)
-
-def download_image(url: str, folder_path: str, img_idx: int) -> tuple[bool, str]:
-    """下载图片到指定文件夹，返回是否成功和实际文件名"""
-    try:
-        # 为GitHub用户图片使用特殊的请求头
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Cache-Control': 'no-cache',
-            'Pragma': 'no-cache',
-            'Sec-Fetch-Dest': 'image',
-            'Sec-Fetch-Mode': 'no-cors',
-            'Sec-Fetch-Site': 'cross-site'
-        }
+    """从body中提取图片URL并按文档顺序替换为 [IMAGE_i] 标签"""
+    return replace_images(body)
 
-        # 如果是GitHub API token，则添加授权头
-        if 'api.github.com' in url or 'github.com' in url:
-            if GITHUB_TOKEN:
-                headers['Authorization'] = f'Bearer {GITHUB_TOKEN}'
-
-        print(f"正在下载图片 {img_idx}: {url}")
-
-        # 使用session进行请求，支持重试
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = requests.get(url, headers=headers, timeout=30, allow_redirects=True)
-
-                # 检查响应状态
-                if response.status_code == 200:
-                    # 检查内容是否为图片
-                    content_type = response.headers.get('content-type', '').lower()
-                    if not any(img_type in content_type for img_type in ['image/', 'application/octet-stream']):
-                        print(f"警告: URL {url} 返回的内容类型不是图片: {content_type}")
-                        if len(response.content) < 1024:  # 如果内容很小，可能是错误信息
-                            print(f"响应内容: {response.text[:200]}")
-                            continue
-
-                    # 获取正确的文件扩展名
-                    extension = get_image_extension_from_url_and_response(url, response)
-                    filename = f"IMAGE_{img_idx}{extension}"
-                    filepath = os.path.join(folder_path, filename)
-
-                    with open(filepath, 'wb') as f:
-                        f.write(response.content)
-
-                    print(f"成功下载图片: {filename} (大小: {len(response.content)} 字节)")
-                    return True, filename
-
-                elif response.status_code == 404:
-                    print(f"图片不存在 (404): {url}")
-                    break  # 不重试404错误
-                elif response.status_code == 403:
-                    print(f"访问被拒绝 (403): {url}")
-                    break  # 不重试403错误
-                elif response.status_code == 400:
-                    print(f"请求错误 (400): {url}")
-                    if attempt < max_retries - 1:
-                        print(f"等待 {attempt + 1} 秒后重试...")
-                        time.sleep(attempt + 1)
-                        continue
-                    else:
-                        break
-                else:
-                    print(f"HTTP错误 {response.status_code}: {url}")
-                    if attempt < max_retries - 1:
-                        print(f"等待 {attempt + 1} 秒后重试...")
-                        time.sleep(attempt + 1)
-                        continue
-                    else:
-                        break
-
-            except requests.exceptions.Timeout:
-                print(f"请求超时 (尝试 {attempt + 1}/{max_retries}): {url}")
-                if attempt < max_retries - 1:
-                    time.sleep(attempt + 1)
-                    continue
-                else:
-                    break
-            except requests.exceptions.ConnectionError as e:
-                print(f"连接错误 (尝试 {attempt + 1}/{max_retries}): {url} - {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(attempt + 1)
-                    continue
-                else:
-                    break
-            except Exception as e:
-                print(f"未知错误 (尝试 {attempt + 1}/{max_retries}): {url} - {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(attempt + 1)
-                    continue
-                else:
-                    break
-
-        # 如果所有重试都失败，创建一个占位符文件
-        placeholder_filename = f"IMAGE_{img_idx}_FAILED.txt"
-        placeholder_path = os.path.join(folder_path, placeholder_filename)
-        with open(placeholder_path, 'w', encoding='utf-8') as f:
-            f.write(f"图片下载失败\n原始URL: {url}\n错误: 无法下载图片")
-
-        print(f"图片下载失败，已创建占位符文件: {placeholder_filename}")
-        return False, placeholder_filename
-
-    except Exception as e:
-        print(f"下载图片时发生异常 {url}: {e}")
-        # 创建错误占位符文件
-        error_filename = f"IMAGE_{img_idx}_ERROR.txt"
-        error_path = os.path.join(folder_path, error_filename)
-        try:
-            with open(error_path, 'w', encoding='utf-8') as f:
-                f.write(f"图片下载异常\n原始URL: {url}\n错误: {str(e)}")
-        except:
-            pass
-        return False, error_filename
 def get_commit_files(owner: str, repo: str, commit_hash: str) -> Dict[str, List[str]]:
     """获取指定commit修改的文件列表，按状态分类"""
     empty_result = {'modified': [], 'added': [], 'removed': [], 'added_paths': []}
 
-    try:
-        # 使用GitHub API获取commit信息
-        api_url = f"https://api.github.com/repos/{owner}/{repo}/commits/{commit_hash}"
-        print(f"正在获取commit {commit_hash[:7]} 的文件信息...")
-
-        response = make_api_request_with_retry(api_url)
-        if response is None:
-            print(f"错误: 无法获取commit {commit_hash[:7]} 的信息，所有重试都失败")
-            return empty_result
-
-        if response.status_code == 200:
-            commit_data = response.json()
-            result = {
-                'modified': [],  # 修改的文件
-                'added': [],     # 新增的文件
-                'removed': [],   # 删除的文件
-                'added_paths': []  # 新增文件的路径（用于路径统计）
-            }
-
-            if 'files' in commit_data:
-                total_files = len(commit_data['files'])
-                valid_files = 0
-
-                for file_info in commit_data['files']:
-                    filename = file_info['filename']
-                    status = file_info['status']
-
-                    # 只处理有效的源代码文件
-                    if not is_valid_file(filename):
-                        continue
-
-                    valid_files += 1
-
-                    if status == 'modified':
-                        result['modified'].append(filename)
-                    elif status == 'added':
-                        result['added'].append(filename)
-                        # 提取新增文件的路径（目录部分）
-                        file_path = os.path.dirname(filename)
-                        if file_path and file_path not in result['added_paths']:
-                            result['added_paths'].append(file_path)
-                    elif status == 'removed':
-                        result['removed'].append(filename)
-                    # 忽略 'renamed' 状态的文件
-
-                return result
-            else:
-                print(f"警告: commit {commit_hash[:7]} 没有文件变更信息")
-                return empty_result
-
-        elif response.status_code == 404:
-            print(f"错误: commit {commit_hash[:7]} 不存在或仓库 {owner}/{repo} 不可访问")
-            return empty_result
-        elif response.status_code == 403:
-            print(f"错误: GitHub API访问被限制，可能是token问题或请求过于频繁 (commit: {commit_hash[:7]})")
-            return empty_result
-        elif response.status_code == 422:
-            print(f"错误: commit hash {commit_hash[:7]} 格式无效")
-            return empty_result
-        else:
-            print(f"错误: 获取commit {commit_hash[:7]} 失败，HTTP状态码: {response.status_code}")
-            print(f"响应内容: {response.text[:200]}...")
-            return empty_result
-
-    except json.JSONDecodeError as e:
-        print(f"错误: 解码GitHub API响应JSON失败 (commit: {commit_hash[:7]}): {e}")
+    commit_data = COMMIT_STORE.get(owner, repo, commit_hash, make_api_request_with_retry)
+    if commit_data is None:
         return empty_result
-    except Exception as e:
-        print(f"错误: 获取commit {commit_hash[:7]} 文件列表时发生未知错误: {type(e).__name__}: {e}")
+
+    result = {
+        'modified': [],  # 修改的文件
+        'added': [],     # 新增的文件
+        'removed': [],   # 删除的文件
+        'added_paths': []  # 新增文件的路径（用于路径统计）
+    }
+
+    if not commit_data['files']:
+        print(f"警告: commit {commit_hash[:7]} 没有文件变更信息")
         return empty_result
-def get_parent_commit(owner: str, repo: str, commit_hash: str) -> Optional[str]:
-    """获取指定commit的父commit"""
-    try:
-        api_url = f"https://api.github.com/repos/{owner}/{repo}/commits/{commit_hash}"
-        print(f"正在获取commit {commit_hash[:7]} 的父commit...")
 
-        response = make_api_request_with_retry(api_url)
-        if response is None:
-            print(f"错误: 无法获取commit {commit_hash[:7]} 的父commit，所有重试都失败")
-            return None
+    for file_info in commit_data['files']:
+        filename = file_info['filename']
+        status = file_info['status']
 
-        if response.status_code == 200:
-            commit_data = response.json()
-            if 'parents' in commit_data and len(commit_data['parents']) > 0:
-                parent_sha = commit_data['parents'][0]['sha']
+        # 只处理有效的源代码文件
+        if not is_valid_file(filename):
+            continue
 
-                return parent_sha
-            else:
-                print(f"警告: commit {commit_hash[:7]} 没有父commit（可能是初始commit）")
-                return None
-        elif response.status_code == 404:
-            print(f"错误: commit {commit_hash[:7]} 不存在或仓库 {owner}/{repo} 不可访问")
-            return None
-        elif response.status_code == 403:
-            print(f"错误: GitHub API访问被限制，无法获取父commit (commit: {commit_hash[:7]})")
-            return None
-        else:
-            print(f"错误: 获取父commit失败，HTTP状态码: {response.status_code} (commit: {commit_hash[:7]})")
-            return None
-
-    except json.JSONDecodeError as e:
-        print(f"错误: 解析父commit响应JSON失败 (commit: {commit_hash[:7]}): {e}")
-        return None
-    except Exception as e:
-        print(f"错误: 获取父commit时发生未知错误 (commit: {commit_hash[:7]}): {type(e).__name__}: {e}")
+        if status == 'modified':
+            result['modified'].append(filename)
+        elif status == 'added':
+            result['added'].append(filename)
+            # 提取新增文件的路径（目录部分）
+            file_path = os.path.dirname(filename)
+            if file_path and file_path not in result['added_paths']:
+                result['added_paths'].append(file_path)
+        elif status == 'removed':
+            result['removed'].append(filename)
+        # 忽略 'renamed' 状态的文件
+
+    return result
+def get_parent_commit(owner: str, repo: str, commit_hash: str) -> Optional[str]:
+    """获取指定commit的父commit"""
+    commit_data = COMMIT_STORE.get(owner, repo, commit_hash, make_api_request_with_retry)
+    if commit_data is None:
+        print(f"错误: 无法获取commit {commit_hash[:7]} 的父commit")
         return None
+
+    if commit_data['parents']:
+        return commit_data['parents'][0]
+    print(f"警告: commit {commit_hash[:7]} 没有父commit（可能是初始commit）")
+    return None
 def get_commit_time(commit_hash: str, owner: str, repo: str) -> int:
     """获取commit的时间戳"""
-    try:
-        api_url = f"https://api.github.com/repos/{owner}/{repo}/commits/{commit_hash}"
-
-        response = make_api_request_with_retry(api_url)
-        if response is None:
-            print(f"错误: 无法获取commit {commit_hash[:7]} 的时间，所有重试都失败")
-            return 0
-
-        if response.status_code == 200:
-            commit_data = response.json()
-
-            if 'commit' not in commit_data:
-                print(f"错误: commit {commit_hash[:7]} 响应中缺少commit信息")
-                return 0
-
-            if 'committer' not in commit_data['commit']:
-                print(f"错误: commit {commit_hash[:7]} 响应中缺少committer信息")
-                return 0
-
-            if 'date' not in commit_data['commit']['committer']:
-                print(f"错误: commit {commit_hash[:7]} 响应中缺少date信息")
-                return 0
-
-            # 获取commit时间
-            commit_time = commit_data['commit']['author']['date']
-            # 转换为时间戳
-            from datetime import datetime
-            dt = datetime.fromisoformat(commit_time.replace('Z', '+00:00'))
-            timestamp = int(dt.timestamp())
-
-            return timestamp
-
-        elif response.status_code == 404:
-            print(f"错误: commit {commit_hash[:7]} 不存在或仓库 {owner}/{repo} 不可访问")
-            return 0
-        elif response.status_code == 403:
-            print(f"错误: GitHub API访问被限制，无法获取commit时间 (commit: {commit_hash[:7]})")
-            return 0
-        elif response.status_code == 422:
-            print(f"错误: commit hash {commit_hash[:7]} 格式无效")
-            return 0
-        else:
-            print(f"错误: 获取commit时间失败，HTTP状态码: {response.status_code} (commit: {commit_hash[:7]})")
-            print(f"响应内容: {response.text[:200]}...")
-            return 0
-
-    except ValueError as e:
-        print(f"错误: 时间格式解析失败 (commit: {commit_hash[:7]}): {e}")
-        return 0
-    except json.JSONDecodeError as e:
-        print(f"错误: 解析commit时间响应JSON失败 (commit: {commit_hash[:7]}): {e}")
+    commit_data = COMMIT_STORE.get(owner, repo, commit_hash, make_api_request_with_retry)
+    if commit_data is None:
+        print(f"错误: 无法获取commit {commit_hash[:7]} 的时间")
         return 0
-    except Exception as e:
-        print(f"错误: 获取commit时间时发生未知错误 (commit: {commit_hash[:7]}): {type(e).__name__}: {e}")
-        return 0
-
-def find_oldest_commit(commits: List[str], owner: str, repo: str) -> str:
-    """找到最老的commit"""
+    return commit_data['author_date']
+
+def order_issue_commits(owner: str, repo: str, commits: List[str],
+                        mirrors: Dict[Tuple[str, str], Optional[str]]) -> Tuple[List[str], Optional[str]]:
+    """
+    返回 (按顺序排列的commit, 需要检出的base commit)。
+    优先用本地镜像的commit图计算（拓扑顺序、PR外部父commit的merge-base，见 git_mirror.resolve_pr_commits），
+    作者时间在rebase后不可靠，而且每个commit都要请求一次API；每个仓库在一次运行中只clone或fetch一次镜像。
+    镜像不可用或commit无法获取时退回到按作者时间排序、通过API查询最老commit的父commit。
+    """
     if not commits:
-        return None
-
-    oldest_commit = commits[0]
-    oldest_time = get_commit_time(commits[0], owner, repo)
-
-    for commit in commits[1:]:
-        commit_time = get_commit_time(commit, owner, repo)
-        if commit_time < oldest_time:
-            oldest_time = commit_time
-            oldest_commit = commit
-        time.sleep(0.5)  # 避免API请求过快
+        return [], None
+    key = (owner, repo)
+    if key not in mirrors:
+        try:
+            mirrors[key] = ensure_mirror(owner, repo, update=True)
+        except subprocess.CalledProcessError as e:
+            print(f"警告: 无法创建或更新镜像 {owner}/{repo}，改用API: {e.stderr.strip()}")
+            mirrors[key] = None
+    mirror = mirrors[key]
+    if mirror is not None and not ensure_commits(mirror, commits):
+        return resolve_pr_commits(mirror, commits)
+
+    sorted_commits = sorted(commits, key=lambda c: get_commit_time(c, owner, repo))
+    oldest_commit = sorted_commits[0]
+    return sorted_commits, get_parent_commit(owner, repo, oldest_commit) or f"{oldest_commit}^"
+
+def make_git_commands(owner: str, repo: str, base_commit: Optional[str]) -> str:
+    """
+    生成git_commands.sh：从共享的bare镜像创建该issue的工作树（镜像不存在时才clone一次），
+    不再为每个issue完整clone仓库。批量创建和清理工作树见 materialize_checkouts.py
+    """
+    rev = base_commit or 'HEAD'
+    fetch_sha = rev.rstrip('^')
+    return f"""#!/bin/bash
+set -e
+MIRROR="${{VFLOC_MIRROR_ROOT:-{MIRROR_ROOT}}}/{owner}/{repo}.git"
+if [ ! -d "$MIRROR" ]; then
+    git clone --mirror https://github.com/{owner}/{repo}.git "$MIRROR"
+fi
+git -C "$MIRROR" cat-file -e "{fetch_sha}^{{commit}}" 2>/dev/null || git -C "$MIRROR" fetch origin {fetch_sha}
+if [ ! -d {repo} ]; then
+    git -C "$MIRROR" worktree add --detach "$PWD/{repo}" {rev}
+fi
+cd {repo}
+"""
 
-    return oldest_commit
 
 def process_issue_data(json_file_path: str, operation_dir: str):
     """处理JSON文件中的issue数据"""
@@ -589,6 +308,9 @@ def process_issue_data(json_file_path: str, operation_dir: str):
     # 创建operation目录
     os.makedirs(operation_dir, exist_ok=True)
 
+    image_jobs = []
+    mirrors = {}
+
     for idx, issue in enumerate(issues_data, 1):
         print(f"处理第 {idx} 个issue: {issue['title']}")
 
@@ -603,51 +325,20 @@ def process_issue_data(json_file_path: str, operation_dir: str):
         folder_path = os.path.join(operation_dir, folder_name)
         os.makedirs(folder_path, exist_ok=True)
 
-        # 处理图片
+        # 处理图片，下载任务统一在最后并发执行
         processed_body, image_urls = extract_images_from_body(issue['body'])
-
-        # 下载图片
         for img_idx, img_url in enumerate(image_urls, 1):
-            success, actual_filename = download_image(img_url, folder_path, img_idx)
-            if success:
-                print(f"图片 {img_idx} 下载成功: {actual_filename}")
-            time.sleep(1)  # 避免请求过快
+            image_jobs.append(make_job(img_url, folder_path, img_idx))
 
         # 创建git命令文件
         git_commands_file = os.path.join(folder_path, "git_commands.sh")
 
-        # 找到最老的commit
+        # 检出PR之前的代码状态；没有commit时检出默认分支
         commits = issue.get('commits', [])
-        if commits:
-            oldest_commit = find_oldest_commit(commits, owner, repo)
-            if oldest_commit:
-                parent_commit = get_parent_commit(owner, repo, oldest_commit)
-
-                if parent_commit:
-                    git_commands = f"""#!/bin/bash
-git clone https://github.com/{owner}/{repo}.git
-cd {repo}
-git checkout {parent_commit}
-"""
-                else:
-                    git_commands = f"""#!/bin/bash
-git clone https://github.com/{owner}/{repo}.git
-cd {repo}
-git checkout {oldest_commit}^
-"""
-            else:
-                git_commands = f"""#!/bin/bash
-git clone https://github.com/{owner}/{repo}.git
-cd {repo}
-"""
-        else:
-            git_commands = f"""#!/bin/bash
-git clone https://github.com/{owner}/{repo}.git
-cd {repo}
-"""
+        ordered_commits, base_commit = order_issue_commits(owner, repo, commits, mirrors)
 
         with open(git_commands_file, 'w', encoding='utf-8') as f:
-            f.write(git_commands)
+            f.write(make_git_commands(owner, repo, base_commit))
 
         # 创建prompt文件
         prompt_file = os.path.join(folder_path, "prompt.txt")
@@ -691,10 +382,8 @@ Please think step-by-step, but return only the JSON object with the two fields.
         all_added_paths = set()     # 新增文件��路径
         added_files_tracker = set()  # 跟踪所有新增过的文件
 
-        # 按时间顺序处理commits（从最老到最新）
-        sorted_commits = sorted(commits, key=lambda c: get_commit_time(c, owner, repo))
-
-        for commit in sorted_commits:
+        # 按拓扑顺序处理commits（从最老到最新）
+        for commit in ordered_commits:
             commit_files = get_commit_files(owner, repo, commit)
 
             # 处理新增文件
@@ -715,8 +404,6 @@ Please think step-by-step, but return only the JSON object with the two fields.
                 if removed_file not in added_files_tracker:
                     all_modified_files.add(removed_file)
 
-            time.sleep(1)  # 避免API请求过快
-
         # 创建ground truth文件
         ground_truth_file = os.path.join(folder_path, "ground_truth.json")
         ground_truth_data = {
@@ -724,6 +411,7 @@ Please think step-by-step, but return only the JSON object with the two fields.
             "issue_number": issue['number'],
             "repository": f"{owner}/{repo}",
             "commits": commits,
+            "base_commit": base_commit,                          # 检出的commit，None表示默认分支
             "modified_files": sorted(list(all_modified_files)),  # 修改和删除的文件
             "added_paths": sorted(list(all_added_paths))         # 新增文件的路径
         }
@@ -732,14 +420,20 @@ Please think step-by-step, but return only the JSON object with the two fields.
             json.dump(ground_truth_data, f, indent=2, ensure_ascii=False)
 
         print(f"完成处理文件夹 {folder_name}")
-        time.sleep(2)  # 避免请求过快
         # 加上break用于简单测试
         # break
 
+    # 并发下载所有图片，失败的进入重试队列，可运行image_downloader.py单独重试
+    download_images(image_jobs, operation_dir=operation_dir)
+    # 缩小和重新压缩图片，[IMAGE_i] 编号不变
+    if NORMALIZE_IMAGES:
+        normalize_operation_dir(operation_dir)
+
 def main():
     # 配置路径
-    json_file_path = (f"../issue_results/{folder}/{folder_to_name[folder]}_issues_with_code_filtered.json")
-    operation_dir = f"../operation/{folder}"
+    json_file_path = os.getenv("VFLOC_INPUT",
+                               f"../issue_results/{folder}/{folder_to_name[folder]}_issues_with_code_filtered.json")
+    operation_dir = os.getenv("VFLOC_OUTPUT", f"../operation/{folder}")
 
     # 处理数据
     process_issue_data(json_file_path, operation_dir)
@@ -0,0 +1,453 @@
+"""
+基于asyncio的图片批量下载
+
+generate_operation_folders.py 原来逐张同步下载图片，每张之后固定 sleep 1 秒。
+这里改为共享连接池的并发下载：按host限制并发数、有限次数重试、边下载边写文件。
+下载失败的图片仍然生成 IMAGE_i_FAILED.txt 占位文件，同时记录到重试队列，
+之后可以单独运行本脚本重新下载，而不需要重新生成operation文件夹。
+
+下载的图片保存在按内容寻址的存储中（image_store.py），operation文件夹中是它的硬链接：
+已经下载过的URL不再请求，重新生成operation文件夹几乎不消耗图片流量。
+
+响应按块写入临时文件（不使用存储时为 IMAGE_i.ext.part），完成后再rename，内存占用与图片大小无关；
+超过 MAX_IMAGE_BYTES 的图片中止下载。格式优先根据文件头判断（包括AVIF、HEIC、SVG），
+无法判断格式的响应按下载失败处理，不再默认保存为.jpg。
+SVG和HEIC既不能被 normalize_images.py（Pillow）打开，也不在 run_inference.py 支持的格式中，
+同样按下载失败处理，生成占位文件并进入重试队列。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+from dotenv import load_dotenv
+
+from image_store import ImageStore
+from token_pool import get_token_pool, load_tokens
+
+load_dotenv()
+
+folder = "florisboard"  # 示例仓库，直接运行本脚本时重新下载该仓库失败的图片
+
+RETRY_QUEUE_FILENAME = "image_retry_queue.jsonl"
+
+IMAGE_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'image/webp,image/apng,image/*,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Cache-Control': 'no-cache',
+    'Pragma': 'no-cache',
+    'Sec-Fetch-Dest': 'image',
+    'Sec-Fetch-Mode': 'no-cors',
+    'Sec-Fetch-Site': 'cross-site'
+}
+
+CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 512  # 判断格式时读取的文件头长度（SVG需要跳过XML声明）
+MAX_IMAGE_BYTES = 50 * 1024 * 1024  # 单张图片的大小上限
+
+# 使用按内容寻址的图片存储；REVALIDATE为True时已存储的URL也发送条件请求（If-None-Match）确认未变化，
+# 否则直接使用存储中的图片（GitHub的附件地址内容不会改变）
+USE_IMAGE_STORE = True
+REVALIDATE = False
+
+
+CONTENT_TYPE_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/jpg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/bmp': '.bmp',
+    'image/avif': '.avif',
+    'image/heic': '.heic',
+    'image/heif': '.heic',
+    'image/svg+xml': '.svg',
+    'image/tiff': '.tiff'
+}
+
+# 能识别但下游无法使用的格式，按下载失败处理
+UNSUPPORTED_EXTENSIONS = {'.heic', '.svg'}
+
+# ISO BMFF（ftyp box）中的品牌
+AVIF_BRANDS = {b'avif', b'avis'}
+HEIC_BRANDS = {b'heic', b'heix', b'hevc', b'hevx', b'heim', b'heis', b'mif1', b'msf1'}
+
+
+class ImageTooLargeError(Exception):
+    """图片超过大小上限"""
+
+
+def get_image_extension_from_content(content: bytes) -> Optional[str]:
+    """从图片内容的文件头检测图片格式，无法识别时返回None"""
+    if content.startswith(b'\xff\xd8\xff'):
+        return '.jpg'
+    elif content.startswith(b'\x89PNG\r\n\x1a\n'):
+        return '.png'
+    elif content.startswith(b'GIF87a') or content.startswith(b'GIF89a'):
+        return '.gif'
+    elif content.startswith(b'RIFF') and content[8:12] == b'WEBP':
+        return '.webp'
+    elif content.startswith(b'BM'):
+        return '.bmp'
+    elif content.startswith(b'II*\x00') or content.startswith(b'MM\x00*'):
+        return '.tiff'
+    elif content[4:8] == b'ftyp':
+        # 主品牌之后是兼容品牌列表，AVIF文件的主品牌也可能是通用的mif1
+        box_size = int.from_bytes(content[:4], 'big')
+        brands = {content[8:12]} | {content[i:i + 4] for i in range(16, min(box_size, len(content)) - 3, 4)}
+        if brands & AVIF_BRANDS:
+            return '.avif'
+        if brands & HEIC_BRANDS:
+            return '.heic'
+        return None
+
+    text = content.lstrip(b'\xef\xbb\xbf \t\r\n').lower()
+    if text.startswith(b'<svg') or (text.startswith((b'<?xml', b'<!doctype svg', b'<!--')) and b'<svg' in text):
+        return '.svg'
+    return None
+
+
+def get_image_extension(url: str, content_type: str, head: bytes) -> Optional[str]:
+    """依次从文件头、Content-Type和URL推断图片扩展名，都无法判断时返回None"""
+    extension = get_image_extension_from_content(head)
+    if extension:
+        return extension
+
+    extension = CONTENT_TYPE_EXTENSIONS.get(content_type.split(';')[0].strip().lower())
+    if extension:
+        return extension
+
+    path = urlparse(url).path.lower()
+    for ext in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.avif', '.heic', '.svg']:
+        if path.endswith(ext):
+            return ext
+    return None
+
+
+def _is_rate_limited(response: aiohttp.ClientResponse) -> bool:
+    """GitHub的速率限制响应（403/429，且额度为0或带有Retry-After）"""
+    if response.status not in (403, 429):
+        return False
+    return response.headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in response.headers
+
+
+async def _read_head(content: aiohttp.StreamReader, size: int = SNIFF_BYTES) -> bytes:
+    """读取至少size字节的文件头（响应更短时读到结尾为止）"""
+    head = b''
+    while len(head) < size:
+        chunk = await content.read(size - len(head))
+        if not chunk:
+            break
+        head += chunk
+    return head
+
+
+def make_job(url: str, folder_path: str, img_idx: int) -> Dict:
+    """构造一个下载任务"""
+    return {'url': url, 'folder_path': folder_path, 'img_idx': img_idx}
+
+
+def write_placeholder(job: Dict, error: str, failed: bool = True) -> str:
+    """下载失败时写入占位文件，返回占位文件名"""
+    suffix = 'FAILED' if failed else 'ERROR'
+    title = '图片下载失败' if failed else '图片下载异常'
+    filename = f"IMAGE_{job['img_idx']}_{suffix}.txt"
+    try:
+        with open(os.path.join(job['folder_path'], filename), 'w', encoding='utf-8') as f:
+            f.write(f"{title}\n原始URL: {job['url']}\n错误: {error}")
+    except OSError:
+        pass
+    return filename
+
+
+def remove_placeholders(job: Dict):
+    """下载成功后删除该图片之前留下的占位文件"""
+    for suffix in ('FAILED', 'ERROR'):
+        path = os.path.join(job['folder_path'], f"IMAGE_{job['img_idx']}_{suffix}.txt")
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _link_stored(store: ImageStore, job: Dict, entry: Dict) -> Dict:
+    """从图片存储链接到operation文件夹，不下载"""
+    filename = f"IMAGE_{job['img_idx']}{entry['extension']}"
+    store.link(entry['sha256'], os.path.join(job['folder_path'], filename))
+    store.linked += 1
+    remove_placeholders(job)
+    print(f"使用已存储的图片: {job['folder_path']}/{filename}")
+    return {**job, 'success': True, 'filename': filename, 'error': None}
+
+
+async def _stream_to_file(response: aiohttp.ClientResponse, head: bytes, f, max_bytes: int):
+    """把文件头和剩余响应按块写入f，返回 (字节数, sha256)；超过max_bytes时抛出ImageTooLargeError"""
+    digest = hashlib.sha256(head)
+    size = len(head)
+    f.write(head)
+    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_bytes:
+            raise ImageTooLargeError(f'超过大小上限 {max_bytes} 字节')
+        f.write(chunk)
+        digest.update(chunk)
+    return size, digest.hexdigest()
+
+
+async def _save_response(response: aiohttp.ClientResponse, head: bytes, path: str,
+                         store: Optional[ImageStore], url: str, extension: str,
+                         max_bytes: int = MAX_IMAGE_BYTES) -> int:
+    """
+    把响应内容流式写入临时文件，完整下载后再rename到path（使用存储时先入库再链接），返回字节数。
+    中途出错或超过大小上限时删除临时文件，path保持不变。
+    """
+    if store is None:
+        part_path = path + '.part'
+        try:
+            with open(part_path, 'wb') as f:
+                size, _ = await _stream_to_file(response, head, f, max_bytes)
+            os.replace(part_path, path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        return size
+
+    tmp = store.temp_file()
+    try:
+        with tmp:
+            size, sha256 = await _stream_to_file(response, head, tmp, max_bytes)
+        sha256 = store.add_file(tmp.name, sha256)
+    finally:
+        if os.path.exists(tmp.name):
+            os.remove(tmp.name)
+    store.record(url, sha256, extension, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+    store.link(sha256, path)
+    return size
+
+
+async def _download_one(session: aiohttp.ClientSession, job: Dict, max_retries: int,
+                        store: Optional[ImageStore] = None, revalidate: bool = REVALIDATE,
+                        max_bytes: int = MAX_IMAGE_BYTES) -> Dict:
+    """下载单张图片，返回带有 success/filename/error 字段的结果"""
+    url = job['url']
+    entry = store.lookup(url) if store is not None else None
+    if entry is not None and entry['extension'] in UNSUPPORTED_EXTENSIONS:
+        entry = None  # 以前的版本存入的SVG/HEIC不再使用
+    if entry is not None and not revalidate:
+        return _link_stored(store, job, entry)
+
+    headers = dict(IMAGE_HEADERS)
+    if entry is not None:
+        headers.update(store.conditional_headers(entry))
+    # GitHub上的图片（如私有仓库附件）从令牌池取token，额度耗尽的token由令牌池换掉
+    pool = get_token_pool() if 'github.com' in urlparse(url).netloc and load_tokens() else None
+
+    error = '无法下载图片'
+    for attempt in range(max_retries):
+        token = None
+        if pool is not None:
+            # 所有token都耗尽时acquire会阻塞等待，放到线程中执行，不阻塞其他下载
+            token = await asyncio.get_running_loop().run_in_executor(None, pool.acquire, 'core')
+            headers['Authorization'] = f'Bearer {token}'
+        try:
+            async with session.get(url, headers=headers, allow_redirects=True) as response:
+                if token is not None:
+                    pool.update_from_headers(token, response.headers, _is_rate_limited(response), 'core')
+                if response.status == 304 and entry is not None:
+                    store.touch(url)
+                    return _link_stored(store, job, entry)
+                if response.status == 200:
+                    content_type = response.headers.get('content-type', '')
+                    if response.content_length is not None and response.content_length > max_bytes:
+                        error = f'超过大小上限: {response.content_length} 字节'
+                        print(f"图片过大 ({response.content_length} 字节)，跳过: {url}")
+                        break
+
+                    head = await _read_head(response.content)
+                    extension = get_image_extension(url, content_type, head)
+                    if extension is None:
+                        print(f"警告: URL {url} 返回的内容无法识别为图片: {content_type}")
+                        print(f"响应内容: {head[:200].decode('utf-8', errors='replace')}")
+                        error = f'非图片响应: {content_type}'
+                        break  # 同一URL重试得到的仍是同样的内容
+                    if extension in UNSUPPORTED_EXTENSIONS:
+                        print(f"不支持的图片格式 {extension}，按下载失败处理: {url}")
+                        error = f'不支持的图片格式: {extension}'
+                        break
+
+                    filename = f"IMAGE_{job['img_idx']}{extension}"
+                    try:
+                        size = await _save_response(response, head, os.path.join(job['folder_path'], filename),
+                                                    store, url, extension, max_bytes)
+                    except ImageTooLargeError as e:
+                        error = str(e)
+                        print(f"图片过大，已中止下载: {url}")
+                        break
+
+                    remove_placeholders(job)
+                    print(f"成功下载图片: {job['folder_path']}/{filename} (大小: {size} 字节)")
+                    return {**job, 'success': True, 'filename': filename, 'error': None}
+
+                error = f'HTTP {response.status}'
+                if token is not None and _is_rate_limited(response):
+                    print(f"token ...{token[-4:]} 的额度已耗尽，换用其他token重试: {url}")
+                    wait_time = 0
+                else:
+                    if response.status in (403, 404):
+                        print(f"图片不可访问 ({response.status}): {url}")
+                        break  # 不重试403/404错误
+                    print(f"HTTP错误 {response.status} (尝试 {attempt + 1}/{max_retries}): {url}")
+                    retry_after = response.headers.get('Retry-After')
+                    wait_time = int(retry_after) if retry_after and retry_after.isdigit() else attempt + 1
+
+        except asyncio.TimeoutError:
+            error = '请求超时'
+            print(f"请求超时 (尝试 {attempt + 1}/{max_retries}): {url}")
+            wait_time = attempt + 1
+        except aiohttp.ClientError as e:
+            error = f'{type(e).__name__}: {e}'
+            print(f"连接错误 (尝试 {attempt + 1}/{max_retries}): {url} - {e}")
+            wait_time = attempt + 1
+
+        if attempt < max_retries - 1:
+            await asyncio.sleep(wait_time)
+
+    filename = write_placeholder(job, error)
+    print(f"图片下载失败，已创建占位符文件: {job['folder_path']}/{filename}")
+    return {**job, 'success': False, 'filename': filename, 'error': error}
+
+
+async def _download_all(jobs: List[Dict], total_limit: int, per_host_limit: int,
+                        max_retries: int, timeout: int, store: Optional[ImageStore] = None,
+                        revalidate: bool = REVALIDATE, max_bytes: int = MAX_IMAGE_BYTES) -> List[Dict]:
+    connector = aiohttp.TCPConnector(limit=total_limit, limit_per_host=per_host_limit)
+    # 所有任务同时提交，大部分在连接池中排队；total和connect超时都包含排队时间，
+    # 这里只限制建立连接和两次读取之间的时间，只在请求真正进行时计时
+    client_timeout = aiohttp.ClientTimeout(total=None, connect=None, sock_connect=timeout, sock_read=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout) as session:
+        if store is None:
+            tasks = [_download_one(session, job, max_retries, max_bytes=max_bytes) for job in jobs]
+        else:
+            # 同一URL的任务依次执行，第一个下载入库后其余直接链接
+            url_locks = {job['url']: asyncio.Lock() for job in jobs}
+
+            async def download_locked(job):
+                async with url_locks[job['url']]:
+                    return await _download_one(session, job, max_retries, store, revalidate, max_bytes)
+
+            tasks = [download_locked(job) for job in jobs]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    final_results = []
+    for job, result in zip(jobs, results):
+        if isinstance(result, BaseException):
+            print(f"下载图片时发生异常 {job['url']}: {result}")
+            filename = write_placeholder(job, str(result), failed=False)
+            result = {**job, 'success': False, 'filename': filename, 'error': str(result)}
+        final_results.append(result)
+    return final_results
+
+
+def load_retry_queue(operation_dir: str) -> List[Dict]:
+    """读取重试队列；队列文件不存在时从已有的占位文件重建"""
+    queue_path = os.path.join(operation_dir, RETRY_QUEUE_FILENAME)
+    jobs = []
+    if os.path.exists(queue_path):
+        with open(queue_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    jobs.append(make_job(entry['url'], os.path.join(operation_dir, entry['folder']), entry['img_idx']))
+        return jobs
+
+    placeholder_pattern = re.compile(r'IMAGE_(\d+)_(?:FAILED|ERROR)\.txt$')
+    for folder_name in sorted(os.listdir(operation_dir)):
+        folder_path = os.path.join(operation_dir, folder_name)
+        if not os.path.isdir(folder_path):
+            continue
+        for filename in sorted(os.listdir(folder_path)):
+            match = placeholder_pattern.match(filename)
+            if not match:
+                continue
+            with open(os.path.join(folder_path, filename), 'r', encoding='utf-8') as f:
+                url_match = re.search(r'原始URL: (\S+)', f.read())
+            if url_match:
+                jobs.append(make_job(url_match.group(1), folder_path, int(match.group(1))))
+    return jobs
+
+
+def save_retry_queue(operation_dir: str, failed_results: List[Dict]):
+    """把失败的下载写入重试队列（覆盖写），队列为空时删除文件"""
+    queue_path = os.path.join(operation_dir, RETRY_QUEUE_FILENAME)
+    if not failed_results:
+        if os.path.exists(queue_path):
+            os.remove(queue_path)
+        return
+    with open(queue_path, 'w', encoding='utf-8') as f:
+        for result in failed_results:
+            entry = {
+                'folder': os.path.relpath(result['folder_path'], operation_dir),
+                'img_idx': result['img_idx'],
+                'url': result['url'],
+                'error': result['error']
+            }
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def download_images(jobs: List[Dict], operation_dir: Optional[str] = None, total_limit: int = 16,
+                    per_host_limit: int = 4, max_retries: int = 3, timeout: int = 60,
+                    use_store: bool = USE_IMAGE_STORE, revalidate: bool = REVALIDATE,
+                    max_bytes: int = MAX_IMAGE_BYTES) -> List[Dict]:
+    """
+    并发下载一批图片，返回每个任务的结果。
+    指定operation_dir时，失败的任务会合并进该目录的重试队列。
+    use_store时通过图片存储下载，已存储的URL直接链接（revalidate时先发送条件请求）。
+    """
+    if not jobs:
+        return []
+    print(f"开始并发下载 {len(jobs)} 张图片 (总并发 {total_limit}, 单host并发 {per_host_limit})...")
+    store = ImageStore() if use_store else None
+    try:
+        results = asyncio.run(_download_all(jobs, total_limit, per_host_limit, max_retries, timeout,
+                                            store, revalidate, max_bytes))
+    finally:
+        if store is not None:
+            store.close()
+
+    failed = [r for r in results if not r['success']]
+    reused = f"（其中 {store.linked} 张直接使用已存储的图片）" if store is not None else ""
+    print(f"图片下载完成: 成功 {len(results) - len(failed)} 张{reused}, 失败 {len(failed)} 张")
+
+    if operation_dir is not None:
+        # 保留旧队列中本批次没有涉及的项
+        previous = []
+        if os.path.exists(os.path.join(operation_dir, RETRY_QUEUE_FILENAME)):
+            done_keys = {(os.path.abspath(r['folder_path']), r['img_idx']) for r in results}
+            for job in load_retry_queue(operation_dir):
+                if (os.path.abspath(job['folder_path']), job['img_idx']) not in done_keys:
+                    previous.append({**job, 'error': None})
+        save_retry_queue(operation_dir, previous + failed)
+    return results
+
+
+def drain_retry_queue(operation_dir: str, **kwargs) -> List[Dict]:
+    """重新下载重试队列中的图片，成功的从队列中移除"""
+    jobs = load_retry_queue(operation_dir)
+    if not jobs:
+        print("重试队列为空")
+        return []
+    results = download_images(jobs, **kwargs)
+    save_retry_queue(operation_dir, [r for r in results if not r['success']])
+    return results
+
+
+def main():
+    operation_dir = f"../operation/{folder}"
+    drain_retry_queue(operation_dir)
+
+
+if __name__ == "__main__":
+    main()
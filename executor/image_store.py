@@ -0,0 +1,119 @@
+"""
+按内容寻址的图片存储
+
+image_downloader.py 以前把每张截图单独下载到每个 {repo}_{issue} 文件夹，重新生成operation文件夹时
+所有图片都要重新下载一遍。这里把图片内容按sha256保存为 blobs/ab/abcdef... 文件，
+并在SQLite中记录 URL -> (sha256, 扩展名, ETag, Last-Modified)：
+- operation文件夹中的 IMAGE_i.ext 是blob的硬链接（不支持硬链接时复制），相同图片只占一份磁盘；
+  blob是只读的（0444），要修改operation文件夹中的图片只能写新文件再替换，不会改动其他issue共用的blob
+- 已经下载过的URL直接链接blob，不再请求；需要重新验证时带 If-None-Match / If-Modified-Since，
+  服务器返回304时同样直接链接
+
+默认位置为 issue_results/cache/images，可用环境变量 IMAGE_STORE_PATH 修改。
+"""
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from typing import Dict, Optional
+
+DEFAULT_STORE_PATH = os.getenv(
+    "IMAGE_STORE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'issue_results', 'cache', 'images')
+)
+
+
+class ImageStore:
+    """sha256命名的blob目录 + URL索引"""
+
+    def __init__(self, root: str = DEFAULT_STORE_PATH):
+        self.root = root
+        self.blob_root = os.path.join(root, 'blobs')
+        self.tmp_root = os.path.join(root, 'tmp')
+        os.makedirs(self.blob_root, exist_ok=True)
+        os.makedirs(self.tmp_root, exist_ok=True)
+        # 多个仓库并行生成operation文件夹时共用同一个索引
+        self._conn = sqlite3.connect(os.path.join(root, 'index.sqlite3'), timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                sha256 TEXT NOT NULL,
+                extension TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self.linked = 0  # 本次运行中直接从存储链接（没有下载内容）的图片数
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.blob_root, sha256[:2], sha256)
+
+    def lookup(self, url: str) -> Optional[Dict]:
+        """URL对应的已存储图片，blob文件已丢失时视为没有"""
+        row = self._conn.execute(
+            "SELECT sha256, extension, etag, last_modified FROM urls WHERE url = ?", (url,)
+        ).fetchone()
+        if row is None or not os.path.exists(self.blob_path(row[0])):
+            return None
+        return {'sha256': row[0], 'extension': row[1], 'etag': row[2], 'last_modified': row[3]}
+
+    def conditional_headers(self, entry: Optional[Dict]) -> Dict[str, str]:
+        """重新验证已存储图片时使用的条件请求头"""
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def temp_file(self):
+        """在存储目录中创建临时文件（与blob在同一文件系统，入库时可以直接rename）"""
+        return tempfile.NamedTemporaryFile(dir=self.tmp_root, delete=False)
+
+    def add_file(self, tmp_path: str, sha256: Optional[str] = None) -> str:
+        """把临时文件移入存储，返回sha256；相同内容已存在时丢弃临时文件"""
+        if sha256 is None:
+            digest = hashlib.sha256()
+            with open(tmp_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            sha256 = digest.hexdigest()
+        path = self.blob_path(sha256)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(tmp_path, 0o444)  # 临时文件默认只有所有者可读；blob被多个issue共用，设为只读
+            os.replace(tmp_path, path)
+        return sha256
+
+    def record(self, url: str, sha256: str, extension: str, etag: Optional[str] = None,
+               last_modified: Optional[str] = None):
+        self._conn.execute("INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?, ?, ?)",
+                           (url, sha256, extension, etag, last_modified, time.time()))
+        self._conn.commit()
+
+    def touch(self, url: str):
+        """重新验证后内容未变（304），更新验证时间"""
+        self._conn.execute("UPDATE urls SET fetched_at = ? WHERE url = ?", (time.time(), url))
+        self._conn.commit()
+
+    def link(self, sha256: str, dest_path: str):
+        """把blob放到dest_path：优先硬链接，跨文件系统等情况下复制"""
+        src = self.blob_path(sha256)
+        if os.path.exists(dest_path):
+            if os.path.samefile(src, dest_path):
+                return
+            os.remove(dest_path)
+        try:
+            os.link(src, dest_path)
+        except OSError:
+            shutil.copyfile(src, dest_path)
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,128 @@
+"""
+从共享bare镜像批量创建和清理operation文件夹的检出
+
+每个 {repo}_{issue} 文件夹的 git_commands.sh 原来都要完整clone一次仓库，同一仓库几百个issue就是几百份历史。
+这里每个仓库只保留一个bare镜像（git_mirror.py，默认 mirrors/{owner}/{repo}.git），
+按 ground_truth.json 中的 base_commit 为每个issue创建分离HEAD的 `git worktree`，工作树之间共享对象库，
+只占检出文件的磁盘空间。已经检出同一commit的工作树会跳过，评测完成后用 --prune 删除。
+
+工作树默认放在issue文件夹中（{issue_dir}/{repo}，与git_commands.sh的结果相同），
+也可以用 --checkout-root 放到其他目录（{checkout_root}/{repo}_{issue}/{repo}）。
+
+用法：
+    python materialize_checkouts.py                       # 为 ../operation/{folder} 创建工作树
+    python materialize_checkouts.py --prune               # 删除这些工作树
+    python materialize_checkouts.py --remote "file:///tmp/remotes/{owner}/{repo}.git"   # 使用本地仓库测试
+"""
+import argparse
+import json
+import os
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from git_mirror import (MIRROR_ROOT, add_worktree, ensure_mirror, mirror_path, prune_worktrees, resolve_commit,
+                        resolve_pr_commits)
+
+folder = os.getenv("VFLOC_REPO", "florisboard")  # 示例仓库，直接运行本脚本时处理该仓库
+
+
+def load_targets(operation_dir: str) -> List[Dict]:
+    """读取每个issue文件夹的 ground_truth.json，返回 [{'issue_dir', 'owner', 'repo', 'base_commit', 'commits'}]"""
+    targets = []
+    for name in sorted(os.listdir(operation_dir)):
+        path = os.path.join(operation_dir, name, 'ground_truth.json')
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            ground_truth = json.load(f)
+        owner, repo = ground_truth['repository'].split('/', 1)
+        targets.append({
+            'issue_dir': os.path.join(operation_dir, name),
+            'owner': owner,
+            'repo': repo,
+            'base_commit': ground_truth.get('base_commit'),
+            'commits': ground_truth.get('commits', [])
+        })
+    return targets
+
+
+def resolve_base(mirror: str, target: Dict) -> str:
+    """issue要检出的commit；旧版本生成的 ground_truth.json 没有 base_commit 时，按commit图从镜像中计算"""
+    if target['base_commit']:
+        return target['base_commit']
+    if not target['commits']:
+        return 'HEAD'
+    _, base = resolve_pr_commits(mirror, target['commits'])
+    return base or 'HEAD'
+
+
+def checkout_path(target: Dict, checkout_root: Optional[str] = None) -> str:
+    if checkout_root is None:
+        return os.path.join(target['issue_dir'], target['repo'])
+    return os.path.join(checkout_root, os.path.basename(target['issue_dir']), target['repo'])
+
+
+def materialize(operation_dir: str, checkout_root: Optional[str] = None, remote: Optional[str] = None,
+                mirror_root: str = MIRROR_ROOT, update: bool = False) -> Dict[str, int]:
+    """
+    为operation目录下每个issue创建工作树，返回统计信息。
+    remote为镜像不存在时clone的地址模板（可包含 {owner} 和 {repo}），默认为GitHub地址。
+    """
+    stats = {'created': 0, 'existing': 0, 'failed': 0}
+    mirrors: Dict[Tuple[str, str], str] = {}
+    for target in load_targets(operation_dir):
+        key = (target['owner'], target['repo'])
+        if key not in mirrors:
+            url = remote.format(owner=key[0], repo=key[1]) if remote else None
+            mirrors[key] = ensure_mirror(key[0], key[1], url=url, mirror_root=mirror_root, update=update)
+        mirror = mirrors[key]
+
+        path = checkout_path(target, checkout_root)
+        previous = resolve_commit(path, 'HEAD') if os.path.exists(os.path.join(path, '.git')) else None
+        try:
+            sha = add_worktree(mirror, path, resolve_base(mirror, target))
+        except (subprocess.CalledProcessError, ValueError, KeyError) as e:
+            stderr = getattr(e, 'stderr', None)
+            print(f"无法创建工作树 {path}: {(stderr or str(e)).strip()}")
+            stats['failed'] += 1
+            continue
+        if previous == sha:
+            stats['existing'] += 1
+        else:
+            stats['created'] += 1
+            print(f"已检出 {os.path.basename(target['issue_dir'])} -> {sha[:7]}")
+
+    print(f"工作树: 新建 {stats['created']} 个，已存在 {stats['existing']} 个，失败 {stats['failed']} 个")
+    return stats
+
+
+def prune(operation_dir: str, checkout_root: Optional[str] = None, mirror_root: str = MIRROR_ROOT) -> int:
+    """删除operation目录（或checkout_root）下由镜像创建的所有工作树，并清理镜像中失效的工作树记录"""
+    under = checkout_root or operation_dir
+    removed = 0
+    for owner, repo in sorted({(t['owner'], t['repo']) for t in load_targets(operation_dir)}):
+        mirror = mirror_path(owner, repo, mirror_root)
+        if os.path.isdir(mirror):
+            removed += prune_worktrees(mirror, under=under)
+    print(f"已删除 {removed} 个工作树")
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从共享bare镜像创建或清理operation文件夹的检出")
+    parser.add_argument('operation_dir', nargs='?', default=f"../operation/{folder}")
+    parser.add_argument('--checkout-root', default=None, help="工作树的根目录，默认放在各issue文件夹中")
+    parser.add_argument('--mirror-root', default=MIRROR_ROOT)
+    parser.add_argument('--remote', default=None, help="clone镜像的地址模板，如 file:///path/{owner}/{repo}.git")
+    parser.add_argument('--update', action='store_true', help="先对已有镜像执行一次fetch")
+    parser.add_argument('--prune', action='store_true', help="删除工作树而不是创建")
+    args = parser.parse_args()
+
+    if args.prune:
+        prune(args.operation_dir, args.checkout_root, args.mirror_root)
+    else:
+        materialize(args.operation_dir, args.checkout_root, args.remote, args.mirror_root, args.update)
+
+
+if __name__ == "__main__":
+    main()
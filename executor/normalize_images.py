@@ -0,0 +1,227 @@
+"""
+operation文件夹中图片的规范化
+
+下载的截图很多是4K手机截图或GIF动图，直接放进多模态请求会让请求体和图片token数量大幅增加。
+本脚本在图片下载之后运行，用进程池并行处理每个issue文件夹中的 IMAGE_i.* 图片：
+- 按EXIF方向旋转，最长边缩小到 MAX_EDGE 像素以内
+- 按 TARGET_FORMAT / QUALITY 重新压缩（已经足够小的静态图片保持原样）
+- GIF/WebP动图均匀抽取 ANIMATION_FRAMES 帧，拼成一张网格图
+- 原图和处理后的尺寸、格式、帧数、大小记录在每个issue文件夹的 image_manifest.json 中
+
+处理后的文件仍然叫 IMAGE_i（只有扩展名可能变化），prompt.txt 中的 [IMAGE_i] 编号不变。
+新文件先写入临时文件再替换，operation文件夹中的图片是图片存储中blob的硬链接，替换不会修改blob。
+重新运行时manifest中已记录、文件大小与记录一致且没有新的原图的图片会跳过。
+
+用法：
+    python normalize_images.py                  # 处理 ../operation/{folder}
+    python normalize_images.py ../operation/uno --max-edge 1024 --format WEBP
+"""
+import argparse
+import json
+import math
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from PIL import Image, ImageOps, ImageSequence
+
+folder = os.getenv("VFLOC_REPO", "florisboard")  # 示例仓库，直接运行本脚本时处理该仓库
+
+MAX_EDGE = 1568            # 最长边像素数
+TARGET_FORMAT = 'JPEG'     # JPEG / PNG / WEBP
+QUALITY = 85               # JPEG和WEBP的压缩质量
+ANIMATION_FRAMES = 4       # 动图抽取的帧数
+KEEP_BELOW_BYTES = 300 * 1024  # 尺寸不超过MAX_EDGE且小于该大小的静态图片保持原样
+
+MANIFEST_FILENAME = 'image_manifest.json'
+FORMAT_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+_IMAGE_FILE_PATTERN = re.compile(r'IMAGE_(\d+)(\.\w+)$')
+# run_inference.py 支持的格式（IMAGE_MIME_TYPES），其他格式（BMP、TIFF、AVIF等）即使足够小也要转换
+PASSTHROUGH_FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+
+
+def _describe(image: Image.Image, path: str, frames: int) -> Dict:
+    return {
+        'file': os.path.basename(path),
+        'width': image.width,
+        'height': image.height,
+        'format': image.format,
+        'frames': frames,
+        'bytes': os.path.getsize(path)
+    }
+
+
+def _contact_sheet(image: Image.Image, frame_count: int, n_frames: int, max_edge: int) -> Image.Image:
+    """从动图中均匀抽取n_frames帧（含首尾帧），按网格拼成一张图"""
+    n_frames = min(n_frames, frame_count)
+    if n_frames <= 1:
+        indices = [0]
+    else:
+        indices = sorted({round(i * (frame_count - 1) / (n_frames - 1)) for i in range(n_frames)})
+    frames = [frame.convert('RGB') for i, frame in enumerate(ImageSequence.Iterator(image)) if i in indices]
+
+    cols = math.ceil(math.sqrt(len(frames)))
+    rows = math.ceil(len(frames) / cols)
+    cell = max_edge // cols
+    for frame in frames:
+        frame.thumbnail((cell, cell), Image.LANCZOS)
+    cell_width = max(frame.width for frame in frames)
+    cell_height = max(frame.height for frame in frames)
+    sheet = Image.new('RGB', (cols * cell_width, rows * cell_height), 'white')
+    for i, frame in enumerate(frames):
+        sheet.paste(frame, ((i % cols) * cell_width, (i // cols) * cell_height))
+    return sheet
+
+
+def _to_target_mode(image: Image.Image, target_format: str) -> Image.Image:
+    """JPEG不支持透明通道，透明部分填充白色"""
+    if target_format == 'JPEG':
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB')
+    if image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def normalize_image(path: str, max_edge: int = MAX_EDGE, target_format: str = TARGET_FORMAT,
+                    quality: int = QUALITY, animation_frames: int = ANIMATION_FRAMES,
+                    keep_below_bytes: int = KEEP_BELOW_BYTES) -> Dict:
+    """规范化一张图片，返回manifest条目 {'original': ..., 'normalized': ...}；无法识别的图片返回 {'error': ...}"""
+    try:
+        with Image.open(path) as image:
+            frame_count = getattr(image, 'n_frames', 1)
+            original = _describe(image, path, frame_count)
+            animated = frame_count > 1
+
+            if (not animated and image.format in PASSTHROUGH_FORMATS and max(image.size) <= max_edge
+                    and original['bytes'] < keep_below_bytes and image.getexif().get(0x0112, 1) == 1):
+                return {'original': original, 'normalized': dict(original), 'unchanged': True}
+
+            if animated:
+                result = _contact_sheet(image, frame_count, animation_frames, max_edge)
+            else:
+                result = ImageOps.exif_transpose(image)
+                result.load()
+            result.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            result = _to_target_mode(result, target_format)
+    except Exception as e:
+        return {'error': f'{type(e).__name__}: {e}', 'original': {'file': os.path.basename(path)}}
+
+    index = _IMAGE_FILE_PATTERN.match(os.path.basename(path)).group(1)
+    new_path = os.path.join(os.path.dirname(path), f"IMAGE_{index}{FORMAT_EXTENSIONS[target_format]}")
+    tmp_path = new_path + '.tmp'
+    save_options = {'quality': quality} if target_format in ('JPEG', 'WEBP') else {'optimize': True}
+    result.save(tmp_path, format=target_format, **save_options)
+    os.replace(tmp_path, new_path)
+    if new_path != path:
+        os.remove(path)  # 扩展名变化时删除原文件（图片存储中的blob不受影响）
+
+    normalized = {
+        'file': os.path.basename(new_path),
+        'width': result.width,
+        'height': result.height,
+        'format': target_format,
+        'frames': 1,
+        'bytes': os.path.getsize(new_path)
+    }
+    if animated:
+        normalized['sampled_frames'] = min(animation_frames, frame_count)
+    return {'original': original, 'normalized': normalized}
+
+
+def _load_manifest(issue_dir: str) -> Dict:
+    path = os.path.join(issue_dir, MANIFEST_FILENAME)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def collect_images(issue_dir: str, manifest: Dict) -> List[str]:
+    """
+    返回issue文件夹中需要处理的图片。同一编号有多个文件时（重新下载的原图和上次处理的结果并存），
+    删除上次的结果，重新处理原图；manifest中已记录的结果且没有新原图时跳过。
+    """
+    by_index: Dict[str, List[str]] = {}
+    for name in os.listdir(issue_dir):
+        match = _IMAGE_FILE_PATTERN.match(name)
+        if match and match.group(2).lower() != '.txt':
+            by_index.setdefault(match.group(1), []).append(name)
+
+    todo = []
+    for index, names in sorted(by_index.items(), key=lambda item: int(item[0])):
+        normalized = (manifest.get(f"IMAGE_{index}") or {}).get('normalized', {})
+        done = normalized.get('file')
+        if names == [done] and os.path.getsize(os.path.join(issue_dir, done)) == normalized.get('bytes'):
+            continue
+        if names == [done]:
+            done = None  # 重新生成文件夹时原图链接回了同名文件，需要重新处理
+        sources = [name for name in names if name != done] or names
+        if done in names and done not in sources:
+            os.remove(os.path.join(issue_dir, done))
+        todo.append(os.path.join(issue_dir, sources[0]))
+        for extra in sources[1:]:
+            print(f"警告: {issue_dir} 中 IMAGE_{index} 有多个文件，只处理 {sources[0]}，忽略 {extra}")
+    return todo
+
+
+def normalize_operation_dir(operation_dir: str, jobs: Optional[int] = None, **options) -> Dict[str, int]:
+    """用进程池规范化operation目录下所有issue文件夹中的图片，返回统计信息"""
+    issue_dirs = sorted(os.path.join(operation_dir, d) for d in os.listdir(operation_dir)
+                        if os.path.isdir(os.path.join(operation_dir, d)))
+    manifests = {issue_dir: _load_manifest(issue_dir) for issue_dir in issue_dirs}
+    tasks = [(issue_dir, path) for issue_dir in issue_dirs for path in collect_images(issue_dir, manifests[issue_dir])]
+    stats = {'images': len(tasks), 'resized': 0, 'unchanged': 0, 'animated': 0, 'errors': 0,
+             'bytes_before': 0, 'bytes_after': 0}
+    if not tasks:
+        print("没有需要规范化的图片")
+        return stats
+
+    print(f"规范化 {len(tasks)} 张图片 (最长边 {options.get('max_edge', MAX_EDGE)}, "
+          f"格式 {options.get('target_format', TARGET_FORMAT)})...")
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(normalize_image, path, **options) for _, path in tasks]
+        for (issue_dir, path), future in zip(tasks, futures):
+            entry = future.result()
+            index = _IMAGE_FILE_PATTERN.match(os.path.basename(path)).group(1)
+            manifests[issue_dir][f"IMAGE_{index}"] = entry
+            if 'error' in entry:
+                stats['errors'] += 1
+                print(f"无法处理图片 {path}: {entry['error']}")
+                continue
+            stats['unchanged' if entry.get('unchanged') else 'resized'] += 1
+            stats['animated'] += entry['original']['frames'] > 1
+            stats['bytes_before'] += entry['original']['bytes']
+            stats['bytes_after'] += entry['normalized']['bytes']
+
+    for issue_dir in {issue_dir for issue_dir, _ in tasks}:
+        manifest = dict(sorted(manifests[issue_dir].items(), key=lambda item: int(item[0].split('_')[1])))
+        with open(os.path.join(issue_dir, MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+
+    print(f"图片规范化完成: 处理 {stats['resized']} 张（动图 {stats['animated']} 张），保持原样 {stats['unchanged']} 张，"
+          f"失败 {stats['errors']} 张，{stats['bytes_before'] / 1e6:.1f}MB -> {stats['bytes_after'] / 1e6:.1f}MB")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="规范化operation文件夹中的图片")
+    parser.add_argument('operation_dir', nargs='?', default=f"../operation/{folder}")
+    parser.add_argument('--max-edge', type=int, default=MAX_EDGE)
+    parser.add_argument('--format', default=TARGET_FORMAT, choices=sorted(FORMAT_EXTENSIONS))
+    parser.add_argument('--quality', type=int, default=QUALITY)
+    parser.add_argument('--frames', type=int, default=ANIMATION_FRAMES, help="动图抽取的帧数")
+    parser.add_argument('--jobs', '-j', type=int, default=None)
+    args = parser.parse_args()
+
+    normalize_operation_dir(args.operation_dir, jobs=args.jobs, max_edge=args.max_edge, target_format=args.format,
+                            quality=args.quality, animation_frames=args.frames)
+
+
+if __name__ == "__main__":
+    main()
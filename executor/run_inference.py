@@ -0,0 +1,356 @@
+"""
+对operation文件夹批量调用多模态模型
+
+generate_operation_folders.py 为每个issue生成 prompt.txt 和 IMAGE_* 图片，本脚本遍历operation目录，
+把prompt和图片组装成OpenAI兼容的 /chat/completions 请求，用asyncio并发发送（信号量限制并发数），
+模型回复写入 {predictions_root}/{run}/{repo}_{issue}.json，供 evaluate_predictions.py 评测。
+
+- 图片按内容sha256只读取和base64编码一次，多个issue引用同一张图片时共用编码结果
+- 回复按 模型 + 生成参数 + prompt + 图片哈希 缓存在SQLite中，重新运行时已有回复的请求不再发送
+- 结束时输出吞吐量和延迟的p50/p90/p99（只统计实际发送的请求）
+
+接口地址、模型和密钥通过环境变量（或 .env）设置：
+    INFERENCE_BASE_URL   默认 http://localhost:8000/v1
+    INFERENCE_MODEL      默认 gpt-4o
+    INFERENCE_API_KEY    可选
+
+用法：
+    python run_inference.py florisboard uno --concurrency 16
+    python run_inference.py --serve-stub 8000        # 启动本地桩服务，用于测试
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiohttp
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+BASE_URL = os.getenv("INFERENCE_BASE_URL", "http://localhost:8000/v1")
+MODEL = os.getenv("INFERENCE_MODEL", "gpt-4o")
+API_KEY = os.getenv("INFERENCE_API_KEY")
+
+OPERATION_ROOT = os.getenv("VFLOC_OPERATION_ROOT", "../operation")
+PREDICTIONS_ROOT = os.getenv("VFLOC_PREDICTIONS_ROOT", "../predictions")
+DEFAULT_CACHE_PATH = os.getenv(
+    "INFERENCE_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 'issue_results', 'cache', 'inference_cache.sqlite3')
+)
+
+IMAGE_MIME_TYPES = {
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp'
+}
+_IMAGE_FILE_PATTERN = re.compile(r'IMAGE_(\d+)(\.\w+)$')
+
+
+# --- 读取operation文件夹 ---
+def list_issue_folders(operation_root: str, folders: Optional[List[str]] = None) -> List[Tuple[str, str]]:
+    """返回所有包含prompt.txt的issue文件夹 [(仓库目录, issue文件夹路径)]"""
+    if not folders:
+        folders = sorted(d for d in os.listdir(operation_root) if os.path.isdir(os.path.join(operation_root, d)))
+    issues = []
+    for folder in folders:
+        folder_dir = os.path.join(operation_root, folder)
+        if not os.path.isdir(folder_dir):
+            print(f"警告: operation目录不存在 {folder_dir}")
+            continue
+        for name in sorted(os.listdir(folder_dir)):
+            if os.path.exists(os.path.join(folder_dir, name, 'prompt.txt')):
+                issues.append((folder, os.path.join(folder_dir, name)))
+    return issues
+
+
+def list_images(issue_dir: str) -> List[str]:
+    """issue文件夹中按编号排序的图片文件（下载失败的占位文件和不支持的格式除外）"""
+    images = []
+    for name in os.listdir(issue_dir):
+        match = _IMAGE_FILE_PATTERN.match(name)
+        if match and match.group(2).lower() in IMAGE_MIME_TYPES:
+            images.append((int(match.group(1)), os.path.join(issue_dir, name)))
+        elif match and not name.endswith('.txt'):
+            print(f"警告: 不支持的图片格式，已跳过 {os.path.join(issue_dir, name)}")
+    return [path for _, path in sorted(images)]
+
+
+class ImageEncoder:
+    """按内容哈希缓存图片的base64 data URL，同一张图片只编码一次"""
+
+    def __init__(self):
+        self._by_path: Dict[str, str] = {}
+        self._data_urls: Dict[str, str] = {}
+
+    def encode(self, path: str) -> Tuple[str, str]:
+        """返回 (sha256, data URL)"""
+        digest = self._by_path.get(path)
+        if digest is None:
+            with open(path, 'rb') as f:
+                content = f.read()
+            digest = hashlib.sha256(content).hexdigest()
+            self._by_path[path] = digest
+            if digest not in self._data_urls:
+                mime = IMAGE_MIME_TYPES[os.path.splitext(path)[1].lower()]
+                self._data_urls[digest] = f"data:{mime};base64,{base64.b64encode(content).decode('ascii')}"
+        return digest, self._data_urls[digest]
+
+
+# --- 回复缓存 ---
+class ResponseCache:
+    """以请求哈希为键的回复缓存（SQLite）"""
+
+    def __init__(self, db_path: str = DEFAULT_CACHE_PATH):
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(db_path)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model: str, params: Dict, prompt: str, image_hashes: List[str]) -> str:
+        digest = hashlib.sha256()
+        digest.update(json.dumps({'model': model, 'params': params}, sort_keys=True).encode('utf-8'))
+        digest.update(hashlib.sha256(prompt.encode('utf-8')).digest())
+        for image_hash in image_hashes:
+            digest.update(bytes.fromhex(image_hash))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        row = self._conn.execute("SELECT payload FROM responses WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, model: str, payload: Dict):
+        self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                           (key, model, json.dumps(payload, ensure_ascii=False), time.time()))
+        self._conn.commit()
+
+
+# --- 发送请求 ---
+def build_messages(prompt: str, data_urls: List[str]) -> List[Dict]:
+    """OpenAI兼容的多模态消息：先文本后图片"""
+    content = [{'type': 'text', 'text': prompt}]
+    content.extend({'type': 'image_url', 'image_url': {'url': url}} for url in data_urls)
+    return [{'role': 'user', 'content': content}]
+
+
+async def _post_chat(session: aiohttp.ClientSession, url: str, body: Dict, max_retries: int) -> Dict:
+    """发送一次chat completion请求，429、5xx和无法解析的200响应按Retry-After或指数退避重试"""
+    error = '请求失败'
+    for attempt in range(max_retries):
+        try:
+            async with session.post(url, json=body) as response:
+                text = await response.text()
+                if response.status == 200:
+                    # 代理或测试服务器可能返回不是JSON对象的200响应，按可重试的错误处理
+                    try:
+                        data = json.loads(text)
+                    except ValueError:
+                        data = None
+                    if isinstance(data, dict):
+                        return data
+                    error = f"响应不是JSON对象: {text[:200]}"
+                    wait_time = 2 ** attempt
+                else:
+                    error = f"HTTP {response.status}: {text[:200]}"
+                    if response.status != 429 and response.status < 500:
+                        break  # 请求本身有问题，重试没有意义
+                    retry_after = response.headers.get('Retry-After')
+                    wait_time = int(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt
+        except asyncio.TimeoutError:
+            error = '请求超时'
+            wait_time = 2 ** attempt
+        except aiohttp.ClientError as e:
+            error = f'{type(e).__name__}: {e}'
+            wait_time = 2 ** attempt
+        if attempt < max_retries - 1:
+            print(f"{error}，{wait_time} 秒后重试 (尝试 {attempt + 1}/{max_retries})")
+            await asyncio.sleep(wait_time)
+    raise RuntimeError(error)
+
+
+async def _run_one(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, job: Dict, cache: ResponseCache,
+                   url: str, model: str, params: Dict, max_retries: int, stats: Dict):
+    """处理一个issue；任何异常只计入该issue的失败，不影响同一批的其他issue"""
+    try:
+        await _process_job(session, semaphore, job, cache, url, model, params, max_retries, stats)
+    except Exception as e:
+        stats['errors'] += 1
+        print(f"处理失败 {job['name']}: {type(e).__name__}: {e}")
+
+
+async def _process_job(session: aiohttp.ClientSession, semaphore: asyncio.Semaphore, job: Dict, cache: ResponseCache,
+                       url: str, model: str, params: Dict, max_retries: int, stats: Dict):
+    if job['cached'] is None:
+        body = {'model': model, 'messages': build_messages(job['prompt'], job['data_urls']), **params}
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                data = await _post_chat(session, url, body, max_retries)
+            except RuntimeError as e:
+                stats['errors'] += 1
+                print(f"请求失败 {job['name']}: {e}")
+                return
+            latency = time.perf_counter() - start
+        stats['latencies'].append(latency)
+        choice = (data.get('choices') or [{}])[0]
+        payload = {
+            'response': (choice.get('message') or {}).get('content') or '',
+            'finish_reason': choice.get('finish_reason'),
+            'usage': data.get('usage'),
+            'latency': latency
+        }
+        cache.put(job['key'], model, payload)
+        usage = payload['usage'] or {}
+        stats['completion_tokens'] += usage.get('completion_tokens') or 0
+        cached = False
+    else:
+        payload = job['cached']
+        cached = True
+
+    record = {'model': model, 'issue': job['name'], 'images': len(job['image_hashes']), 'cached': cached, **payload}
+    with open(job['output'], 'w', encoding='utf-8') as f:
+        json.dump(record, f, indent=2, ensure_ascii=False)
+
+
+async def _run_all(jobs: List[Dict], cache: ResponseCache, base_url: str, model: str, api_key: Optional[str],
+                   params: Dict, concurrency: int, max_retries: int, timeout: int) -> Dict:
+    stats = {'latencies': [], 'errors': 0, 'completion_tokens': 0}
+    headers = {'Content-Type': 'application/json'}
+    if api_key:
+        headers['Authorization'] = f'Bearer {api_key}'
+    url = base_url.rstrip('/') + '/chat/completions'
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(connector=connector, timeout=client_timeout, headers=headers) as session:
+        await asyncio.gather(*(_run_one(session, semaphore, job, cache, url, model, params, max_retries, stats)
+                               for job in jobs))
+    return stats
+
+
+def report(stats: Dict, total: int, cache_hits: int, elapsed: float):
+    """输出吞吐量和延迟分位数"""
+    sent = len(stats['latencies'])
+    print(f"\n共 {total} 个issue：缓存命中 {cache_hits}，发送请求 {sent}，失败 {stats['errors']}，用时 {elapsed:.1f} 秒")
+    if sent:
+        latencies = np.array(stats['latencies'])
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+        print(f"吞吐量: {sent / elapsed:.2f} 请求/秒"
+              + (f", {stats['completion_tokens'] / elapsed:.1f} 输出token/秒" if stats['completion_tokens'] else ''))
+        print(f"延迟: p50 {p50:.2f}s, p90 {p90:.2f}s, p99 {p99:.2f}s, 最大 {latencies.max():.2f}s")
+
+
+def run_inference(folders: Optional[List[str]] = None, operation_root: str = OPERATION_ROOT,
+                  predictions_root: str = PREDICTIONS_ROOT, run: Optional[str] = None,
+                  base_url: str = BASE_URL, model: str = MODEL, api_key: Optional[str] = API_KEY,
+                  params: Optional[Dict] = None, concurrency: int = 8, max_retries: int = 3, timeout: int = 600,
+                  cache_path: str = DEFAULT_CACHE_PATH, skip_images: bool = False) -> Dict:
+    """对operation目录下的issue批量请求模型，返回统计信息"""
+    params = params if params is not None else {'temperature': 0}
+    run = run or re.sub(r'[^\w.-]+', '_', model)
+    output_dir = os.path.join(predictions_root, run)
+    os.makedirs(output_dir, exist_ok=True)
+
+    encoder = ImageEncoder()
+    cache = ResponseCache(cache_path)
+    jobs = []
+    for folder, issue_dir in list_issue_folders(operation_root, folders):
+        with open(os.path.join(issue_dir, 'prompt.txt'), 'r', encoding='utf-8') as f:
+            prompt = f.read()
+        encoded = [] if skip_images else [encoder.encode(path) for path in list_images(issue_dir)]
+        image_hashes = [digest for digest, _ in encoded]
+        key = ResponseCache.make_key(model, params, prompt, image_hashes)
+        name = os.path.basename(issue_dir)
+        jobs.append({
+            'name': name,
+            'prompt': prompt,
+            'data_urls': [data_url for _, data_url in encoded],
+            'image_hashes': image_hashes,
+            'key': key,
+            'cached': cache.get(key),
+            'output': os.path.join(output_dir, f"{name}.json")
+        })
+
+    cache_hits = sum(job['cached'] is not None for job in jobs)
+    print(f"模型 {model} @ {base_url}：{len(jobs)} 个issue，其中 {cache_hits} 个已有缓存，并发 {concurrency}")
+    start = time.perf_counter()
+    stats = asyncio.run(_run_all(jobs, cache, base_url, model, api_key, params, concurrency, max_retries, timeout))
+    elapsed = time.perf_counter() - start
+    report(stats, len(jobs), cache_hits, elapsed)
+    print(f"模型回复已保存到 {output_dir}")
+    return {**stats, 'total': len(jobs), 'cache_hits': cache_hits, 'elapsed': elapsed}
+
+
+# --- 本地桩服务 ---
+def serve_stub(port: int, delay: float = 0.2):
+    """
+    启动一个OpenAI兼容的本地桩服务用于测试：每个请求等待delay秒后，
+    返回一个空的定位结果，并在usage中报告收到的图片数量。
+    """
+    from aiohttp import web
+
+    async def chat_completions(request):
+        body = await request.json()
+        content = body['messages'][0]['content']
+        images = sum(1 for part in content if part.get('type') == 'image_url')
+        await asyncio.sleep(delay)
+        answer = json.dumps({'modified_files': [], 'added_paths': []})
+        return web.json_response({
+            'id': 'stub',
+            'model': body.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': f"```json\n{answer}\n```"},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': 0, 'completion_tokens': len(answer), 'images': images}
+        })
+
+    app = web.Application(client_max_size=256 * 1024 * 1024)
+    app.router.add_post('/v1/chat/completions', chat_completions)
+    web.run_app(app, port=port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对operation文件夹批量调用OpenAI兼容的多模态模型")
+    parser.add_argument('repos', nargs='*', help="operation下的仓库目录名，默认全部")
+    parser.add_argument('--operation', default=OPERATION_ROOT, help="operation目录")
+    parser.add_argument('--predictions', default=PREDICTIONS_ROOT, help="模型回复的输出目录")
+    parser.add_argument('--run', default=None, help="本次运行的名称（输出子目录），默认为模型名")
+    parser.add_argument('--base-url', default=BASE_URL, help="OpenAI兼容接口地址")
+    parser.add_argument('--model', default=MODEL, help="模型名称")
+    parser.add_argument('--temperature', type=float, default=0)
+    parser.add_argument('--max-tokens', type=int, default=None)
+    parser.add_argument('--concurrency', '-c', type=int, default=8, help="同时进行的请求数")
+    parser.add_argument('--no-images', action='store_true', help="只发送文本prompt（纯文本对照实验）")
+    parser.add_argument('--serve-stub', type=int, default=None, metavar='PORT', help="启动本地桩服务")
+    args = parser.parse_args()
+
+    if args.serve_stub is not None:
+        serve_stub(args.serve_stub)
+        return
+
+    params = {'temperature': args.temperature}
+    if args.max_tokens is not None:
+        params['max_tokens'] = args.max_tokens
+    run_inference(args.repos, args.operation, args.predictions, args.run, args.base_url, args.model,
+                  params=params, concurrency=args.concurrency, skip_images=args.no_images)
+
+
+if __name__ == "__main__":
+    main()
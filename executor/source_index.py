@@ -0,0 +1,259 @@
+"""
+每个operation文件夹对应源代码快照的文件索引，以及预测和ground truth的路径校验
+
+prompt.txt 要求模型返回的文件都存在于当前代码库、新增路径都是合法目录，但以前没有任何检查，
+ground_truth.json 中的路径在 base_commit 上是否存在也没有核对过。这里对每个issue的 base_commit
+通过常驻的 `git cat-file --batch`（git_batch.py）递归读取tree列出所有文件，建立排序后的文件和目录列表，用bisect回答：
+- 文件/目录是否存在，某个目录下有哪些文件（前缀查询）
+- 文件是否是 folder_to_extension_list / is_valid_file 认可的源代码文件
+
+索引按commit的tree SHA缓存在 issue_results/cache/source_index/{tree}.gz（以\\0分隔的排序路径，gzip压缩），
+base_commit相同的issue共用一份，可用环境变量 VFLOC_SOURCE_INDEX_PATH 修改位置。
+
+校验时每个issue一个任务，用进程池并行，结果按 (来源, 仓库, issue) 一行：
+- modified_files：存在的源代码文件 / 存在但不是源代码文件 / 是目录 / 不存在
+- added_paths：已存在的目录 / 新目录（合法，ground truth中新增文件所在的目录可能原来不存在）/ 是文件
+
+用法：
+    python source_index.py                                   # 校验 ../operation 下所有ground truth
+    python source_index.py --predictions ../predictions --runs gpt-4o --output validation.csv
+    python source_index.py --repos uno --remote "file:///tmp/remotes/{owner}/{repo}.git"
+"""
+import argparse
+import bisect
+import gzip
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from evaluate_predictions import FIELDS, OPERATION_ROOT, PREDICTIONS_ROOT, list_runs, load_prediction, normalize_paths
+from generate_operation_folders import folder_to_extension_list, is_valid_file
+from git_batch import get_pool
+from git_mirror import MIRROR_ROOT, ensure_mirror
+from materialize_checkouts import load_targets, resolve_base
+
+INDEX_CACHE_PATH = os.getenv(
+    "VFLOC_SOURCE_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'issue_results', 'cache', 'source_index')
+)
+
+FILE_STATUSES = ('ok', 'not_source', 'is_dir', 'missing')
+DIR_STATUSES = ('existing', 'new', 'is_file')
+
+
+class SourceIndex:
+    """一个快照中所有文件和目录的排序列表"""
+
+    def __init__(self, files: Iterable[str], folder_name: Optional[str] = None):
+        self.files = sorted(files)
+        dirs = set()
+        for path in self.files:
+            parent = path.rpartition('/')[0]
+            while parent and parent not in dirs:
+                dirs.add(parent)
+                parent = parent.rpartition('/')[0]
+        self.dirs = sorted(dirs)
+        self.folder_name = folder_name
+
+    @staticmethod
+    def _contains(items: List[str], path: str) -> bool:
+        i = bisect.bisect_left(items, path)
+        return i < len(items) and items[i] == path
+
+    def has_file(self, path: str) -> bool:
+        return self._contains(self.files, path)
+
+    def has_dir(self, path: str) -> bool:
+        return path == '' or self._contains(self.dirs, path)
+
+    def is_source_file(self, path: str) -> bool:
+        """存在且通过 is_valid_file 过滤（仓库不在 folder_to_extension_list 中时只检查存在）"""
+        if not self.has_file(path):
+            return False
+        return self.folder_name not in folder_to_extension_list or is_valid_file(path, self.folder_name)
+
+    def files_under(self, directory: str) -> List[str]:
+        """directory下（含子目录）的所有文件；'/' 之后的下一个字符是 '0'，两次bisect得到前缀范围"""
+        if not directory:
+            return list(self.files)
+        lo = bisect.bisect_left(self.files, directory + '/')
+        hi = bisect.bisect_left(self.files, directory + '0', lo)
+        return self.files[lo:hi]
+
+    def nearest_dir(self, path: str) -> str:
+        """path自身或最近的已存在上级目录，都不存在时返回 ''（仓库根目录）"""
+        while path and not self.has_dir(path):
+            path = path.rpartition('/')[0]
+        return path
+
+    def file_status(self, path: str) -> str:
+        if self.has_file(path):
+            return 'ok' if self.is_source_file(path) else 'not_source'
+        return 'is_dir' if self.has_dir(path) else 'missing'
+
+    def dir_status(self, path: str) -> str:
+        if self.has_dir(path):
+            return 'existing'
+        return 'is_file' if self.has_file(path) else 'new'
+
+    def __len__(self):
+        return len(self.files)
+
+
+def tree_of(mirror: str, rev: str) -> str:
+    commit = get_pool(mirror).commit(rev)
+    if commit is None:
+        raise KeyError(f"{mirror} 中找不到commit {rev}")
+    return commit.tree
+
+
+def _list_tree(mirror: str, tree: str) -> List[str]:
+    """递归读取tree对象，列出所有文件（不含子模块），与 `git ls-tree -r` 结果相同"""
+    return [path for path, _ in get_pool(mirror).walk(tree)]
+
+
+@lru_cache(maxsize=8)
+def load_index(mirror: str, tree: str, folder_name: Optional[str] = None,
+               cache_dir: str = INDEX_CACHE_PATH) -> SourceIndex:
+    """读取tree的索引，缓存不存在时遍历tree生成并写入缓存"""
+    path = os.path.join(cache_dir, f"{tree}.gz")
+    if os.path.exists(path):
+        with gzip.open(path, 'rt', encoding='utf-8', errors='surrogateescape') as f:
+            files = f.read().split('\0')
+        return SourceIndex(files[:-1], folder_name)
+
+    index = SourceIndex(_list_tree(mirror, tree), folder_name)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with gzip.open(tmp_path, 'wt', encoding='utf-8', errors='surrogateescape') as f:
+        f.write(''.join(f"{p}\0" for p in index.files))
+    os.replace(tmp_path, path)
+    return index
+
+
+def build_index(mirror: str, rev: str, folder_name: Optional[str] = None,
+                cache_dir: str = INDEX_CACHE_PATH) -> SourceIndex:
+    """rev（commit SHA或 sha^ 等表达式）对应快照的索引"""
+    return load_index(mirror, tree_of(mirror, rev), folder_name, cache_dir)
+
+
+def check_paths(index: SourceIndex, paths: Dict[str, List[str]]) -> Dict:
+    """按状态统计一组 modified_files / added_paths，问题路径记录在 'invalid' 中"""
+    row = {'files': len(paths['modified_files']), 'dirs': len(paths['added_paths'])}
+    invalid = {}
+    file_statuses = [index.file_status(p) for p in paths['modified_files']]
+    dir_statuses = [index.dir_status(p) for p in paths['added_paths']]
+    for status in FILE_STATUSES:
+        row[f'files_{status}'] = file_statuses.count(status)
+    for status in DIR_STATUSES:
+        row[f'dirs_{status}'] = dir_statuses.count(status)
+    for path, status in zip(paths['modified_files'], file_statuses):
+        if status != 'ok':
+            invalid.setdefault(status, []).append(path)
+    for path, status in zip(paths['added_paths'], dir_statuses):
+        if status == 'is_file':
+            invalid.setdefault('dir_is_file', []).append(path)
+    row['invalid'] = json.dumps(invalid, ensure_ascii=False) if invalid else ''
+    return row
+
+
+def validate_issue(task: Tuple) -> List[Dict]:
+    """在工作进程中校验一个issue的ground truth和各run的预测"""
+    folder_name, issue_key, mirror, base, gold, run_dirs, cache_dir = task
+    base_row = {'repo': folder_name, 'issue': issue_key, 'base_commit': base}
+    try:
+        index = build_index(mirror, base, folder_name, cache_dir)
+    except KeyError as e:
+        return [dict(base_row, source='ground_truth', error=str(e.args[0]))]
+
+    rows = [dict(base_row, source='ground_truth', **check_paths(index, gold))]
+    for run_dir in run_dirs:
+        prediction = load_prediction(os.path.join(run_dir, f"{issue_key}.json"))
+        if prediction is None:
+            rows.append(dict(base_row, source=os.path.basename(run_dir), error='预测缺失或无法解析'))
+        else:
+            rows.append(dict(base_row, source=os.path.basename(run_dir), **check_paths(index, prediction)))
+    return rows
+
+
+def validate(operation_root: str = OPERATION_ROOT, folders: Optional[List[str]] = None,
+             predictions_root: Optional[str] = None, runs: Optional[List[str]] = None,
+             remote: Optional[str] = None, mirror_root: str = MIRROR_ROOT, cache_dir: str = INDEX_CACHE_PATH,
+             jobs: Optional[int] = None) -> pd.DataFrame:
+    """并行校验operation目录下所有issue的ground truth（以及指定run的预测），返回每个 (来源, issue) 一行的DataFrame"""
+    if folders is None:
+        folders = sorted(d for d in os.listdir(operation_root) if os.path.isdir(os.path.join(operation_root, d)))
+    run_dirs = []
+    if predictions_root is not None:
+        run_dirs = [os.path.join(predictions_root, run) for run in (runs or list_runs(predictions_root))]
+
+    mirrors: Dict[Tuple[str, str], str] = {}
+    tasks = []
+    for folder_name in folders:
+        for target in load_targets(os.path.join(operation_root, folder_name)):
+            key = (target['owner'], target['repo'])
+            if key not in mirrors:
+                url = remote.format(owner=key[0], repo=key[1]) if remote else None
+                mirrors[key] = ensure_mirror(key[0], key[1], url=url, mirror_root=mirror_root)
+            with open(os.path.join(target['issue_dir'], 'ground_truth.json'), 'r', encoding='utf-8') as f:
+                ground_truth = json.load(f)
+            gold = {field: normalize_paths(ground_truth.get(field, [])) for field in FIELDS}
+            tasks.append((folder_name, os.path.basename(target['issue_dir']), mirrors[key],
+                          resolve_base(mirrors[key], target), gold, run_dirs, cache_dir))
+    if not tasks:
+        print("没有找到需要校验的ground truth")
+        return pd.DataFrame()
+
+    print(f"校验 {len(tasks)} 个issue（ground truth + {len(run_dirs)} 个run）...")
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(validate_issue, tasks, chunksize=max(1, len(tasks) // 64))
+        rows = [row for issue_rows in results for row in issue_rows]
+    columns = ['source', 'repo', 'issue', 'base_commit', 'error', 'files'] + [f'files_{s}' for s in FILE_STATUSES] + \
+              ['dirs'] + [f'dirs_{s}' for s in DIR_STATUSES] + ['invalid']
+    per_issue = pd.DataFrame(rows).reindex(columns=columns)
+    counts = [c for c in columns if c.startswith(('files', 'dirs'))]
+    per_issue[counts] = per_issue[counts].astype('Int64')
+    return per_issue
+
+
+def summarize(per_issue: pd.DataFrame) -> pd.DataFrame:
+    """按来源汇总：各状态路径的总数，以及至少有一个问题路径的issue数"""
+    counts = [c for c in per_issue.columns if c.startswith(('files', 'dirs'))]
+    summary = per_issue.groupby('source')[counts].sum().astype(int)
+    summary.insert(0, 'issues', per_issue.groupby('source').size())
+    summary['errors'] = per_issue.groupby('source')['error'].count()
+    summary['issues_with_invalid'] = per_issue.assign(bad=per_issue['invalid'].fillna('') != '') \
+        .groupby('source')['bad'].sum()
+    return summary.reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="校验预测和ground truth中的路径是否存在于base_commit的代码中")
+    parser.add_argument('--operation', default=OPERATION_ROOT, help="operation目录（包含ground_truth.json）")
+    parser.add_argument('--repos', nargs='+', default=None, help="只校验这些仓库（operation下的目录名），默认全部")
+    parser.add_argument('--predictions', nargs='?', const=PREDICTIONS_ROOT, default=None,
+                        help="同时校验该目录下的预测结果（不带值时为默认预测目录）")
+    parser.add_argument('--runs', nargs='+', default=None, help="只校验这些run，默认全部")
+    parser.add_argument('--mirror-root', default=MIRROR_ROOT)
+    parser.add_argument('--remote', default=None, help="clone镜像的地址模板，如 file:///path/{owner}/{repo}.git")
+    parser.add_argument('--output', default=None, help="把每个issue的校验结果写入CSV")
+    parser.add_argument('--jobs', '-j', type=int, default=None)
+    args = parser.parse_args()
+
+    per_issue = validate(args.operation, args.repos, args.predictions, args.runs, args.remote, args.mirror_root,
+                         jobs=args.jobs)
+    if per_issue.empty:
+        return
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(summarize(per_issue).to_string(index=False))
+    if args.output:
+        per_issue.to_csv(args.output, index=False)
+        print(f"\n校验结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,84 +3,32 @@ import requests
 import time
 import os
 from urllib.parse import urlparse
-from dotenv import load_dotenv
+from token_pool import get_token_pool
+from journal import IssueJournal
 
 # --- 配置 ---
-load_dotenv()
-GITHUB_TOKEN = os.getenv("MY_GITHUB_TOKEN")
-repo_name = "ant-design"
-INPUT_JSON_FILE = f'../issue_results/{repo_name}/{repo_name}_issues_with_closing_pr_checked.json'
-OUTPUT_JSON_FILE = f'../issue_results/{repo_name}/intermediates/{repo_name}_issues_with_code.json'
+# 由pipeline.py运行时通过环境变量传入仓库和输入输出路径
+repo_name = os.getenv("VFLOC_REPO", "ant-design")
+INPUT_JSON_FILE = os.getenv("VFLOC_INPUT", f'../issue_results/{repo_name}/{repo_name}_issues_with_closing_pr_checked.json')
+OUTPUT_JSON_FILE = os.getenv("VFLOC_OUTPUT", f'../issue_results/{repo_name}/intermediates/{repo_name}_issues_with_code.json')
 MAX_RETRIES = 5  # 最大重试次数
 
 
 # --- GitHub API 辅助函数 ---
-def handle_rate_limit(response):
-    """
-    处理API速率限制，等待限制重置后返回
-    """
-    # 处理多种可能的速率限制状态码: 429(标准限流), 403(可能的认证和限流混合), 443(SSL相关或自定义限流)
-    if response.status_code in [429, 403, 443]:
-        # 尝试从响应头获取限制重置时间
-        reset_time = int(response.headers.get('X-RateLimit-Reset', 0))
-
-        # 检查响应内容是否提到rate limit
-        is_rate_limit = False
-        try:
-            response_json = response.json()
-            message = response_json.get('message', '').lower()
-            if 'rate limit' in message or 'api rate limit' in message:
-                is_rate_limit = True
-        except:
-            # 无法解析JSON，检查响应文本
-            try:
-                response_text = response.text.lower()
-                if 'rate limit' in response_text or 'api rate limit' in response_text:
-                    is_rate_limit = True
-            except:
-                pass
-
-        # 确认是速率限制错误或直接处理这三种状态码
-        if is_rate_limit or response.status_code in [429, 443]:
-            if reset_time > 0:
-                current_time = int(time.time())
-                sleep_time = reset_time - current_time + 5  # 额外等待5秒以确保重置完成
-                if sleep_time > 0:
-                    print(f"遇到API速率限制 (状态码: {response.status_code})，等待 {sleep_time} 秒后重试...")
-                    time.sleep(sleep_time)
-                    return True
-            else:  # 如果无法获取重置时间，默认等待一定时间
-                if response.status_code == 429:
-                    wait_time = 60  # 标准限流, 等待60秒
-                elif response.status_code == 443:
-                    wait_time = 90  # SSL相关或自定义限流, 等待90秒
-                else:  # 403
-                    wait_time = 120  # 可能是长时间限流, 等待更长时间
-
-                print(f"遇到API速率限制 (状态码: {response.status_code})，无法获取重置时间，等待{wait_time}秒后重试...")
-                time.sleep(wait_time)
-                return True
-    return False
-
-def get_commit_files(owner, repo, commit_sha, token):
+def get_commit_files(owner, repo, commit_sha):
     """
     获取指定Commit更改的文件列表。
-    支持自动处理API速率限制。
+    速率限制由令牌池处理（换用其他token，全部耗尽时才等待）。
     """
     url = f"https://api.github.com/repos/{owner}/{repo}/commits/{commit_sha}"
     headers = {
-        "Authorization": f"token {token}",
         "Accept": "application/vnd.github.v3+json"
     }
 
     retries = 0
     while retries < MAX_RETRIES:
         try:
-            response = requests.get(url, headers=headers)
-
-            if handle_rate_limit(response):
-                # 遇到速率限制并处理后重试
-                continue
+            response = get_token_pool().get(url, headers=headers)
 
             response.raise_for_status()  # 如果请求失败则抛出HTTPError
             commit_data = response.json()
@@ -117,25 +65,20 @@ def get_commit_files(owner, repo, commit_sha, token):
 
     return None
 
-def get_pr_files(owner, repo, pr_number, token):
+def get_pr_files(owner, repo, pr_number):
     """
     获取指定Pull Request更改的文件列表。
-    支持自动处理API速率限制。
+    速率限制由令牌池处理（换用其他token，全部耗尽时才等待）。
     """
     url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}/files"
     headers = {
-        "Authorization": f"token {token}",
         "Accept": "application/vnd.github.v3+json"
     }
 
     retries = 0
     while retries < MAX_RETRIES:
         try:
-            response = requests.get(url, headers=headers)
-
-            if handle_rate_limit(response):
-                # 遇到速率限制并处理后重试
-                continue
+            response = get_token_pool().get(url, headers=headers)
 
             response.raise_for_status()  # 如果请求失败则抛出HTTPError
             return response.json()
@@ -167,25 +110,20 @@ def get_pr_files(owner, repo, pr_number, token):
 
     return None
 
-def get_pr_commits_info(owner, repo, pr_number, token):
+def get_pr_commits_info(owner, repo, pr_number):
     """
     获取指定Pull Request的commits列表 (SHA)。
-    支持自动处理API速率限制。
+    速率限制由令牌池处理（换用其他token，全部耗尽时才等待）。
     """
     url = f"https://api.github.com/repos/{owner}/{repo}/pulls/{pr_number}/commits"
     headers = {
-        "Authorization": f"token {token}",
         "Accept": "application/vnd.github.v3+json"
     }
 
     retries = 0
     while retries < MAX_RETRIES:
         try:
-            response = requests.get(url, headers=headers)
-
-            if handle_rate_limit(response):
-                # 遇到速率限制并处理后重试
-                continue
+            response = get_token_pool().get(url, headers=headers)
 
             response.raise_for_status()
             commits_data = response.json()
@@ -227,8 +165,10 @@ def parse_repo_url(repo_api_url):
 
 # --- 主逻辑 ---
 def main():
-    if not GITHUB_TOKEN:
-        print("错误：GITHUB_PAT 环境变量未设置。请设置您的GitHub Personal Access Token。")
+    try:
+        get_token_pool()
+    except ValueError as e:
+        print(f"错误：{e}")
         return
 
     try:
@@ -241,12 +181,19 @@ def main():
         print(f"错误：输入文件 '{INPUT_JSON_FILE}' 不是有效的JSON格式。")
         return
 
-    processed_issues = []
+    # 每处理完一个条目就写入日志，中断后重新运行会跳过已处理的条目
+    journal = IssueJournal(OUTPUT_JSON_FILE)
+    issue_keys = [issue.get('number', i) for i, issue in enumerate(issues_data)]
     total_issues = len(issues_data)
     print(f"开始处理 {total_issues} 个条目...")
 
     for i, issue in enumerate(issues_data):
         print(f"\n处理条目 {i+1}/{total_issues}: Issue Number {issue.get('number')}")
+        if journal.done(issue_keys[i], issue):
+            print(f"  已在日志中，跳过。")
+            continue
+        original_issue = dict(issue)  # 下面会直接修改issue，日志按修改前的内容判断输入是否变化
+        fetch_failed = False  # 获取失败的条目照常输出，但重新运行时会再次尝试
 
         # 先默认设为None
         pr_number_to_fetch = None
@@ -271,12 +218,11 @@ def main():
                 print(f"  无法从 repository_url '{issue['repository_url']}' 解析 owner/repo。跳过PR信息获取。")
                 issue['changed_files'] = [] # 添加空列表以保持结构一致
                 issue['commits'] = []
-                processed_issues.append(issue)
+                journal.append(issue_keys[i], original_issue, issue)
                 continue
 
             print(f"  尝试获取 PR #{pr_number_to_fetch} 的变更文件信息 (仓库: {owner}/{repo})...")
-            files_changed = get_pr_files(owner, repo, pr_number_to_fetch, GITHUB_TOKEN)
-            time.sleep(1) # 尊重API速率限制
+            files_changed = get_pr_files(owner, repo, pr_number_to_fetch)
 
             if files_changed:
                 issue['changed_files'] = []
@@ -299,16 +245,16 @@ def main():
 
                 # 获取PR的commits
                 print(f"  尝试获取 PR #{pr_number_to_fetch} 的 commits...")
-                commit_shas = get_pr_commits_info(owner, repo, pr_number_to_fetch, GITHUB_TOKEN)
+                commit_shas = get_pr_commits_info(owner, repo, pr_number_to_fetch)
                 issue['commits'] = commit_shas
                 if commit_shas:
                     print(f"    成功获取 {len(commit_shas)} 个 commits。")
                 else:
                     print(f"    未能获取 PR #{pr_number_to_fetch} 的 commits。")
-                time.sleep(1)
 
             else:
                 print(f"    未能获取 PR #{pr_number_to_fetch} 的文件变更信息。")
+                fetch_failed = True
                 issue['changed_files'] = [] # 即使失败也添加空列表
                 issue['commits'] = []
 
@@ -319,12 +265,11 @@ def main():
                 print(f"  无法从 repository_url '{issue['repository_url']}' 解析 owner/repo。跳过Commit信息获取。")
                 issue['changed_files'] = [] # 添加空列表以保持结构一致
                 issue['commits'] = [commit_sha_to_fetch]  # 记录当前commit SHA
-                processed_issues.append(issue)
+                journal.append(issue_keys[i], original_issue, issue)
                 continue
 
             print(f"  尝试获取 Commit {commit_sha_to_fetch} 的变更文件信息 (仓库: {owner}/{repo})...")
-            files_changed = get_commit_files(owner, repo, commit_sha_to_fetch, GITHUB_TOKEN)
-            time.sleep(1) # 尊重API速率限制
+            files_changed = get_commit_files(owner, repo, commit_sha_to_fetch)
 
             if files_changed:
                 issue['changed_files'] = []
@@ -345,6 +290,7 @@ def main():
                 issue['commits'] = [commit_sha_to_fetch]
             else:
                 print(f"    未能获取 Commit {commit_sha_to_fetch} 的文件变更信息。")
+                fetch_failed = True
                 issue['changed_files'] = [] # 即使失败也添加空列表
                 issue['commits'] = [] # 空列表保持一致性
         else:
@@ -355,11 +301,11 @@ def main():
             issue['changed_files'] = []
             issue['commits'] = []
 
-        processed_issues.append(issue)
+        journal.append(issue_keys[i], original_issue, issue, complete=not fetch_failed)
 
+    journal.close()
     try:
-        with open(OUTPUT_JSON_FILE, 'w', encoding='utf-8') as f:
-            json.dump(processed_issues, f, indent=2, ensure_ascii=False)
+        journal.compact(issue_keys)
         print(f"\n处理完成！结果已保存到 '{OUTPUT_JSON_FILE}'")
     except IOError:
         print(f"错误：无法写入输出文件 '{OUTPUT_JSON_FILE}'。")
@@ -1,16 +1,18 @@
 import json
-import requests
-import time
 import os
+import requests
 from urllib.parse import urlparse
-from dotenv import load_dotenv
+from token_pool import get_token_pool
+from journal import IssueJournal
+from graphql_batch import post_graphql, query_issue_timelines
 
 # --- 配置 ---
-load_dotenv()
-GITHUB_TOKEN = os.getenv("MY_GITHUB_TOKEN")
-repo_name = "florisboard"
-INPUT_JSON_FILE = f'../issue_results/{repo_name}/intermediates/{repo_name}_completed_with_images.json'
-OUTPUT_JSON_FILE = f'../issue_results/{repo_name}/intermediates/{repo_name}_issues_with_closing_commit.json'
+# 由pipeline.py运行时通过环境变量传入仓库和输入输出路径
+repo_name = os.getenv("VFLOC_REPO", "florisboard")
+INPUT_JSON_FILE = os.getenv("VFLOC_INPUT",
+                            f'../issue_results/{repo_name}/intermediates/{repo_name}_completed_with_images.json')
+OUTPUT_JSON_FILE = os.getenv("VFLOC_OUTPUT",
+                             f'../issue_results/{repo_name}/intermediates/{repo_name}_issues_with_closing_commit.json')
 
 # --- GitHub API 辅助函数 ---
 def get_owner_repo_from_url(html_or_api_url):
@@ -22,13 +24,12 @@ def get_owner_repo_from_url(html_or_api_url):
         return path_parts[0], path_parts[1]
     return None, None
 
-def search_closing_commits_by_graphql(owner, repo, issue_number, token):
+def search_closing_commits_by_graphql(owner, repo, issue_number):
     """
     使用GitHub GraphQL API查找直接关闭issue的commit（而非通过PR）
     返回commit SHA列表
     """
     headers = {
-        "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
     }
     query = f"""
@@ -58,7 +59,7 @@ def search_closing_commits_by_graphql(owner, repo, issue_number, token):
     }}
     """
     try:
-        response = requests.post(
+        response = get_token_pool().post(
             "https://api.github.com/graphql",
             headers=headers,
             json={"query": query}
@@ -87,7 +88,86 @@ def search_closing_commits_by_graphql(owner, repo, issue_number, token):
         print(f"  GraphQL查找commit出错: {e}")
         return []
 
-def search_closing_commits_by_search(owner, repo, issue_number_int, token):
+CLOSED_EVENT_FIELDS = """
+            pageInfo {
+              hasNextPage
+              endCursor
+            }
+            nodes {
+              ... on ClosedEvent {
+                closer {
+                  ... on Commit {
+                    oid
+                    message
+                    url
+                    author {
+                      name
+                      email
+                      date
+                    }
+                  }
+                }
+              }
+            }"""
+
+
+def parse_closed_event_commits(nodes):
+    """从ClosedEvent节点中提取closer为Commit的记录"""
+    commits = []
+    for node in nodes:
+        commit = node.get("closer")
+        if commit and commit.get("oid"):
+            commits.append({
+                'sha': commit.get("oid"),
+                'message': commit.get("message"),
+                'url': commit.get("url"),
+                'author': commit.get("author")
+            })
+    return commits
+
+
+def fetch_remaining_closed_events(owner, repo, issue_number, cursor):
+    """对ClosedEvent超过一页的issue继续翻页，返回剩余页中的commit"""
+    commits = []
+    while cursor:
+        query = f"""
+    query {{
+      repository(owner: \"{owner}\", name: \"{repo}\") {{
+        issue(number: {issue_number}) {{
+          timelineItems(itemTypes: [CLOSED_EVENT], first: 100, after: \"{cursor}\") {{{CLOSED_EVENT_FIELDS}
+          }}
+        }}
+      }}
+    }}
+    """
+        try:
+            data = post_graphql(query)
+        except Exception as e:
+            print(f"  GraphQL翻页查询Issue #{issue_number}出错: {e}")
+            break
+        timeline = ((data.get('repository') or {}).get('issue') or {}).get('timelineItems', {})
+        commits.extend(parse_closed_event_commits(timeline.get('nodes', [])))
+        page_info = timeline.get('pageInfo', {})
+        cursor = page_info.get('endCursor') if page_info.get('hasNextPage') else None
+    return commits
+
+
+def search_closing_commits_by_graphql_batch(owner, repo, issue_numbers, **kwargs):
+    """
+    批量版本的search_closing_commits_by_graphql：用别名在一次GraphQL请求中查询多个issue的ClosedEvent，
+    批次大小的调整见 graphql_batch.py。每个issue先取一页，只有ClosedEvent超过一页的少数issue才继续翻页。
+    返回 {issue_number: [commit, ...]}；查询失败的issue不会出现在结果中，由调用方回退到逐个查询。
+    """
+    def parse(number, timeline):
+        commits = parse_closed_event_commits(timeline.get('nodes', []))
+        page_info = timeline.get('pageInfo', {})
+        if page_info.get('hasNextPage'):
+            commits.extend(fetch_remaining_closed_events(owner, repo, number, page_info.get('endCursor')))
+        return commits
+
+    return query_issue_timelines(owner, repo, issue_numbers, 'CLOSED_EVENT', CLOSED_EVENT_FIELDS, parse, **kwargs)
+
+def search_closing_commits_by_search(owner, repo, issue_number_int):
     """
     使用GitHub Search API查找可能关闭此Issue的commit
     搜索commit消息中包含issue编号的commit
@@ -106,11 +186,10 @@ def search_closing_commits_by_search(owner, repo, issue_number_int, token):
         print(f"  搜索尝试 {i + 1}: {query}")
         url = f"https://api.github.com/search/commits?q={query}&sort=committer-date&order=desc"
         headers = {
-            "Authorization": f"token {token}",
             "Accept": "application/vnd.github.cloak-preview+json"
         }
         try:
-            response = requests.get(url, headers=headers)
+            response = get_token_pool().get(url, headers=headers)
             response.raise_for_status()
             search_results = response.json()
             print(f"    找到 {search_results.get('total_count', 0)} 个commit")
@@ -134,8 +213,6 @@ def search_closing_commits_by_search(owner, repo, issue_number_int, token):
                             all_commits.append(commit_info)
                             break
 
-            time.sleep(1)  # 避免API限制
-
         except requests.exceptions.HTTPError as e:
             print(f"  搜索commit时HTTP错误: {e}")
             if response is not None:
@@ -153,18 +230,17 @@ def search_closing_commits_by_search(owner, repo, issue_number_int, token):
 
     return unique_commits
 
-def get_issue_timeline_commits(owner, repo, issue_number, token):
+def get_issue_timeline_commits(owner, repo, issue_number):
     """
     通过Issue Timeline API获取关闭该issue的commit信息
     """
     url = f"https://api.github.com/repos/{owner}/{repo}/issues/{issue_number}/timeline"
     headers = {
-        "Authorization": f"token {token}",
         "Accept": "application/vnd.github.mockingbird-preview+json"
     }
 
     try:
-        response = requests.get(url, headers=headers)
+        response = get_token_pool().get(url, headers=headers)
         response.raise_for_status()
         timeline_events = response.json()
 
@@ -173,7 +249,7 @@ def get_issue_timeline_commits(owner, repo, issue_number, token):
             if event.get('event') == 'closed' and event.get('commit_id'):
                 # 获取commit详细信息
                 commit_url = f"https://api.github.com/repos/{owner}/{repo}/commits/{event['commit_id']}"
-                commit_response = requests.get(commit_url, headers=headers)
+                commit_response = get_token_pool().get(commit_url, headers=headers)
                 if commit_response.status_code == 200:
                     commit_data = commit_response.json()
                     commits.append({
@@ -183,7 +259,6 @@ def get_issue_timeline_commits(owner, repo, issue_number, token):
                         'author': commit_data.get('commit', {}).get('author'),
                         'committer': commit_data.get('commit', {}).get('committer')
                     })
-                time.sleep(0.5)  # 避免API限制
 
         return commits
     except Exception as e:
@@ -192,8 +267,10 @@ def get_issue_timeline_commits(owner, repo, issue_number, token):
 
 # --- 主逻辑 ---
 def main():
-    if not GITHUB_TOKEN:
-        print("错误：MY_GITHUB_TOKEN 环境变量未设置。请设置您的GitHub Personal Access Token。")
+    try:
+        get_token_pool()
+    except ValueError as e:
+        print(f"错误：{e}")
         return
 
     try:
@@ -213,10 +290,27 @@ def main():
             print(f"错误：输入文件 '{INPUT_JSON_FILE}' 的顶层结构应为JSON数组或单个JSON对象。")
             return
 
-    issues_with_closing_commit_info = []
+    # 每处理完一个Issue就写入日志，中断后重新运行会跳过已处理的Issue
+    journal = IssueJournal(OUTPUT_JSON_FILE)
     total_issues_to_process = len(issues_data_input)
     print(f"开始处理 {total_issues_to_process} 个Issue...")
 
+    # 先按仓库分组，批量查询所有未处理issue的关闭commit
+    issues_by_repo = {}
+    for issue_item in issues_data_input:
+        if not isinstance(issue_item, dict) or not issue_item.get('number'):
+            continue
+        if journal.done(issue_item['number'], issue_item):
+            continue
+        owner, repo = get_owner_repo_from_url(issue_item.get('repository_url') or issue_item.get('html_url') or '')
+        if owner and repo:
+            issues_by_repo.setdefault((owner, repo), []).append(issue_item['number'])
+    closing_commits = {}
+    for (owner, repo), numbers in issues_by_repo.items():
+        print(f"使用GraphQL批量查询 {owner}/{repo} 中 {len(numbers)} 个Issue的关闭commit...")
+        for number, commits in search_closing_commits_by_graphql_batch(owner, repo, numbers).items():
+            closing_commits[(owner, repo, number)] = commits
+
     for i, issue_item in enumerate(issues_data_input):
         if not isinstance(issue_item, dict):
             print(f"  警告: 第 {i+1} 个条目不是一个字典，已跳过。")
@@ -235,22 +329,27 @@ def main():
             continue
 
         print(f"\n处理Issue {i+1}/{total_issues_to_process}: #{issue_number}")
+        if journal.done(issue_number, issue_item):
+            print(f"  Issue #{issue_number} 已在日志中，跳过。")
+            continue
 
-        # 方法1: 使用GraphQL查找关闭事件中的commit
-        graphql_commits = search_closing_commits_by_graphql(owner, repo, issue_number, GITHUB_TOKEN)
+        # 方法1: 使用GraphQL查找关闭事件中的commit（批量查询失败时单独查询）
+        graphql_commits = closing_commits.get((owner, repo, int(issue_number)))
+        if graphql_commits is None:
+            graphql_commits = search_closing_commits_by_graphql(owner, repo, issue_number)
         print(f"  GraphQL方法找到 {len(graphql_commits)} 个commit")
 
         all_commits = graphql_commits
 
         # 方法2: 使用Timeline API
         if len(graphql_commits) == 0:
-            timeline_commits = get_issue_timeline_commits(owner, repo, issue_number, GITHUB_TOKEN)
+            timeline_commits = get_issue_timeline_commits(owner, repo, issue_number)
             print(f"  Timeline方法找到 {len(timeline_commits)} 个commit")
             all_commits = graphql_commits + timeline_commits
 
         # # 方法3: 使用Search API
         if len(all_commits) == 0:
-            search_commits = search_closing_commits_by_search(owner, repo, issue_number, GITHUB_TOKEN)
+            search_commits = search_closing_commits_by_search(owner, repo, issue_number)
             print(f"  Search方法找到 {len(search_commits)} 个commit")
             all_commits = search_commits
 
@@ -263,24 +362,26 @@ def main():
                 unique_commits.append(commit)
                 seen_shas.add(commit['sha'])
 
+        issue_item_copy = None
         if unique_commits:
             print(f"    成功找到 {len(unique_commits)} 个关闭commit")
             issue_item_copy = issue_item.copy()
             issue_item_copy['pr_number'] = unique_commits[0]
             # issue_item_copy['commit_count'] = len(unique_commits)
             issue_item_copy['pr_source'] = 'commit'
-            issues_with_closing_commit_info.append(issue_item_copy)
         else:
             print(f"    未找到关闭commit")
+        journal.append(issue_number, issue_item, issue_item_copy)
 
-
+    journal.close()
+    try:
+        issues_with_closing_commit_info = journal.compact(
+            [item.get('number') for item in issues_data_input if isinstance(item, dict)], write_empty=False)
+    except IOError:
+        print(f"错误：无法写入输出文件 '{OUTPUT_JSON_FILE}'。")
+        return
     if issues_with_closing_commit_info:
-        try:
-            with open(OUTPUT_JSON_FILE, 'w', encoding='utf-8') as f:
-                json.dump(issues_with_closing_commit_info, f, indent=2, ensure_ascii=False)
-            print(f"\n处理完成！{len(issues_with_closing_commit_info)} 个包含关闭commit信息的Issue已保存到 '{OUTPUT_JSON_FILE}'")
-        except IOError:
-            print(f"错误：无法写入输出文件 '{OUTPUT_JSON_FILE}'。")
+        print(f"\n处理完成！{len(issues_with_closing_commit_info)} 个包含关闭commit信息的Issue已保存到 '{OUTPUT_JSON_FILE}'")
     else:
         print("\n没有找到任何包含关闭commit信息的Issue。")
 
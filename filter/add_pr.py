@@ -1,16 +1,16 @@
 import json
-import requests
-import time
 import os
+import requests
 from urllib.parse import urlparse
-from dotenv import load_dotenv
+from token_pool import get_token_pool
+from journal import IssueJournal
+from graphql_batch import query_issue_timelines
 
 # --- 配置 ---
-load_dotenv()
-GITHUB_TOKEN = os.getenv("MY_GITHUB_TOKEN")
-repo_name = "AntennaPod"
-INPUT_JSON_FILE = f'../issue_results/{repo_name}_completed_with_images.json'
-OUTPUT_JSON_FILE = f'../issue_results/{repo_name}_issues_with_closing_pr.json'
+# 由pipeline.py运行时通过环境变量传入仓库和输入输出路径
+repo_name = os.getenv("VFLOC_REPO", "AntennaPod")
+INPUT_JSON_FILE = os.getenv("VFLOC_INPUT", f'../issue_results/{repo_name}_completed_with_images.json')
+OUTPUT_JSON_FILE = os.getenv("VFLOC_OUTPUT", f'../issue_results/{repo_name}_issues_with_closing_pr.json')
 
 # --- GitHub API 辅助函数 ---
 def get_owner_repo_from_url(html_or_api_url):
@@ -22,13 +22,12 @@ def get_owner_repo_from_url(html_or_api_url):
         return path_parts[0], path_parts[1]
     return None, None
 
-def search_linked_pr_by_graphql(owner, repo, issue_number, token):
+def search_linked_pr_by_graphql(owner, repo, issue_number):
     """
     使用GitHub GraphQL API查找与issue关联的PR（即界面close标签右侧显示的PR）。
-    返回PR号列表（通常只有一个）。
+    返回PR号列表（通常只有一个）；请求出错时返回None。
     """
     headers = {
-        "Authorization": f"Bearer {token}",
         "Content-Type": "application/json"
     }
     query = f"""
@@ -53,7 +52,7 @@ def search_linked_pr_by_graphql(owner, repo, issue_number, token):
     }}
     """
     try:
-        response = requests.post(
+        response = get_token_pool().post(
             "https://api.github.com/graphql",
             headers=headers,
             json={"query": query}
@@ -75,12 +74,44 @@ def search_linked_pr_by_graphql(owner, repo, issue_number, token):
         return pr_numbers
     except Exception as e:
         print(f"  GraphQL查找PR出错: {e}")
-        return []
+        return None
+
+CONNECTED_EVENT_FIELDS = """
+          nodes {
+            ... on ConnectedEvent {
+              subject {
+                ... on PullRequest {
+                  number
+                }
+              }
+            }
+          }"""
+
+
+def parse_connected_event_prs(issue_number, timeline):
+    """从CONNECTED_EVENT节点中提取关联PR的编号"""
+    pr_numbers = []
+    for node in timeline.get('nodes', []):
+        pr = node.get("subject")
+        if pr and pr.get("number"):
+            pr_numbers.append(pr["number"])
+    return pr_numbers
 
-def search_closing_pr_debug(owner, repo, issue_number_int, token):
+
+def search_linked_prs_by_graphql_batch(owner, repo, issue_numbers, **kwargs):
+    """
+    批量版本的search_linked_pr_by_graphql：用别名在一次GraphQL请求中查询多个issue的CONNECTED_EVENT，
+    批次大小的调整见 graphql_batch.py。
+    返回 {issue_number: [PR号, ...]}；查询失败的issue不会出现在结果中，由调用方回退到逐个查询。
+    """
+    return query_issue_timelines(owner, repo, issue_numbers, 'CONNECTED_EVENT', CONNECTED_EVENT_FIELDS,
+                                 parse_connected_event_prs, **kwargs)
+
+def search_closing_pr_debug(owner, repo, issue_number_int):
     """
     使用 GitHub Search API 查找可能关闭此 Issue 并且已合并的 PR。
     选择满足条件中编号最小的 PR（表示最早的）。
+    返回 (PR号或None, 是否有查询出错)。
     """
     issue_number_str = str(issue_number_int)
     queries_to_try = [
@@ -88,16 +119,16 @@ def search_closing_pr_debug(owner, repo, issue_number_int, token):
         f"repo:{owner}/{repo} type:pr is:merged {issue_number_str} in:title,body",
     ]
     pr_number_found = None
+    request_failed = False
 
     for i, query in enumerate(queries_to_try):
         print(f"  DEBUG: Search Attempt {i + 1} for Issue #{issue_number_str} with query: {query}")
         url = f"https://api.github.com/search/issues?q={query}&sort=updated&order=desc"
         headers = {
-            "Authorization": f"token {token}",
             "Accept": "application/vnd.github.v3+json"
         }
         try:
-            response = requests.get(url, headers=headers)
+            response = get_token_pool().get(url, headers=headers)
             print(f"    DEBUG: API URL: {url}")
             print(f"    DEBUG: Response Status Code: {response.status_code}")
             response.raise_for_status()
@@ -124,24 +155,29 @@ def search_closing_pr_debug(owner, repo, issue_number_int, token):
                 break
 
         except requests.exceptions.HTTPError as e:
+            request_failed = True
             print(f"  错误: HTTPError during Search API for query '{query}': {e}")
             if response is not None:
                 print(f"  Response content: {response.text}")
         except requests.exceptions.RequestException as e:
+            request_failed = True
             print(f"  错误: RequestException during Search API for query '{query}': {e}")
         except Exception as e_general:
+            request_failed = True
             print(f"  未预期的错误在 search_closing_pr_debug (query: '{query}'): {e_general}")
 
     if pr_number_found:
-        return pr_number_found
+        return pr_number_found, request_failed
     else:
         print(f"  DEBUG: Issue #{issue_number_str} no pr.")
-        return None
+        return None, request_failed
 
 # --- 主逻辑 ---
 def main():
-    if not GITHUB_TOKEN:
-        print("错误：GITHUB_PAT 环境变量未设置。请设置您的GitHub Personal Access Token。")
+    try:
+        get_token_pool()
+    except ValueError as e:
+        print(f"错误：{e}")
         return
 
     try:
@@ -161,10 +197,27 @@ def main():
             print(f"错误：输入文件 '{INPUT_JSON_FILE}' 的顶层结构应为JSON数组或单个JSON对象。")
             return
 
-    issues_with_closing_pr_info = []
+    # 每处理完一个Issue就写入日志，中断后重新运行会跳过已处理的Issue
+    journal = IssueJournal(OUTPUT_JSON_FILE)
     total_issues_to_process = len(issues_data_input)
     print(f"开始处理 {total_issues_to_process} 个Issue...")
 
+    # 先按仓库分组，批量查询所有未处理的closed issue的关联PR
+    issues_by_repo = {}
+    for issue_item in issues_data_input:
+        if not isinstance(issue_item, dict) or issue_item.get('state') != 'closed' or not issue_item.get('number'):
+            continue
+        if journal.done(issue_item['number'], issue_item):
+            continue
+        owner, repo = get_owner_repo_from_url(issue_item.get('repository_url') or issue_item.get('html_url') or '')
+        if owner and repo:
+            issues_by_repo.setdefault((owner, repo), []).append(issue_item['number'])
+    linked_prs = {}
+    for (owner, repo), numbers in issues_by_repo.items():
+        print(f"使用GraphQL批量查询 {owner}/{repo} 中 {len(numbers)} 个Issue的关联PR...")
+        for number, pr_numbers in search_linked_prs_by_graphql_batch(owner, repo, numbers).items():
+            linked_prs[(owner, repo, number)] = pr_numbers
+
     for i, issue_item in enumerate(issues_data_input):
         if not isinstance(issue_item, dict):
             print(f"  警告: 第 {i+1} 个条目不是一个字典，已跳过。")
@@ -189,12 +242,18 @@ def main():
             print(f"  Issue #{issue_number} 状态为 '{issue_item.get('state')}'，不是closed。跳过查找关闭PR。")
             continue
 
+        if journal.done(issue_number, issue_item):
+            print(f"  Issue #{issue_number} 已在日志中，跳过。")
+            continue
+
         print(f"  仓库: {owner}/{repo}. Issue #{issue_number} (State: {issue_item.get('state')}).")
-        print(f"  尝试使用GraphQL查找关联此Issue的PR...")
-        pr_numbers = search_linked_pr_by_graphql(owner, repo, issue_number, GITHUB_TOKEN)
-        time.sleep(1)
+        pr_numbers = linked_prs.get((owner, repo, int(issue_number)))
+        if pr_numbers is None:
+            print(f"  批量查询未返回结果，尝试使用GraphQL单独查找关联此Issue的PR...")
+            pr_numbers = search_linked_pr_by_graphql(owner, repo, issue_number)
+        request_failed = pr_numbers is None
 
-        found = False
+        result = None
         if pr_numbers:
             pr_numbers_filtered = [int(pr) for pr in pr_numbers if int(pr) > int(issue_number)]
             if pr_numbers_filtered:
@@ -204,17 +263,16 @@ def main():
                 issue_item_copy = issue_item.copy()
                 issue_item_copy['pr_number'] = chosen_pr
                 issue_item_copy['pr_source'] = 'graphql'
-                issues_with_closing_pr_info.append(issue_item_copy)
-                found = True
+                result = issue_item_copy
 
-        if not found:
+        if result is None:
             print(f"    GraphQL未找到，尝试使用Search API查找...")
             try:
                 issue_number_int = int(issue_number)
             except Exception:
                 issue_number_int = issue_number
-            closing_pr_number = search_closing_pr_debug(owner, repo, issue_number_int, GITHUB_TOKEN)
-            time.sleep(2)
+            closing_pr_number, search_failed = search_closing_pr_debug(owner, repo, issue_number_int)
+            request_failed = request_failed or search_failed
             if closing_pr_number is not None:
                 try:
                     if int(closing_pr_number) > int(issue_number):
@@ -222,7 +280,7 @@ def main():
                         issue_item_copy = issue_item.copy()
                         issue_item_copy['pr_number'] = closing_pr_number
                         issue_item_copy['pr_source'] = 'search_api'
-                        issues_with_closing_pr_info.append(issue_item_copy)
+                        result = issue_item_copy
                     else:
                         print(f"    Search API找到PR #{closing_pr_number}，但其编号不大于Issue #{issue_number}，忽略。")
                 except Exception:
@@ -230,13 +288,18 @@ def main():
             else:
                 print(f"    未能找到明确关闭 Issue #{issue_number} 的PR。")
 
+        # 没找到PR也记录（结果为None），续跑时不再重复查询；因请求出错没找到的续跑时重新查询
+        journal.append(issue_number, issue_item, result, complete=result is not None or not request_failed)
+
+    journal.close()
+    try:
+        issues_with_closing_pr_info = journal.compact(
+            [item.get('number') for item in issues_data_input if isinstance(item, dict)], write_empty=False)
+    except IOError:
+        print(f"错误：无法写入输出文件 '{OUTPUT_JSON_FILE}'。")
+        return
     if issues_with_closing_pr_info:
-        try:
-            with open(OUTPUT_JSON_FILE, 'w', encoding='utf-8') as f:
-                json.dump(issues_with_closing_pr_info, f, indent=2, ensure_ascii=False)
-            print(f"\n处理完成！{len(issues_with_closing_pr_info)} 个包含关闭PR信息的Issue已保存到 '{OUTPUT_JSON_FILE}'")
-        except IOError:
-            print(f"错误：无法写入输出文件 '{OUTPUT_JSON_FILE}'。")
+        print(f"\n处理完成！{len(issues_with_closing_pr_info)} 个包含关闭PR信息的Issue已保存到 '{OUTPUT_JSON_FILE}'")
     else:
         print(f"\n处理完成！没有找到任何包含明确关闭PR信息的Issue。输出文件 '{OUTPUT_JSON_FILE}' 未创建或为空。")
 
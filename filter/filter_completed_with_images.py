@@ -1,11 +1,12 @@
 import pandas as pd
 import json
 import os
+from issue_predicate import COMPLETED_WITH_IMAGES
 
 def filter_issues():
     # 文件路径
-    excel_path = "../issue_results/All-Hands-AI_OpenHands_issues_with_analysis_2025-06-13_02-21-15.xlsx"
-    output_path = r"D:\Code2025S\enhancement_vision\issue_results\All-Hands-AI_completed_with_images.json"
+    excel_path = os.getenv("VFLOC_INPUT", "../issue_results/All-Hands-AI_OpenHands_issues_with_analysis_2025-06-13_02-21-15.xlsx")
+    output_path = os.getenv("VFLOC_OUTPUT", r"D:\Code2025S\enhancement_vision\issue_results\All-Hands-AI_completed_with_images.json")
 
     # 读取Excel文件
     print(f"正在读取 {excel_path}...")
@@ -16,8 +17,8 @@ def filter_issues():
         # 显示数据结构和列名
         print(f"数据列: {', '.join(df.columns)}")
 
-        # 筛选条件: state_reason为completed且total_image_count不为0
-        filtered_df = df[(df['state_reason'] == 'completed') & (df['body_image_count'] > 0)]
+        # 筛选条件: state_reason为completed且body_image_count不为0（与爬虫共用同一份声明）
+        filtered_df = COMPLETED_WITH_IMAGES.filter_dataframe(df)
 
         print(f"筛选后数据: {len(filtered_df)} 条记录")
 
@@ -12,9 +12,11 @@ import os
 import glob
 from pathlib import Path
 
-repo_name = "uno"
-INPUT_JSON_FILE = f'../issue_results/{repo_name}/intermediates/{repo_name}_issues_with_code.json'
-OUTPUT_JSON_FILE = f'../issue_results/{repo_name}/intermediates/{repo_name}_issues_with_code_processed.json'
+# 由pipeline.py运行时通过环境变量传入仓库和输入输出路径
+repo_name = os.getenv("VFLOC_REPO", "uno")
+INPUT_JSON_FILE = os.getenv("VFLOC_INPUT", f'../issue_results/{repo_name}/intermediates/{repo_name}_issues_with_code.json')
+OUTPUT_JSON_FILE = os.getenv("VFLOC_OUTPUT",
+                             f'../issue_results/{repo_name}/intermediates/{repo_name}_issues_with_code_processed.json')
 
 def process_code_json_file(input_file_path, output_file_path):
     """
@@ -0,0 +1,249 @@
+"""
+常驻的 `git cat-file --batch` / `--batch-check` 进程
+
+读取commit的父commit、时间、tree和blob时，每次都启动一个git进程的开销远大于查询本身。
+这里每个仓库启动少量常驻的cat-file进程，通过管道逐个发送对象名并直接解析返回的对象内容：
+- commit：tree、父commit、作者时间、提交时间
+- tree：逐项解析二进制的 "<mode> <name>\\0<sha>" 条目，可以递归遍历出所有文件
+- blob：原始字节
+
+对象名可以是SHA，也可以是 sha^、sha^{tree}、HEAD 等git能解析的表达式。
+同一仓库的进程放在池中（默认4个，可用环境变量 VFLOC_GIT_BATCH_WORKERS 修改），多线程可以同时查询；
+进程池按进程id区分，ProcessPoolExecutor的工作进程不会共用父进程的管道。
+
+用法：
+    pool = get_pool(mirror)
+    commit = pool.commit('HEAD')
+    for path, entry in pool.walk(commit.tree):
+        data = pool.blob(entry.sha)
+"""
+import atexit
+import os
+import queue
+import subprocess
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+POOL_SIZE = int(os.getenv("VFLOC_GIT_BATCH_WORKERS", "4"))
+
+
+class Commit(NamedTuple):
+    sha: str
+    tree: str
+    parents: List[str]
+    author_time: int
+    committer_time: int
+
+
+class TreeEntry(NamedTuple):
+    mode: str
+    type: str
+    sha: str
+    name: str
+
+
+def _entry_type(mode: str) -> str:
+    if mode == '40000':
+        return 'tree'
+    if mode == '160000':
+        return 'commit'  # 子模块
+    return 'blob'
+
+
+def parse_commit(sha: str, data: bytes) -> Commit:
+    """解析commit对象的头部（到第一个空行为止）"""
+    tree, parents, author_time, committer_time = None, [], 0, 0
+    for line in data.split(b'\n'):
+        if not line:
+            break
+        key, _, value = line.partition(b' ')
+        if key == b'tree':
+            tree = value.decode()
+        elif key == b'parent':
+            parents.append(value.decode())
+        elif key == b'author':
+            author_time = int(value.rsplit(b' ', 2)[1])
+        elif key == b'committer':
+            committer_time = int(value.rsplit(b' ', 2)[1])
+    return Commit(sha, tree, parents, author_time, committer_time)
+
+
+def parse_tree(data: bytes, hash_size: int = 20) -> List[TreeEntry]:
+    """解析二进制tree对象；hash_size为20（SHA-1）或32（SHA-256）"""
+    entries = []
+    i = 0
+    while i < len(data):
+        space = data.index(b' ', i)
+        nul = data.index(b'\0', space)
+        mode = data[i:space].decode()
+        name = data[space + 1:nul].decode('utf-8', 'surrogateescape')
+        sha = data[nul + 1:nul + 1 + hash_size].hex()
+        entries.append(TreeEntry(mode, _entry_type(mode), sha, name))
+        i = nul + 1 + hash_size
+    return entries
+
+
+class CatFile:
+    """一个仓库的一对常驻cat-file进程（--batch读内容，--batch-check只读类型和大小），按需启动"""
+
+    def __init__(self, repo_path: str):
+        self.repo_path = repo_path
+        self._procs: Dict[str, subprocess.Popen] = {}
+        self._lock = threading.Lock()
+
+    def _proc(self, mode: str) -> subprocess.Popen:
+        proc = self._procs.get(mode)
+        if proc is None or proc.poll() is not None:
+            proc = subprocess.Popen(['git', 'cat-file', mode], cwd=self.repo_path, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self._procs[mode] = proc
+        return proc
+
+    def _request(self, mode: str, rev: str) -> Tuple[subprocess.Popen, Optional[List[bytes]]]:
+        """发送一个对象名，返回 (进程, 头部字段)；对象不存在时头部为None"""
+        if '\n' in rev:
+            raise ValueError(f"对象名中不能包含换行: {rev!r}")
+        proc = self._proc(mode)
+        proc.stdin.write(rev.encode('utf-8', 'surrogateescape') + b'\n')
+        proc.stdin.flush()
+        header = proc.stdout.readline()
+        if not header:
+            self._procs.pop(mode, None)
+            raise RuntimeError(f"git cat-file {mode} 在 {self.repo_path} 中意外退出")
+        fields = header.split()
+        # 不存在时返回 "<rev> missing"，有歧义的短SHA返回 "<rev> ambiguous"
+        if len(fields) != 3:
+            return proc, None
+        return proc, fields
+
+    def info(self, rev: str) -> Optional[Tuple[str, str, int]]:
+        """对象的 (sha, 类型, 大小)，不存在时返回None"""
+        with self._lock:
+            _, fields = self._request('--batch-check', rev)
+        if fields is None:
+            return None
+        return fields[0].decode(), fields[1].decode(), int(fields[2])
+
+    def read(self, rev: str) -> Optional[Tuple[str, str, bytes]]:
+        """对象的 (sha, 类型, 内容)，不存在时返回None"""
+        with self._lock:
+            proc, fields = self._request('--batch', rev)
+            if fields is None:
+                return None
+            size = int(fields[2])
+            data = proc.stdout.read(size + 1)[:size]  # 内容之后还有一个换行
+        return fields[0].decode(), fields[1].decode(), data
+
+    def close(self):
+        with self._lock:
+            for proc in self._procs.values():
+                if proc.poll() is None:
+                    proc.stdin.close()
+                    proc.wait()
+            self._procs.clear()
+
+
+class CatFilePool:
+    """同一仓库的多个CatFile，供多个线程同时查询"""
+
+    def __init__(self, repo_path: str, size: int = POOL_SIZE):
+        self.repo_path = repo_path
+        self.size = max(1, size)
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._all: List[CatFile] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self) -> Iterator[CatFile]:
+        try:
+            cat_file = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if len(self._all) < self.size:
+                    cat_file = CatFile(self.repo_path)
+                    self._all.append(cat_file)
+                else:
+                    cat_file = None
+            if cat_file is None:
+                cat_file = self._idle.get()
+        try:
+            yield cat_file
+        finally:
+            self._idle.put(cat_file)
+
+    def info(self, rev: str) -> Optional[Tuple[str, str, int]]:
+        with self.acquire() as cat_file:
+            return cat_file.info(rev)
+
+    def read(self, rev: str) -> Optional[Tuple[str, str, bytes]]:
+        with self.acquire() as cat_file:
+            return cat_file.read(rev)
+
+    def exists(self, rev: str) -> bool:
+        return self.info(rev) is not None
+
+    def commit(self, rev: str) -> Optional[Commit]:
+        """读取并解析commit，rev指向tag时读取tag指向的commit"""
+        obj = self.read(rev)
+        if obj is not None and obj[1] != 'commit':
+            obj = self.read(f"{rev}^{{commit}}")
+        if obj is None:
+            return None
+        return parse_commit(obj[0], obj[2])
+
+    def tree(self, rev: str) -> Optional[List[TreeEntry]]:
+        """读取并解析tree，rev也可以是commit（读取其根tree）"""
+        obj = self.read(rev)
+        if obj is not None and obj[1] != 'tree':
+            obj = self.read(f"{rev}^{{tree}}")
+        if obj is None:
+            return None
+        return parse_tree(obj[2], len(obj[0]) // 2)
+
+    def blob(self, rev: str) -> Optional[bytes]:
+        obj = self.read(rev)
+        if obj is None or obj[1] != 'blob':
+            return None
+        return obj[2]
+
+    def walk(self, rev: str, prefix: str = '') -> Iterator[Tuple[str, TreeEntry]]:
+        """递归遍历tree，按git的tree顺序产生 (路径, 条目)，只包含blob（不进入子模块）"""
+        entries = self.tree(rev)
+        if entries is None:
+            raise KeyError(f"{self.repo_path} 中找不到tree {rev}")
+        for entry in entries:
+            path = f"{prefix}{entry.name}"
+            if entry.type == 'tree':
+                yield from self.walk(entry.sha, path + '/')
+            elif entry.type == 'blob':
+                yield path, entry
+
+    def close(self):
+        for cat_file in self._all:
+            cat_file.close()
+        self._all.clear()
+        self._idle = queue.LifoQueue()
+
+
+_pools: Dict[Tuple[int, str], CatFilePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(repo_path: str, size: int = POOL_SIZE) -> CatFilePool:
+    """返回当前进程中该仓库共享的CatFilePool"""
+    key = (os.getpid(), os.path.realpath(repo_path))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = CatFilePool(repo_path, size)
+        return pool
+
+
+@atexit.register
+def close_pools():
+    with _pools_lock:
+        for (pid, _), pool in list(_pools.items()):
+            if pid == os.getpid():
+                pool.close()
+        _pools.clear()
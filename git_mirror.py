@@ -0,0 +1,258 @@
+"""
+本地bare镜像仓库的公共操作
+
+每个GitHub仓库在本地只保留一个 `git clone --mirror` 的bare镜像（包含 refs/pull/*，PR中的commit也能找到），
+各脚本通过这里的函数读取commit信息和文件变更，不再逐个commit请求GitHub API。
+对象查询（commit是否存在、父commit和时间）走 git_batch.py 中常驻的cat-file进程，不为每次查询启动git。
+镜像启用commit-graph文件，PR中commit的拓扑排序和base commit（merge-base）都在本地计算，每个仓库只需一次clone或fetch。
+评测时每个issue需要的检出也从镜像创建为 `git worktree`，不再为每个issue完整clone一次仓库。
+"""
+import os
+import re
+import shutil
+import subprocess
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from git_batch import get_pool
+
+# 默认镜像目录，可通过环境变量修改
+MIRROR_ROOT = os.getenv(
+    "VFLOC_MIRROR_ROOT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mirrors')
+)
+
+_STATUS_PATTERN = re.compile(r'^[ACDMRTUXB]\d*$')
+_SHA_PREFIX_PATTERN = re.compile(r'[0-9a-f]{40}')  # 如 sha、sha^、sha~2 开头的完整SHA
+
+
+def run_git(args: List[str], cwd: Optional[str] = None, input_text: Optional[str] = None) -> str:
+    """执行git命令并返回标准输出，失败时抛出 subprocess.CalledProcessError"""
+    result = subprocess.run(
+        ['git'] + args, cwd=cwd, input=input_text, capture_output=True,
+        text=True, encoding='utf-8', errors='surrogateescape', check=True
+    )
+    return result.stdout
+
+
+def mirror_path(owner: str, repo: str, mirror_root: str = MIRROR_ROOT) -> str:
+    """返回仓库镜像的本地路径"""
+    return os.path.join(mirror_root, owner, f"{repo}.git")
+
+
+def ensure_mirror(owner: str, repo: str, url: Optional[str] = None, mirror_root: str = MIRROR_ROOT,
+                  update: bool = False) -> str:
+    """
+    确保本地存在仓库的bare镜像，返回镜像路径。
+    url默认为GitHub地址，测试时可以传入 file:// 地址；update为True时对已有镜像执行一次fetch。
+    """
+    path = mirror_path(owner, repo, mirror_root)
+    if url is None:
+        url = f"https://github.com/{owner}/{repo}.git"
+
+    if not os.path.isdir(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        print(f"正在创建镜像 {owner}/{repo} -> {path}")
+        run_git(['clone', '--mirror', '--quiet', url, path])
+        write_commit_graph(path)
+    elif update:
+        print(f"正在更新镜像 {owner}/{repo}")
+        run_git(['fetch', '--prune', '--quiet', 'origin'], cwd=path)
+        write_commit_graph(path)
+    return path
+
+
+def write_commit_graph(mirror: str):
+    """
+    为镜像写入commit-graph文件（所有ref可达的commit），rev-list拓扑排序和merge-base直接读取其中的父commit和
+    代数信息，不再逐个解压commit对象；之后的fetch也会自动更新commit-graph
+    """
+    run_git(['config', 'core.commitGraph', 'true'], cwd=mirror)
+    run_git(['config', 'fetch.writeCommitGraph', 'true'], cwd=mirror)
+    run_git(['commit-graph', 'write', '--reachable'], cwd=mirror)
+
+
+def missing_objects(mirror: str, shas: Iterable[str]) -> List[str]:
+    """返回镜像中不存在的commit"""
+    pool = get_pool(mirror)
+    return [sha for sha in dict.fromkeys(shas) if not pool.exists(sha)]
+
+
+def ensure_commits(mirror: str, shas: Iterable[str]) -> List[str]:
+    """
+    确保commit在镜像中存在（不在任何ref上的commit单独按SHA fetch），返回仍然缺失的commit。
+    """
+    still_missing = []
+    for sha in missing_objects(mirror, shas):
+        try:
+            run_git(['fetch', '--quiet', 'origin', sha], cwd=mirror)
+        except subprocess.CalledProcessError as e:
+            print(f"警告: 无法从远端获取commit {sha[:7]}: {e.stderr.strip()}")
+            still_missing.append(sha)
+    return still_missing
+
+
+def get_commit_info(mirror: str, shas: Iterable[str]) -> Dict[str, Tuple[int, List[str]]]:
+    """获取多个commit的作者时间戳和父commit列表，返回 {sha: (author_time, parents)}，不存在的commit不包含在内"""
+    pool = get_pool(mirror)
+    info = {}
+    for sha in dict.fromkeys(shas):
+        commit = pool.commit(sha)
+        if commit is not None:
+            info[sha] = (commit.author_time, commit.parents)
+    return info
+
+
+def diff_commits(mirror: str, commits: Dict[str, List[str]]) -> Dict[str, List[Tuple[str, str, Optional[str]]]]:
+    """
+    用一次 `git diff-tree --stdin` 计算多个commit相对第一个父commit的文件变更（开启重命名检测）。
+    commits: {sha: parents}
+    返回 {sha: [(status字母, 路径, 重命名前路径或None), ...]}
+    """
+    if not commits:
+        return {}
+    lines = [f"{sha} {parents[0]}" if parents else sha for sha, parents in commits.items()]
+    output = run_git(['diff-tree', '--stdin', '-z', '-r', '-M', '--name-status', '--root'],
+                     cwd=mirror, input_text='\n'.join(lines) + '\n')
+
+    changes = {sha: [] for sha in commits}
+    tokens = output.split('\0')
+    current = None
+    i = 0
+    while i < len(tokens):
+        token = tokens[i].strip('\n')
+        if not token:
+            i += 1
+            continue
+        if _STATUS_PATTERN.match(token) and current is not None:
+            status = token[0]
+            if status in ('R', 'C'):
+                changes[current].append((status, tokens[i + 2], tokens[i + 1]))
+                i += 3
+            else:
+                changes[current].append((status, tokens[i + 1], None))
+                i += 2
+        else:
+            current = token
+            changes.setdefault(current, [])
+            i += 1
+    return changes
+
+
+def resolve_commit(repo_path: str, rev: str) -> Optional[str]:
+    """把SHA、短SHA或 sha^ 等表达式解析为完整的commit SHA，不存在时返回None"""
+    try:
+        return run_git(['rev-parse', '--verify', '--quiet', f"{rev}^{{commit}}"], cwd=repo_path).strip()
+    except subprocess.CalledProcessError:
+        return None
+
+
+def list_worktrees(mirror: str) -> List[Tuple[str, Optional[str]]]:
+    """镜像的所有附加工作树 [(路径, HEAD)]，不包括镜像自身"""
+    output = run_git(['worktree', 'list', '--porcelain'], cwd=mirror)
+    worktrees = []
+    for block in output.strip().split('\n\n'):
+        fields = dict(line.split(' ', 1) if ' ' in line else (line, None) for line in block.splitlines())
+        if 'worktree' in fields and 'bare' not in fields:
+            worktrees.append((fields['worktree'], fields.get('HEAD')))
+    return worktrees
+
+
+def add_worktree(mirror: str, path: str, rev: str) -> str:
+    """
+    在path创建检出rev的分离HEAD工作树（与镜像共享对象库，不复制历史），返回完整SHA。
+    path已经是检出同一commit的工作树时直接返回；检出其他commit时先删除再重新创建。
+    """
+    path = os.path.abspath(path)
+    sha = resolve_commit(mirror, rev)
+    if sha is None:
+        # 不在任何ref上的commit（如已删除分支中的commit）单独fetch；只有以完整SHA开头的rev才能fetch
+        match = _SHA_PREFIX_PATTERN.match(rev)
+        if match:
+            ensure_commits(mirror, [match.group(0)])
+            sha = resolve_commit(mirror, rev)
+        if sha is None:
+            raise ValueError(f"镜像 {mirror} 中找不到commit {rev}")
+
+    if os.path.exists(path):
+        if os.path.exists(os.path.join(path, '.git')) and resolve_commit(path, 'HEAD') == sha:
+            return sha
+        print(f"{path} 已存在但没有检出 {sha[:7]}，重新创建工作树")
+        remove_worktree(mirror, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    run_git(['worktree', 'add', '--detach', '--quiet', path, sha], cwd=mirror)
+    return sha
+
+
+def remove_worktree(mirror: str, path: str):
+    """删除工作树；目录已不是有效工作树时直接删除目录并清理镜像中的记录"""
+    path = os.path.abspath(path)
+    try:
+        run_git(['worktree', 'remove', '--force', path], cwd=mirror)
+    except subprocess.CalledProcessError:
+        shutil.rmtree(path, ignore_errors=True)
+        prune_worktrees(mirror)
+
+
+def prune_worktrees(mirror: str, under: Optional[str] = None) -> int:
+    """
+    清理工作树：under为None时只清理目录已被删除的工作树记录（git worktree prune），
+    否则删除under目录下的所有工作树。返回删除的工作树数量。
+    """
+    removed = 0
+    if under is not None:
+        under = os.path.realpath(under)
+        for path, _ in list_worktrees(mirror):
+            if os.path.realpath(path).startswith(under + os.sep):
+                remove_worktree(mirror, path)
+                removed += 1
+    run_git(['worktree', 'prune'], cwd=mirror)
+    return removed
+
+
+def merge_base(mirror: str, revs: List[str]) -> Optional[str]:
+    """多个commit的共同祖先（git merge-base --octopus），没有共同祖先时返回None"""
+    if len(revs) == 1:
+        return revs[0]
+    try:
+        return run_git(['merge-base', '--octopus'] + revs, cwd=mirror).strip() or None
+    except subprocess.CalledProcessError:
+        return None
+
+
+def is_ancestor(mirror: str, ancestor: str, descendant: str) -> bool:
+    result = subprocess.run(['git', 'merge-base', '--is-ancestor', ancestor, descendant], cwd=mirror,
+                            capture_output=True)
+    return result.returncode == 0
+
+
+def order_commits(mirror: str, shas: List[str], boundary: Iterable[str] = ()) -> List[str]:
+    """
+    按拓扑顺序排列commit（祖先在前，与作者时间无关，rebase后也正确）。
+    boundary中的commit及其祖先不参与遍历，传入PR的base可以把遍历限制在PR范围内。
+    """
+    shas = list(dict.fromkeys(shas))
+    if len(shas) <= 1:
+        return shas
+    output = run_git(['rev-list', '--topo-order', '--reverse'] + shas + ['--not'] + list(boundary), cwd=mirror)
+    position = {sha: i for i, sha in enumerate(output.split())}
+    # 本身是boundary祖先的commit不会出现在输出中，排在最前面
+    return sorted(shas, key=lambda sha: position.get(sha, -1))
+
+
+def resolve_pr_commits(mirror: str, shas: List[str]) -> Tuple[List[str], Optional[str]]:
+    """
+    根据commit图确定PR中commit的顺序和PR之前的代码状态，返回 (拓扑顺序的commit, base_commit)。
+    base_commit是PR外部的第一父commit（如rebase前后混在一起的多段commit有多个时取它们的merge-base），
+    全部是根commit时为None。base不在默认分支上时（PR基于其他分支）打印与默认分支的merge-base供核对。
+    镜像中不存在的commit不包含在返回的列表中。
+    """
+    info = get_commit_info(mirror, shas)
+    inside = set(info)
+    outside = list(dict.fromkeys(parents[0] for _, parents in info.values() if parents and parents[0] not in inside))
+    base = merge_base(mirror, outside) if outside else None
+    ordered = order_commits(mirror, list(info), outside)
+
+    if base is not None and not is_ancestor(mirror, base, 'HEAD'):
+        default_base = merge_base(mirror, [base, 'HEAD'])
+        print(f"提示: base {base[:7]} 不在默认分支上，与默认分支的merge-base为 {(default_base or '无')[:7]}")
+    return ordered, base
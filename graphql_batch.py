@@ -0,0 +1,94 @@
+"""
+用GraphQL别名批量查询issue的timelineItems
+
+add_pr.py（CONNECTED_EVENT -> 关联PR）和 add_commit.py（CLOSED_EVENT -> 关闭commit）原来对每个issue
+单独发送一次GraphQL请求。这里把一批issue写成同一个请求中的别名 i{number}: issue(number: ...)，
+每批返回的 rateLimit { cost remaining } 用来决定下一批的大小：
+- 按本批的单issue成本估算，下一批的成本不超过 target_cost
+- 下一批的成本不超过当前token剩余额度除以token数，额度快耗尽时不再发送大批量请求
+
+额度耗尽（包括以HTTP 200返回的 RATE_LIMITED 错误）时由令牌池标记该token并换用其他token重试本批。
+请求出错（如超时、超出资源限制）时把批次减半重试，批次为1时仍出错则跳过该issue。
+"""
+from typing import Any, Callable, Dict, Iterable
+
+from token_pool import get_token_pool
+
+GRAPHQL_URL = "https://api.github.com/graphql"
+
+
+def post_graphql(query: str) -> Dict:
+    """发送GraphQL请求并返回data字段"""
+    response = get_token_pool().post(GRAPHQL_URL, headers={"Content-Type": "application/json"},
+                                     json={"query": query})
+    response.raise_for_status()
+    return response.json().get('data') or {}
+
+
+def next_batch_size(rate_limit: Dict, batch_len: int, max_batch_size: int, target_cost: int) -> int:
+    """根据本批的 rateLimit { cost remaining } 计算下一批的issue数"""
+    per_issue = (rate_limit.get('cost') or 1) / batch_len
+    size = target_cost / per_issue
+    remaining = rate_limit.get('remaining')
+    if remaining is not None:
+        # 多个token轮流使用，每个token只分摊剩余额度的一部分
+        size = min(size, remaining / max(1, len(get_token_pool().tokens)) / per_issue)
+    return max(1, min(max_batch_size, int(size)))
+
+
+def query_issue_timelines(owner: str, repo: str, issue_numbers: Iterable, item_type: str, fields: str,
+                          parse: Callable[[int, Dict], Any], batch_size: int = 50, max_batch_size: int = 100,
+                          target_cost: int = 10) -> Dict[int, Any]:
+    """
+    批量查询issue中item_type类型的timelineItems（first: 10），fields为timelineItems内的查询字段，
+    parse(issue_number, timelineItems) 把每个issue的结果转换为返回值。
+    返回 {issue_number: parse的结果}；查询失败或无法解析的issue（如已转移或删除）不会出现在结果中。
+    """
+    pending = [int(n) for n in issue_numbers]
+    results = {}
+
+    while pending:
+        batch = pending[:batch_size]
+        aliases = "\n".join(
+            f"""      i{number}: issue(number: {number}) {{
+        timelineItems(itemTypes: [{item_type}], first: 10) {{{fields}
+        }}
+      }}"""
+            for number in batch
+        )
+        query = f"""
+    query {{
+      rateLimit {{
+        cost
+        remaining
+        resetAt
+      }}
+      repository(owner: \"{owner}\", name: \"{repo}\") {{
+{aliases}
+      }}
+    }}
+    """
+        try:
+            data = post_graphql(query)
+        except Exception as e:
+            if batch_size > 1:
+                # 请求过大可能超时或超出资源限制，缩小批次并降低后续批次上限
+                batch_size = max_batch_size = max(1, batch_size // 2)
+                print(f"  GraphQL批量查询出错: {e}，批次缩小为 {batch_size} 后重试")
+                continue
+            print(f"  GraphQL批量查询Issue #{batch[0]}出错: {e}")
+            pending = pending[1:]
+            continue
+
+        repository = data.get('repository') or {}
+        for number in batch:
+            issue_data = repository.get(f"i{number}")
+            if issue_data is None:
+                continue  # 该issue无法解析（如已转移或删除），留给调用方处理
+            results[number] = parse(number, issue_data.get('timelineItems') or {})
+        pending = pending[len(batch):]
+        print(f"  GraphQL批量查询完成 {len(batch)} 个Issue，剩余 {len(pending)} 个")
+
+        batch_size = next_batch_size(data.get('rateLimit') or {}, len(batch), max_batch_size, target_cost)
+
+    return results
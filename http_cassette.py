@@ -0,0 +1,169 @@
+"""
+GitHub请求的录制与回放
+
+挂载在令牌池的requests session上（token_pool.TokenPool创建session时自动安装），
+add_pr.py、add_commit.py、add_code.py、add_groundtruth.py、generate_operation_folders.py
+发出的REST和GraphQL请求都经过这里：
+- record：正常请求GitHub，同时把每次请求和响应追加写入gzip压缩的JSONL磁带文件
+- replay：完全不访问网络，从磁带文件返回录制的响应，磁带中没有的请求直接报错
+
+通过环境变量选择：GITHUB_CASSETTE_MODE=record|replay（不设置则不启用），
+GITHUB_CASSETTE_PATH 指定磁带文件（默认 cassettes/github.jsonl.gz）。
+请求按 方法 + 规范化URL + 请求体哈希 匹配，不比较请求头（token不同也能回放）；
+同一请求录制了多次时按录制顺序依次返回，用完后重复返回最后一次。
+"""
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import defaultdict, deque
+from typing import Dict, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CASSETTE_MODE = os.getenv("GITHUB_CASSETTE_MODE", "").lower()
+CASSETTE_PATH = os.getenv(
+    "GITHUB_CASSETTE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cassettes', 'github.jsonl.gz')
+)
+
+# 只保存后续处理会用到的响应头，磁带更紧凑
+KEPT_HEADERS = ('Content-Type', 'Link', 'ETag', 'Retry-After', 'X-RateLimit-Limit', 'X-RateLimit-Remaining',
+                'X-RateLimit-Reset', 'X-RateLimit-Resource', 'X-RateLimit-Used')
+
+
+class CassetteMissError(requests.exceptions.ConnectionError):
+    """回放模式下磁带中没有对应的请求"""
+
+
+def normalize_url(url: str) -> str:
+    """主机名小写、查询参数排序，参数顺序不同的同一请求视为相同"""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, query, ''))
+
+
+def request_key(method: str, url: str, body) -> str:
+    """请求的匹配键：方法 + 规范化URL + 请求体sha1"""
+    if body is None:
+        body = b''
+    elif isinstance(body, str):
+        body = body.encode('utf-8')
+    body_hash = hashlib.sha1(body).hexdigest()[:16] if body else ''
+    return f"{method.upper()} {normalize_url(url)} {body_hash}"
+
+
+def is_graphql_rate_limited(status: int, body: bytes) -> bool:
+    """GraphQL的主速率限制以HTTP 200返回，errors中的type为 RATE_LIMITED"""
+    if status != 200 or b'RATE_LIMITED' not in body:
+        return False
+    try:
+        errors = json.loads(body).get('errors') or []
+    except (ValueError, AttributeError):
+        return False
+    return any(isinstance(error, dict) and error.get('type') == 'RATE_LIMITED' for error in errors)
+
+
+def _is_rate_limited(status: int, headers, body: bytes) -> bool:
+    if status in (403, 429) and (headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in headers):
+        return True
+    return is_graphql_rate_limited(status, body)
+
+
+class CassetteAdapter(HTTPAdapter):
+    """录制或回放请求的transport adapter"""
+
+    def __init__(self, mode: str, path: str = CASSETTE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        if mode not in ('record', 'replay'):
+            raise ValueError(f"未知的磁带模式: {mode}")
+        self.mode = mode
+        self.path = path
+        self._lock = threading.Lock()
+        self._records: Dict[str, deque] = defaultdict(deque)
+        self._file = None
+        if mode == 'replay':
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            # gzip支持多member追加，多次录制可写入同一个文件
+            self._file = gzip.open(path, 'at', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"磁带文件不存在: {self.path}")
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._records[record['key']].append(record)
+            except (EOFError, json.JSONDecodeError):
+                # 录制进程被中断时最后一段gzip没有结尾，已读出的记录仍然可用
+                print(f"警告: 磁带 {self.path} 末尾不完整，已忽略")
+        print(f"已加载磁带 {self.path}，共 {sum(len(v) for v in self._records.values())} 条记录")
+
+    def send(self, request, **kwargs):
+        key = request_key(request.method, request.url, request.body)
+        if self.mode == 'replay':
+            return self._replay(request, key)
+
+        response = super().send(request, **kwargs)
+        if not _is_rate_limited(response.status_code, response.headers, response.content):
+            # 速率限制响应会被令牌池换token重试，不录制
+            record = {
+                'key': key,
+                'status': response.status_code,
+                'reason': response.reason,
+                'headers': {h: response.headers[h] for h in KEPT_HEADERS if h in response.headers},
+                'body': response.content.decode('utf-8', errors='replace')
+            }
+            with self._lock:
+                self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self._file.flush()
+        return response
+
+    def _replay(self, request, key: str) -> requests.Response:
+        with self._lock:
+            queue = self._records.get(key)
+            if not queue:
+                raise CassetteMissError(f"磁带中没有该请求: {key}", request=request)
+            record = queue.popleft() if len(queue) > 1 else queue[0]
+
+        response = requests.Response()
+        response.status_code = record['status']
+        response.reason = record.get('reason')
+        response.headers = CaseInsensitiveDict(record['headers'])
+        response._content = record['body'].encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
+
+
+def install_cassette(session: requests.Session, mode: Optional[str] = None,
+                     path: Optional[str] = None) -> Optional[CassetteAdapter]:
+    """按环境变量（或参数）在session上挂载磁带adapter，未启用时返回None"""
+    mode = (mode if mode is not None else CASSETTE_MODE) or None
+    if mode is None:
+        return None
+    adapter = CassetteAdapter(mode, path or CASSETTE_PATH)
+    atexit.register(adapter.close)  # 进程退出时写完gzip结尾
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    print(f"GitHub请求磁带模式: {mode} ({adapter.path})")
+    return adapter
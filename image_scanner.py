@@ -0,0 +1,113 @@
+"""
+issue正文中图片引用的扫描
+
+爬虫统计图片数量和执行器生成 [IMAGE_i] 标签共用这里的扫描结果，二者的计数和编号保持一致。
+所有写法合并成一个预编译的正则，一次从左到右扫描得到按文档顺序排列的图片位置，
+替换时按位置切片拼接，耗时与正文长度成线性关系。
+
+支持的写法：
+- HTML img标签，src为双引号、单引号或不带引号
+- Markdown行内图片 ![alt](url "title")
+- Markdown引用式图片 ![alt][ref]、![alt][] 和 ![alt]，配合 [ref]: url 定义
+- 直接粘贴的GitHub附件链接（github.com/user-attachments/assets/...、user-images.githubusercontent.com/...）
+"""
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+_IMAGE_PATTERN = re.compile(
+    # HTML img标签
+    r"""(?P<html>(?i:<img\b[^>]*?\bsrc\s*=\s*)(?:"(?P<src_dq>[^"]*)"|'(?P<src_sq>[^']*)'|(?P<src_uq>[^\s"'>]+))[^>]*>)"""
+    # Markdown行内图片，url可以用<>包裹，可以包含一层成对的括号（如 u(1).png），后面可以有标题
+    r"""|(?P<inline>!\[(?P<inline_alt>[^\]]*)\]\(\s*<?(?P<inline_url>(?:[^\s<>()]|\([^\s<>()]*\))+)>?"""
+    r"""(?:\s+(?:"[^"]*"|'[^']*'|\([^)]*\)))?\s*\))"""
+    # Markdown引用式图片
+    r"""|(?P<ref>!\[(?P<ref_alt>[^\]]*)\](?:\[(?P<ref_label>[^\]]*)\])?)"""
+    # 引用定义（整行），扫描时跳过，避免其中的附件链接被重复计数
+    r"""|(?P<definition>^[ ]{0,3}\[(?P<def_label>[^\]]+)\]:[ \t]*<?(?P<def_url>[^\s<>]+)>?[^\n]*)"""
+    # 普通Markdown链接的目标 ](url)，扫描时跳过，避免其中的附件链接被当作图片；
+    # 只跳过目标部分，链接文字中的图片（[![alt](img)](link)、[<img src=...>](link)）仍能被匹配
+    r"""|(?P<link>\]\((?:[^()\n]|\([^()\n]*\))*\))"""
+    # 直接粘贴的GitHub附件链接
+    r"""|(?P<autolink>https?://(?:github\.com/user-attachments/assets/|"""
+    r"""(?:private-)?user-images\.githubusercontent\.com/)[^\s<>()\[\]"']+)""",
+    re.MULTILINE
+)
+
+
+class ImageRef(NamedTuple):
+    """一个图片引用在正文中的位置"""
+    start: int
+    end: int
+    url: str
+    kind: str  # 'html' / 'markdown' / 'reference' / 'autolink'
+    alt: str = ''
+
+
+def _normalize_label(label: str) -> str:
+    """引用标签不区分大小写，连续空白视为一个空格"""
+    return ' '.join(label.split()).lower()
+
+
+def scan_images(content: Optional[str]) -> List[ImageRef]:
+    """一次扫描返回正文中所有图片引用，按文档顺序排列"""
+    if not content:
+        return []
+
+    refs = []
+    pending_refs = []  # 引用式图片需要等全部定义扫描完才能确定url
+    definitions: Dict[str, str] = {}
+
+    for match in _IMAGE_PATTERN.finditer(content):
+        kind = match.lastgroup
+        if kind == 'html':
+            url = match.group('src_dq')
+            if url is None:
+                url = match.group('src_sq')
+            if url is None:
+                url = match.group('src_uq')
+            refs.append(ImageRef(match.start(), match.end(), url, 'html'))
+        elif kind == 'inline':
+            refs.append(ImageRef(match.start(), match.end(), match.group('inline_url'), 'markdown',
+                                 match.group('inline_alt')))
+        elif kind == 'ref':
+            label = match.group('ref_label') or match.group('ref_alt')
+            pending_refs.append((len(refs), match, _normalize_label(label)))
+            refs.append(None)
+        elif kind == 'definition':
+            # 同一标签以第一个定义为准
+            definitions.setdefault(_normalize_label(match.group('def_label')), match.group('def_url'))
+        elif kind == 'autolink':
+            refs.append(ImageRef(match.start(), match.end(), match.group('autolink'), 'autolink'))
+
+    for index, match, label in pending_refs:
+        url = definitions.get(label)
+        if url is not None:
+            refs[index] = ImageRef(match.start(), match.end(), url, 'reference', match.group('ref_alt'))
+
+    return [ref for ref in refs if ref is not None]
+
+
+def count_images(content: Optional[str]) -> int:
+    """正文中的图片数量"""
+    return len(scan_images(content))
+
+
+def replace_images(content: Optional[str], refs: Optional[List[ImageRef]] = None,
+                   template: str = '[IMAGE_{}]') -> Tuple[str, List[str]]:
+    """
+    把图片引用按文档顺序替换为 [IMAGE_1]、[IMAGE_2]...
+    返回 (替换后的正文, 与标签编号对应的图片url列表)
+    """
+    if not content:
+        return content or '', []
+    if refs is None:
+        refs = scan_images(content)
+
+    parts = []
+    position = 0
+    for index, ref in enumerate(refs, 1):
+        parts.append(content[position:ref.start])
+        parts.append(template.format(index))
+        position = ref.end
+    parts.append(content[position:])
+    return ''.join(parts), [ref.url for ref in refs]
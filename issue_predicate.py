@@ -0,0 +1,97 @@
+"""
+issue筛选条件的声明
+
+filter_completed_with_images.py 只保留 state_reason == 'completed' 且 body_image_count > 0 的issue，
+但爬虫以前对所有issue都获取评论。这里把筛选条件声明为一组 (字段, 运算符, 值)，
+爬虫和筛选脚本共用同一份声明：爬虫按字段获取成本从低到高依次判断，
+一旦确定不可能通过就跳过该issue后续的评论获取等工作；筛选脚本用同一份条件过滤Excel。
+"""
+import operator
+from typing import Dict, List, Optional, Tuple
+
+# 字段在爬取时的获取成本：
+# 0 - issue列表接口直接返回；1 - 需要本地分析正文；2 - 需要评论数据（额外API请求）
+FIELD_COST = {
+    'state': 0,
+    'state_reason': 0,
+    'type': 0,
+    'labels': 0,
+    'comments': 0,
+    'body_image_count': 1,
+    'comment_image_count': 2,
+    'total_image_count': 2
+}
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    'in': lambda value, choices: value in choices
+}
+
+# 只有已关闭的issue才会有这些state_reason
+CLOSED_STATE_REASONS = {'completed', 'not_planned', 'duplicate'}
+
+
+class IssuePredicate:
+    """由多个条件组成的与(AND)判断，条件按字段成本排序"""
+
+    def __init__(self, conditions: List[Tuple[str, str, object]]):
+        for field, op, _ in conditions:
+            if field not in FIELD_COST:
+                raise ValueError(f"未知的筛选字段: {field}")
+            if op not in OPERATORS:
+                raise ValueError(f"未知的运算符: {op}")
+        self.conditions = sorted(conditions, key=lambda c: FIELD_COST[c[0]])
+
+    def max_cost(self) -> int:
+        """判断结果所需的最高字段成本"""
+        return max((FIELD_COST[field] for field, _, _ in self.conditions), default=0)
+
+    def evaluate(self, fields: Dict, max_cost: int = 2) -> bool:
+        """
+        只检查成本不超过max_cost的条件。返回False表示该issue一定无法通过，
+        返回True表示目前已知的字段都满足（更高成本的条件尚未判断）。
+        """
+        for field, op, value in self.conditions:
+            if FIELD_COST[field] > max_cost:
+                break
+            if not OPERATORS[op](fields.get(field), value):
+                return False
+        return True
+
+    def __call__(self, record: Dict) -> bool:
+        return self.evaluate(record)
+
+    def api_state(self) -> Optional[str]:
+        """能下推到issue列表接口的state参数：条件要求已关闭时返回'closed'"""
+        for field, op, value in self.conditions:
+            if field == 'state' and op == '==':
+                return value
+            if field == 'state_reason' and op == '==' and value in CLOSED_STATE_REASONS:
+                return 'closed'
+            if field == 'state_reason' and op == 'in' and set(value) <= CLOSED_STATE_REASONS:
+                return 'closed'
+        return None
+
+    def filter_dataframe(self, df):
+        """对pandas DataFrame应用同样的条件，返回筛选后的DataFrame"""
+        mask = None
+        for field, op, value in self.conditions:
+            column = df[field]
+            condition = column.isin(value) if op == 'in' else OPERATORS[op](column, value)
+            mask = condition if mask is None else mask & condition
+        return df if mask is None else df[mask]
+
+    def __repr__(self):
+        return ' and '.join(f"{field} {op} {value!r}" for field, op, value in self.conditions)
+
+
+# filter_completed_with_images.py 使用的筛选条件
+COMPLETED_WITH_IMAGES = IssuePredicate([
+    ('state_reason', '==', 'completed'),
+    ('body_image_count', '>', 0)
+])
@@ -0,0 +1,119 @@
+"""
+按issue追加写入的处理日志（JSONL），用于网络请求密集的脚本断点续跑
+
+add_pr.py、add_commit.py、add_code.py、add_groundtruth.py 以前把所有结果放在列表里，
+处理完最后一个issue才 json.dump 一次，中途出错或 Ctrl-C 之前的API请求全部白费。
+现在每处理完一个issue就向 <输出文件>.journal.jsonl 追加一行：
+
+    {"key": "1234", "input": "<输入条目的sha1>", "record": {...} 或 null}
+
+record为null表示该issue处理过但没有结果（如没找到关联PR），续跑时同样跳过；
+请求失败的issue记录时带 "retry": true，结果照常输出，但续跑时会重新处理。
+重新运行时，key和输入条目哈希都与日志一致的issue直接使用日志中的结果；输入文件中该issue
+被人工修改过时哈希不同，会重新处理。全部处理完后 compact() 按输入顺序生成最终的JSON文件并删除日志：
+日志只用于续跑被中断的运行，完整运行之后（如修改代码后或 --force 重新运行）所有issue都会重新处理。
+"""
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+def item_hash(item: Any) -> str:
+    """输入条目的哈希，条目内容变化后日志中的结果不再使用"""
+    return hashlib.sha1(json.dumps(item, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class IssueJournal:
+    """以issue编号为键的追加写入日志，journal_path默认为 <output_path>.journal.jsonl"""
+
+    def __init__(self, output_path: str, journal_path: Optional[str] = None):
+        self.output_path = output_path
+        self.path = journal_path or output_path + '.journal.jsonl'
+        self._entries: Dict[str, Tuple[Optional[str], Any]] = {}  # key -> (输入哈希, 结果)，需要重试时哈希为None
+        self._load()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        # 进程在写一行的中途被中断时丢弃不完整的最后一行，否则下一条记录会接在它后面
+        complete = data[:data.rfind(b'\n') + 1]
+        if len(complete) != len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(len(complete))
+        for line in complete.decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            digest = None if entry.get('retry') else entry.get('input')
+            self._entries[entry['key']] = (digest, entry.get('record'))
+        if self._entries:
+            print(f"从日志 {self.path} 恢复了 {len(self._entries)} 个已处理的issue")
+
+    def done(self, key, item: Any = None) -> bool:
+        """该issue是否已处理过；给出item时还要求输入条目与处理时相同"""
+        entry = self._entries.get(str(key))
+        if entry is None or entry[0] is None:
+            return False
+        return item is None or entry[0] == item_hash(item)
+
+    def get(self, key) -> Any:
+        """已处理issue的结果（没有结果时为None）"""
+        entry = self._entries.get(str(key))
+        return entry[1] if entry else None
+
+    def append(self, key, item: Any, record: Any, complete: bool = True):
+        """记录一个处理完的issue，立即写入磁盘；complete=False表示请求失败，续跑时重新处理"""
+        key = str(key)
+        digest = item_hash(item)
+        entry = {'key': key, 'input': digest, 'record': record}
+        if not complete:
+            entry['retry'] = True
+        self._entries[key] = (digest if complete else None, record)
+        self._file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._file.flush()
+
+    def records(self, keys: Optional[Iterable] = None) -> List[Any]:
+        """按keys的顺序（默认按写入顺序）返回非空结果"""
+        keys = self._entries.keys() if keys is None else [str(k) for k in keys]
+        results = []
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None:
+                results.append(entry[1])
+        return results
+
+    def compact(self, keys: Optional[Iterable] = None, write_empty: bool = True) -> List[Any]:
+        """
+        把日志中的结果合并成最终的JSON数组写入output_path（先写临时文件再替换），返回结果列表。
+        keys: 输入中issue的顺序，只输出这些issue；write_empty=False时没有结果不生成文件。
+        输出写入成功后删除日志，写入失败时保留日志供下次续跑。
+        """
+        results = self.records(keys)
+        if results or write_empty:
+            tmp_path = self.output_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.output_path)
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._entries.clear()
+        return results
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
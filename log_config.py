@@ -3,8 +3,8 @@ import logging
 from datetime import datetime
 import colorlog
 
-# 设置日志保存路径
-log_path = os.path.join(os.getcwd(), 'logs')
+# 设置日志保存路径（pipeline.py并行处理多个仓库时通过VFLOC_LOG_DIR为每个仓库指定单独的目录）
+log_path = os.getenv("VFLOC_LOG_DIR") or os.path.join(os.getcwd(), 'logs')
 if not os.path.exists(log_path):
     os.makedirs(log_path)
 
@@ -0,0 +1,335 @@
+"""
+数据集构建流水线
+
+把 crawl → filter → link → code → groundtruth → executor 这条原来靠人按 codebook_manual_screening.md
+依次手动运行的脚本链声明为带输入输出文件的阶段。每个阶段记录运行时输入文件和脚本代码的sha256，
+再次运行时只执行输入或代码变化过、或输出缺失的阶段；上游重新运行后输出没变，下游也不会重新运行。
+
+人工检查得到的 *_checked.json / *_checked_again.json / *_filtered.json 不由任何阶段生成，
+作为源文件参与哈希：修改其中一个文件后重新运行，只会执行它下游的阶段；文件还不存在时，
+依赖它的阶段会停下来提示需要人工处理。
+
+各脚本以子进程运行，工作目录为脚本所在目录（与手动运行时一致），仓库和输入输出路径通过环境变量
+VFLOC_REPO / VFLOC_GITHUB_REPO / VFLOC_INPUT / VFLOC_OUTPUT 传入。
+
+指定多个仓库（或不指定，即全部13个仓库）时用进程池并行处理，每个仓库一个工作进程：
+脚本的输出写入 issue_results/{仓库}/logs/pipeline_{日期}.log，log_config 的日志也写到该目录；
+所有进程通过 VFLOC_TOKEN_STATE 指向的SQLite文件共享GitHub token额度。
+
+用法：
+    python pipeline.py florisboard               # 只运行过期的阶段
+    python pipeline.py florisboard --dry-run     # 只显示将要运行的阶段
+    python pipeline.py florisboard --force link  # 强制重新运行某个阶段（及其受影响的下游）
+    python pipeline.py                           # 并行处理所有仓库
+    python pipeline.py bruno uno --only link     # 只对指定仓库运行某个阶段
+    python pipeline.py --jobs 4                  # 限制并行进程数
+"""
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, TextIO
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RESULTS_ROOT = os.path.join(ROOT, 'issue_results')
+OPERATION_ROOT = os.path.join(ROOT, 'operation')
+# 多个工作进程共享的token额度文件
+TOKEN_STATE_PATH = os.path.join(RESULTS_ROOT, 'cache', 'token_budget.sqlite3')
+
+# 目录名 -> (文件名前缀, GitHub仓库全名)
+REPOSITORIES = {
+    'All-Hands-AI': ('All-Hands-AI', 'All-Hands-AI/OpenHands'),
+    'ant-design': ('ant-design', 'ant-design/ant-design'),
+    'AntennaPod': ('AntennaPod', 'AntennaPod/AntennaPod'),
+    'AppFlowy': ('AppFlowy', 'AppFlowy-IO/AppFlowy'),
+    'bruno': ('bruno', 'usebruno/bruno'),
+    'cgeo': ('cgeo', 'cgeo/cgeo'),
+    'ComfyUI': ('ComfyUI', 'Comfy-Org/ComfyUI_frontend'),
+    'files': ('files', 'files-community/Files'),
+    'florisboard': ('florisboard', 'florisboard/florisboard'),
+    'notepad': ('notepad-plus-plus', 'notepad-plus-plus/notepad-plus-plus'),
+    'TeamNewPipe_NewPipe': ('TeamNewPipe_NewPipe', 'TeamNewPipe/NewPipe'),
+    'thunderbird': ('thunderbird', 'thunderbird/thunderbird-android'),
+    'uno': ('uno', 'unoplatform/uno')
+}
+
+
+class Stage:
+    """流水线中的一个阶段：运行script，读取inputs[0]（VFLOC_INPUT），生成outputs[0]（VFLOC_OUTPUT）"""
+
+    def __init__(self, name: str, script: str, inputs: List[str], outputs: List[str],
+                 code: List[str] = (), env: Optional[Dict[str, str]] = None):
+        self.name = name
+        self.script = script
+        self.inputs = inputs
+        self.outputs = outputs
+        self.code = [script] + list(code)  # 脚本及其依赖的公共模块，改动后阶段视为过期
+        self.env = env or {}
+
+
+def build_stages(folder: str) -> List[Stage]:
+    """按执行顺序返回某个仓库的所有阶段"""
+    if folder not in REPOSITORIES:
+        raise ValueError(f"未知的仓库: {folder}，可选: {', '.join(REPOSITORIES)}")
+    name, full_name = REPOSITORIES[folder]
+    base = os.path.join(RESULTS_ROOT, folder)
+    inter = os.path.join(base, 'intermediates')
+
+    analysis = os.path.join(inter, f'{name}_issues_with_analysis.xlsx')
+    completed = os.path.join(inter, f'{name}_completed_with_images.json')
+    closing_pr = os.path.join(inter, f'{name}_issues_with_closing_pr.json')
+    closing_pr_checked = os.path.join(base, f'{name}_issues_with_closing_pr_checked.json')  # 人工检查
+    with_code = os.path.join(inter, f'{name}_issues_with_code.json')
+    with_code_processed = os.path.join(inter, f'{name}_issues_with_code_processed.json')
+    checked_again = os.path.join(base, f'{name}_issues_with_code_checked_again.json')  # 人工检查
+    updated = os.path.join(base, f'{name}_issues_with_code_updated.json')
+    filtered = os.path.join(base, f'{name}_issues_with_code_filtered.json')  # 人工筛选（可选）
+
+    # 有人工筛选后的文件时执行器使用它，否则直接使用ground truth阶段的输出
+    executor_inputs = [filtered, updated] if os.path.exists(filtered) else [updated]
+
+    return [
+        Stage('crawl', 'clawer/issue.py', [], [analysis],
+              code=['clawer/crawl_store.py', 'image_scanner.py', 'issue_predicate.py', 'token_pool.py'],
+              env={'VFLOC_GITHUB_REPO': full_name}),
+        Stage('filter', 'filter/filter_completed_with_images.py', [analysis], [completed],
+              code=['issue_predicate.py']),
+        Stage('link', 'filter/add_pr.py', [completed], [closing_pr],
+              code=['token_pool.py', 'journal.py', 'graphql_batch.py']),
+        Stage('code', 'filter/add_code.py', [closing_pr_checked], [with_code], code=['token_pool.py', 'journal.py']),
+        Stage('process', 'filter/process_code_json.py', [with_code], [with_code_processed]),
+        Stage('groundtruth', 'clawer/add_groundtruth.py', [checked_again], [updated],
+              code=['clawer/git_groundtruth.py', 'git_mirror.py', 'git_batch.py', 'commit_store.py', 'token_pool.py',
+                    'journal.py']),
+        Stage('executor', 'executor/generate_operation_folders.py', executor_inputs,
+              [os.path.join(OPERATION_ROOT, folder)],
+              code=['executor/image_downloader.py', 'executor/image_store.py', 'executor/normalize_images.py',
+                    'image_scanner.py', 'git_mirror.py', 'git_batch.py', 'commit_store.py', 'token_pool.py'])
+    ]
+
+
+class PipelineState:
+    """记录每个阶段上次成功运行时的输入哈希和代码哈希，文件哈希按 (大小, 修改时间) 缓存"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.data = {'files': {}, 'stages': {}}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+
+    def file_hash(self, path: str) -> Optional[str]:
+        """文件的sha256，不存在返回None，目录只判断是否存在"""
+        if not os.path.exists(path):
+            return None
+        if os.path.isdir(path):
+            return 'dir'
+        stat = os.stat(path)
+        cached = self.data['files'].get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        self.data['files'][path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def fingerprint(self, stage: Stage) -> Dict:
+        code = hashlib.sha256()
+        for path in stage.code:
+            code.update((self.file_hash(os.path.join(ROOT, path)) or '').encode())
+        return {
+            'inputs': {path: self.file_hash(path) for path in stage.inputs},
+            'code': code.hexdigest()
+        }
+
+    def record(self, stage: Stage):
+        self.data['stages'][stage.name] = self.fingerprint(stage)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=2)
+
+
+def stale_reason(stage: Stage, state: PipelineState, forced: bool) -> Optional[str]:
+    """阶段需要运行的原因，最新时返回None"""
+    if forced:
+        return '强制运行'
+    missing = [path for path in stage.outputs if not os.path.exists(path)]
+    if missing:
+        return f"输出不存在: {os.path.relpath(missing[0], ROOT)}"
+    previous = state.data['stages'].get(stage.name)
+    if previous is None:
+        # 引入流水线之前已经生成的输出，直接记录为最新
+        state.record(stage)
+        return None
+    if previous.get('failed'):
+        return '上次运行失败'
+    current = state.fingerprint(stage)
+    if current['code'] != previous['code']:
+        return '脚本代码已修改'
+    changed = [path for path, digest in current['inputs'].items() if previous['inputs'].get(path) != digest]
+    if changed:
+        return f"输入已变化: {os.path.relpath(changed[0], ROOT)}"
+    return None
+
+
+def run_stage(stage: Stage, folder: str, log: Optional[TextIO] = None) -> bool:
+    """以子进程运行阶段脚本，成功且输出都已生成时返回True；指定log时脚本输出写入该文件"""
+    script_path = os.path.join(ROOT, stage.script)
+    script_dir = os.path.dirname(script_path)
+    for path in stage.outputs:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    env = dict(os.environ)
+    env.update(stage.env)
+    env['VFLOC_REPO'] = folder
+    if stage.inputs:
+        env['VFLOC_INPUT'] = stage.inputs[0]
+    env['VFLOC_OUTPUT'] = stage.outputs[0]
+    env['PYTHONPATH'] = os.pathsep.join(p for p in [ROOT, script_dir, env.get('PYTHONPATH')] if p)
+
+    if log is not None:
+        env['VFLOC_LOG_DIR'] = os.path.dirname(log.name)
+        log.write(f"\n===== {datetime.now():%Y-%m-%d %H:%M:%S} {stage.name}: {stage.script} =====\n")
+        log.flush()
+    result = subprocess.run([sys.executable, script_path], cwd=script_dir, env=env,
+                            stdout=log, stderr=subprocess.STDOUT if log is not None else None)
+    if result.returncode != 0:
+        print(f"[{stage.name}] 脚本退出码 {result.returncode}")
+        return False
+    # 部分脚本出错时只打印信息并正常退出，以输出文件是否生成判断成功
+    missing = [path for path in stage.outputs if not os.path.exists(path)]
+    if missing:
+        print(f"[{stage.name}] 运行结束但没有生成输出: {os.path.relpath(missing[0], ROOT)}")
+        return False
+    return True
+
+
+def run_pipeline(folder: str, force: List[str] = (), dry_run: bool = False,
+                 only: Optional[List[str]] = None, log: Optional[TextIO] = None) -> bool:
+    """
+    运行一个仓库的流水线，有阶段运行失败时返回False（等待人工处理不算失败）。
+    only: 只考虑这些阶段，其余阶段的输出按现状作为输入使用
+    """
+    stages = build_stages(folder)
+    names = {stage.name for stage in stages}
+    unknown = (set(force) | set(only or ())) - names
+    if unknown:
+        raise ValueError(f"未知的阶段: {', '.join(sorted(unknown))}")
+    skipped_outputs = set()  # --only 未选中的阶段的输出，按现状作为输入
+    if only:
+        skipped_outputs = {path for stage in stages if stage.name not in only for path in stage.outputs}
+        stages = [stage for stage in stages if stage.name in only]
+
+    state = PipelineState(os.path.join(RESULTS_ROOT, folder, '.pipeline_state.json'))
+    produced_by = {path: stage.name for stage in stages for path in stage.outputs}
+    pending = set()  # 本次已经（或在dry-run中将要）运行、输出可能变化的阶段
+    blocked = set()  # 缺少人工处理的源文件或上游失败的阶段
+    ok = True
+
+    for stage in stages:
+        upstream = {produced_by[path] for path in stage.inputs if path in produced_by}
+        if upstream & blocked:
+            blocked.add(stage.name)
+            print(f"[{stage.name}] 跳过：上游阶段未完成")
+            continue
+        sources_missing = [path for path in stage.inputs if path not in produced_by and not os.path.exists(path)]
+        if sources_missing:
+            blocked.add(stage.name)
+            waiting = '上游阶段的输出' if sources_missing[0] in skipped_outputs else '等待人工处理：'
+            print(f"[{stage.name}] {waiting}{os.path.relpath(sources_missing[0], ROOT)} 尚不存在")
+            continue
+
+        if dry_run and upstream & pending:
+            reason = '上游阶段将重新运行'
+        else:
+            reason = stale_reason(stage, state, stage.name in force)
+        if reason is None:
+            print(f"[{stage.name}] 已是最新")
+            continue
+
+        print(f"[{stage.name}] 需要运行（{reason}）: {stage.script}")
+        pending.add(stage.name)
+        if dry_run:
+            continue
+        if run_stage(stage, folder, log):
+            state.record(stage)
+            state.save()
+        else:
+            # 失败时可能留下不完整的输出，标记后下次一定重新运行
+            state.data['stages'][stage.name] = {'failed': True}
+            state.save()
+            blocked.add(stage.name)
+            ok = False
+
+    state.save()
+    return ok
+
+
+def _run_worker(folder: str, force: List[str], dry_run: bool, only: Optional[List[str]]) -> bool:
+    """工作进程：运行一个仓库的流水线，所有输出写入该仓库自己的日志文件"""
+    log_dir = os.path.join(RESULTS_ROOT, folder, 'logs')
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"pipeline_{datetime.now():%Y-%m-%d}.log")
+    with open(log_path, 'a', encoding='utf-8') as log:
+        stdout, sys.stdout = sys.stdout, log
+        try:
+            return run_pipeline(folder, force=force, dry_run=dry_run, only=only, log=log)
+        except Exception as e:
+            print(f"流水线出错: {e}")
+            return False
+        finally:
+            sys.stdout = stdout
+
+
+def run_many(folders: List[str], force: List[str] = (), dry_run: bool = False,
+             only: Optional[List[str]] = None, jobs: Optional[int] = None) -> Dict[str, bool]:
+    """用进程池并行运行多个仓库的流水线，返回 {仓库: 是否成功}"""
+    # 子进程及其脚本继承环境变量，所有仓库共享同一份token额度
+    os.environ.setdefault('VFLOC_TOKEN_STATE', TOKEN_STATE_PATH)
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(folders)))
+    print(f"使用 {jobs} 个进程处理 {len(folders)} 个仓库，日志见 issue_results/<仓库>/logs/")
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {folder: pool.submit(_run_worker, folder, list(force), dry_run, only) for folder in folders}
+        for folder, future in futures.items():
+            results[folder] = future.result()
+            print(f"  {folder}: {'完成' if results[folder] else '失败'}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按需运行数据集构建流水线")
+    parser.add_argument('repos', nargs='*', metavar='repo',
+                        help=f"仓库目录名（folder_to_name中的键），默认全部: {', '.join(sorted(REPOSITORIES))}")
+    parser.add_argument('--force', nargs='+', default=[], metavar='STAGE', help="强制重新运行的阶段")
+    parser.add_argument('--only', nargs='+', default=None, metavar='STAGE', help="只运行这些阶段")
+    parser.add_argument('--dry-run', action='store_true', help="只显示需要运行的阶段")
+    parser.add_argument('--jobs', '-j', type=int, default=None, help="并行进程数，默认为CPU核数")
+    args = parser.parse_args()
+
+    folders = args.repos or list(REPOSITORIES)
+    unknown = [folder for folder in folders if folder not in REPOSITORIES]
+    if unknown:
+        parser.error(f"未知的仓库: {', '.join(unknown)}，可选: {', '.join(sorted(REPOSITORIES))}")
+
+    if len(folders) == 1:
+        ok = run_pipeline(folders[0], force=args.force, dry_run=args.dry_run, only=args.only)
+    else:
+        results = run_many(folders, force=args.force, dry_run=args.dry_run, only=args.only, jobs=args.jobs)
+        failed = [folder for folder, success in results.items() if not success]
+        print(f"完成 {len(results) - len(failed)}/{len(results)} 个仓库" + (f"，失败: {', '.join(failed)}" if failed else ""))
+        ok = not failed
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+多个GitHub token组成的令牌池
+
+各脚本原来只读取一个 MY_GITHUB_TOKEN，遇到速率限制就阻塞等待重置。这里从
+MY_GITHUB_TOKENS（逗号分隔，未设置时回退到 MY_GITHUB_TOKEN）读取多个token，
+按响应头 X-RateLimit-Resource / X-RateLimit-Remaining / X-RateLimit-Reset 记录每个token
+在每类资源（core、search、graphql）上的剩余额度，每次请求交给剩余额度最多的token，
+只有所有token在该资源上都耗尽时才等待最早的重置时间。
+设置 VFLOC_TOKEN_STATE 后额度记录在SQLite文件中，多个进程共用同一份额度。
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+
+from http_cassette import CASSETTE_MODE, install_cassette, is_graphql_rate_limited
+
+load_dotenv()
+
+API_ROOT = "https://api.github.com"
+
+# 设置后各进程通过该SQLite文件共享token额度（pipeline.py并行处理多个仓库时设置）
+BUDGET_PATH = os.getenv("VFLOC_TOKEN_STATE")
+
+# 未收到响应头之前假定的额度，只用于token之间排序
+DEFAULT_LIMITS = {
+    'core': 5000,
+    'search': 30,
+    'graphql': 5000
+}
+
+
+def load_tokens() -> List[str]:
+    """从环境变量读取token列表（去重并保持顺序）"""
+    tokens = os.getenv("MY_GITHUB_TOKENS") or os.getenv("MY_GITHUB_TOKEN") or ""
+    return list(dict.fromkeys(t.strip() for t in tokens.split(',') if t.strip()))
+
+
+def resource_for_url(url: str) -> str:
+    """根据请求地址判断所属的速率限制资源"""
+    if url.rstrip('/').endswith('/graphql'):
+        return 'graphql'
+    if '/search/' in url:
+        return 'search'
+    return 'core'
+
+
+def _is_rate_limited(response: requests.Response) -> bool:
+    """判断响应是否为速率限制（包括二级限制和GraphQL以HTTP 200返回的 RATE_LIMITED）"""
+    if response.status_code == 200:
+        return is_graphql_rate_limited(response.status_code, response.content)
+    if response.status_code not in (403, 429):
+        return False
+    if response.headers.get('X-RateLimit-Remaining') == '0' or 'Retry-After' in response.headers:
+        return True
+    try:
+        return 'rate limit' in response.text.lower()
+    except Exception:
+        return False
+
+
+class MemoryBudget:
+    """进程内的额度表 {(token, resource): (remaining, reset时间戳)}"""
+
+    def __init__(self):
+        self._data: Dict[Tuple[str, str], Tuple[Optional[int], float]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self
+
+    def get(self, token: str, resource: str) -> Tuple[Optional[int], float]:
+        return self._data.get((token, resource), (None, 0))
+
+    def set(self, token: str, resource: str, remaining: int, reset: float):
+        self._data[(token, resource)] = (remaining, reset)
+
+
+class SqliteBudget:
+    """
+    多个进程共享的额度表，保存在SQLite文件中（只保存token的哈希）。
+    pipeline.py 多仓库并行时各进程共用同一份额度，不会各自以为还有额度而同时耗尽同一个token。
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS budget ("
+            "token_hash TEXT, resource TEXT, remaining INTEGER, reset REAL, PRIMARY KEY (token_hash, resource))"
+        )
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE 取得写锁，选token和扣减额度在所有进程间是原子的
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def get(self, token: str, resource: str) -> Tuple[Optional[int], float]:
+        row = self._conn.execute("SELECT remaining, reset FROM budget WHERE token_hash = ? AND resource = ?",
+                                 (self._key(token), resource)).fetchone()
+        return (row[0], row[1]) if row else (None, 0)
+
+    def set(self, token: str, resource: str, remaining: int, reset: float):
+        self._conn.execute("INSERT OR REPLACE INTO budget VALUES (?, ?, ?, ?)",
+                           (self._key(token), resource, remaining, reset))
+
+
+class TokenPool:
+    """按资源记录每个token额度的令牌池，线程安全；设置budget_path时额度在多个进程间共享"""
+
+    def __init__(self, tokens: Optional[List[str]] = None, pool_maxsize: int = 16,
+                 budget_path: Optional[str] = BUDGET_PATH):
+        self.tokens = list(tokens) if tokens is not None else load_tokens()
+        if not self.tokens and CASSETTE_MODE == 'replay':
+            self.tokens = ['replay']  # 回放时不访问网络，不需要真实token
+        if not self.tokens:
+            raise ValueError("未设置GitHub token，请在 .env 中设置 MY_GITHUB_TOKENS 或 MY_GITHUB_TOKEN")
+        self._budget = SqliteBudget(budget_path) if budget_path else MemoryBudget()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # GITHUB_CASSETTE_MODE=record/replay 时录制或回放所有请求
+        self.cassette = install_cassette(self.session)
+
+    def _remaining(self, token: str, resource: str, now: float) -> int:
+        remaining, reset = self._budget.get(token, resource)
+        if remaining is None or reset <= now:
+            # 没有记录或已过重置时间，按默认额度计算
+            return DEFAULT_LIMITS.get(resource, DEFAULT_LIMITS['core'])
+        return remaining
+
+    def acquire(self, resource: str = 'core') -> str:
+        """返回该资源上剩余额度最多的token；所有token都耗尽时等待最早的重置"""
+        while True:
+            with self._budget.transaction():
+                now = time.time()
+                token = max(self.tokens, key=lambda t: self._remaining(t, resource, now))
+                remaining = self._remaining(token, resource, now)
+                if remaining > 0:
+                    # 预先扣减，多个线程（进程）同时请求时不会都挑中同一个token
+                    _, reset = self._budget.get(token, resource)
+                    if reset <= now:
+                        reset = now + 3600  # 额度窗口为一小时，收到响应头后会被覆盖
+                    self._budget.set(token, resource, remaining - 1, reset)
+                    return token
+                wait_until = min(self._budget.get(t, resource)[1] for t in self.tokens)
+            sleep_time = max(0, wait_until - time.time()) + 1
+            print(f"所有token的 {resource} 额度均已耗尽，等待 {sleep_time:.0f} 秒后继续...")
+            time.sleep(sleep_time)
+
+    def update(self, token: str, response: requests.Response, resource: str = 'core'):
+        """根据响应头更新token额度"""
+        self.update_from_headers(token, response.headers, _is_rate_limited(response), resource)
+
+    def update_from_headers(self, token: str, headers, rate_limited: bool, resource: str = 'core'):
+        """根据响应头更新token额度，供aiohttp等非requests的响应使用；rate_limited为该响应是否为速率限制"""
+        if self.cassette is not None and self.cassette.mode == 'replay':
+            return  # 回放的额度信息已过时，不参与调度
+        resource = headers.get('X-RateLimit-Resource', resource)
+        remaining = headers.get('X-RateLimit-Remaining')
+        reset = headers.get('X-RateLimit-Reset')
+        if rate_limited:
+            retry_after = headers.get('Retry-After')
+            if retry_after is not None:
+                reset_time = time.time() + int(retry_after)
+            elif reset is not None:
+                reset_time = int(reset)
+            else:
+                reset_time = time.time() + 60
+            self.mark_exhausted(token, resource, reset_time)
+        elif remaining is not None and reset is not None:
+            with self._budget.transaction():
+                self._budget.set(token, resource, int(remaining), int(reset))
+
+    def mark_exhausted(self, token: str, resource: str, reset_time: float):
+        """标记token在某资源上额度耗尽，直到reset_time"""
+        with self._budget.transaction():
+            self._budget.set(token, resource, 0, reset_time)
+
+    def remaining(self, resource: str = 'core') -> int:
+        """所有token在该资源上的剩余额度之和"""
+        with self._budget.transaction():
+            now = time.time()
+            return sum(self._remaining(t, resource, now) for t in self.tokens)
+
+    def request(self, method: str, url: str, resource: Optional[str] = None, auth_scheme: str = 'Bearer',
+                **kwargs) -> requests.Response:
+        """
+        用剩余额度最多的token发送请求，遇到速率限制时换下一个token重试。
+        其他错误（网络异常、4xx/5xx）原样交给调用方处理。
+        """
+        if url.startswith('/'):
+            url = API_ROOT + url
+        resource = resource or resource_for_url(url)
+        headers = dict(kwargs.pop('headers', None) or {})
+        kwargs.setdefault('timeout', 30)
+        while True:
+            token = self.acquire(resource)
+            headers['Authorization'] = f"{auth_scheme} {token}"
+            response = self.session.request(method, url, headers=headers, **kwargs)
+            self.update(token, response, resource)
+            if not _is_rate_limited(response):
+                return response
+            print(f"token ...{token[-4:]} 的 {resource} 额度已耗尽，切换到其他token")
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+
+_POOL = None
+
+
+def get_token_pool() -> TokenPool:
+    """返回进程内共享的令牌池"""
+    global _POOL
+    if _POOL is None:
+        _POOL = TokenPool()
+    return _POOL